@@ -2,18 +2,23 @@
 Main application file for Clinical Notes Recording System
 """
 import streamlit as st
-from utils import create_directories
-from auth import initialize_session_state, render_login_page, check_authentication, get_current_username
-from data_handler import load_data, get_doctor_notes, get_note_by_id
-from text_formatter import format_clinical_text, split_content_dynamically
-from ui_components import (
-    render_note_selector,
-    render_audio_recorder,
-    render_save_audio_button,
-    render_content_cards,
-    render_additional_notes
+import metrics
+from auth import (
+    initialize_session_state,
+    render_login_page,
+    check_authentication,
+    get_current_username,
+    is_admin
 )
 from styles import MAIN_STYLES
+from warmup import start_background_warmup
+
+
+def get_session_id() -> str:
+    """Get the Streamlit session ID of the current script run"""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else ""
 
 
 def main():
@@ -23,51 +28,106 @@ def main():
         page_title="Clinical Notes",
         page_icon="🩺"
     )
-    
-    st.markdown(MAIN_STYLES, unsafe_allow_html=True)
-    
-    create_directories()
+
+    with metrics.rerun(
+        session_id=get_session_id() if metrics.ENABLED else "",
+        profile=metrics.ENABLED and st.query_params.get("profile") == "1"
+    ):
+        render_app()
+
+
+def render_app():
+    """Render the page for the current session"""
+    with metrics.span("css_injection"):
+        st.markdown(MAIN_STYLES, unsafe_allow_html=True)
+
     initialize_session_state()
-    
+
     if not check_authentication():
-        render_login_page()
+        with metrics.span("render.login_page"):
+            render_login_page()
+        start_background_warmup()
         return
-    
-    df = load_data()
+
+    # Heavy dependencies (pandas, requests) are only needed after login
+    from utils import create_directories
+    from data_handler import load_data, get_doctor_notes, get_note_by_id, get_note_index
+    from config import PREFETCH_NOTES
+    from render_cache import render_note_stream, prefetch
+    from ui_components import (
+        render_note_selector,
+        render_audio_recorder,
+        render_save_audio_button,
+        render_content_cards,
+        render_additional_notes,
+        render_validation_mode,
+        remember_note_version,
+        render_take_history
+    )
+
+    create_directories()
+
     username = get_current_username()
-    
-    doctor_notes = get_doctor_notes(df, username)
-    
-    if doctor_notes.empty:
+
+    # The dashboard reads the materialized summary, not the dataset
+    if is_admin(username) and st.toggle("📊 Progress dashboard", key="admin_dashboard"):
+        from ui_components import render_admin_dashboard
+        render_admin_dashboard()
+        return
+
+    with metrics.span("load_data"):
+        df = load_data(username)
+
+    if not get_note_index(df).notes_for(username):
         st.info("📋 No notes assigned to your account.")
         return
-    
+
     st.markdown("<br>", unsafe_allow_html=True)
-    
+
+    if st.toggle("✅ Validation mode", key="validation_mode"):
+        with metrics.span("get_doctor_notes"):
+            doctor_notes = get_doctor_notes(df, username)
+        render_validation_mode(doctor_notes, username, df)
+        return
+
     c1, c2, c3 = st.columns([2, 2, 1])
-    
+
     with c1:
-        selected = render_note_selector(doctor_notes, username)
-    
+        selected = render_note_selector(username, df)
+
+    if selected is None:
+        return
+
     with c2:
-        render_audio_recorder()
+        render_audio_recorder(username)
 
     with c3:
         render_save_audio_button(selected, username, df)
-    
-    note = get_note_by_id(doctor_notes, selected)
+
+    note = get_note_by_id(df, selected)
     if note is None:
         st.error("Note not found!")
         return
-    
-    formatted_text = format_clinical_text(note["raw_text"])
-    sections = split_content_dynamically(formatted_text, max_height=500)
-    render_content_cards(sections)
-    
+
+    remember_note_version(selected, int(note["version"]))
+
+    render_content_cards(render_note_stream(selected, note["raw_text"], max_height=500))
+
+    # Doctors work through their list in order: render the next notes ahead
+    note_ids = get_note_index(df).notes_for(username)
+    if selected in note_ids:
+        position = note_ids.index(selected)
+        upcoming = note_ids[position + 1:position + 1 + PREFETCH_NOTES]
+        prefetch(
+            [(note_id, get_note_by_id(df, note_id)["raw_text"]) for note_id in upcoming],
+            max_height=500
+        )
+
     render_additional_notes(selected, username, df)
-    
+    render_take_history(selected)
+
     st.markdown("<br>", unsafe_allow_html=True)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
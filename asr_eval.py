@@ -0,0 +1,364 @@
+"""
+Batch ASR evaluation: WER/CER of transcripts against raw_text
+
+Transcripts come from the dataset's transcript column or from --transcripts
+(CSV or JSONL with note_id and transcript). Word errors are attributed to
+the note section (as recognized by find_section_headers) of the reference
+word they fall on; insertions count towards the preceding word's section.
+
+Edit distances use a row-vectorized NumPy DP: each row's substitution and
+deletion costs are computed at once, and insertions are resolved with a
+running minimum. Distances without an alignment (CER) are computed in a
+diagonal band that widens until the result is exact. Notes are scored in
+parallel processes. Per-note results are cached in --cache keyed by a hash
+of reference and transcript, so re-runs only score new or changed
+transcripts.
+
+Usage:
+    python asr_eval.py --transcripts transcripts.csv --workers 8 --json report.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_PATH
+from text_formatter import SECTION_LABELS, find_section_headers
+
+CACHE_PATH = "asr_eval_cache.jsonl"
+MAX_BACKTRACE_CELLS = 50_000_000  # Larger pairs are scored without a section breakdown
+NO_SECTION = "other"
+
+_TOKEN = re.compile(r"[\w']+(?:-[\w']+)*")
+
+
+def tokenize(text: str) -> List[Tuple[str, int]]:
+    """
+    Normalized words with their character offset in the NFC form of text
+    Lowercased, apostrophes unified and punctuation dropped; accents are kept.
+    Words are lowercased after matching, so offsets are not shifted by
+    characters whose lowercase form is longer.
+    """
+    text = unicodedata.normalize("NFC", text).replace("’", "'")
+    return [(m.group(0).lower(), m.start()) for m in _TOKEN.finditer(text)]
+
+
+def normalize(text: str) -> str:
+    """Normalized words of text joined by single spaces"""
+    return " ".join(word for word, _ in tokenize(text))
+
+
+def _encode(ref: List[str], hyp: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    vocab: Dict[str, int] = {}
+    ref_ids = np.array([vocab.setdefault(t, len(vocab)) for t in ref], dtype=np.int32)
+    hyp_ids = np.array([vocab.setdefault(t, len(vocab)) for t in hyp], dtype=np.int32)
+    return ref_ids, hyp_ids
+
+
+def _next_row(prev: np.ndarray, ref_id, hyp_ids: np.ndarray, i: int) -> np.ndarray:
+    """DP row i from row i-1: substitution/deletion vectorized, insertion by running minimum"""
+    row = np.empty_like(prev)
+    row[0] = i
+    row[1:] = np.minimum(prev[1:] + 1, prev[:-1] + (hyp_ids != ref_id))
+    offsets = np.arange(len(row), dtype=prev.dtype)
+    return np.minimum.accumulate(row - offsets) + offsets
+
+
+def _banded_distance(ref: np.ndarray, hyp: np.ndarray, band: int) -> int:
+    """
+    Edit distance restricted to cells with |i - j| <= band
+    Exact whenever the result is <= band; otherwise an upper bound.
+    """
+    n, m = len(ref), len(hyp)
+    inf = np.int32(n + m + 1)
+    prev = np.full(m + 2, inf, dtype=np.int32)
+    cur = np.full(m + 2, inf, dtype=np.int32)
+    hi = min(m, band)
+    prev[:hi + 1] = np.arange(hi + 1)
+    offsets = np.arange(m + 1, dtype=np.int32)
+    for i in range(1, n + 1):
+        lo, hi = max(0, i - band), min(m, i + band)
+        if lo > hi:
+            return int(inf)  # band narrower than the length difference
+        # prev[hi] may lie just outside the previous band, where it holds inf
+        start = max(lo, 1)
+        cur[start:hi + 1] = np.minimum(
+            prev[start:hi + 1] + 1,
+            prev[start - 1:hi] + (hyp[start - 1:hi] != ref[i - 1]),
+        )
+        if lo == 0:
+            cur[0] = i
+        else:
+            cur[lo - 1] = inf
+        span = cur[lo:hi + 1] - offsets[lo:hi + 1]
+        cur[lo:hi + 1] = np.minimum.accumulate(span) + offsets[lo:hi + 1]
+        cur[hi + 1] = inf
+        prev, cur = cur, prev
+    return int(prev[m])
+
+
+def edit_distance(ref: np.ndarray, hyp: np.ndarray, expected: int = 0) -> int:
+    """
+    Levenshtein distance between two integer sequences
+    Uses a diagonal band that is doubled until the distance fits inside it,
+    so similar sequences cost O(len * distance) instead of O(len^2).
+    expected, an estimate of the distance, sets the starting band.
+    """
+    if not len(ref) or not len(hyp):
+        return max(len(ref), len(hyp))
+    band = abs(len(ref) - len(hyp)) + max(32, int(expected * 1.25))
+    while True:
+        distance = _banded_distance(ref, hyp, band)
+        if distance <= band or band >= max(len(ref), len(hyp)):
+            return distance
+        band *= 2
+
+
+def align(ref: np.ndarray, hyp: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Word-level alignment via full DP matrix and backtrace
+    Returns per-reference-word (substituted, deleted, insertions after) arrays.
+    """
+    n, m = len(ref), len(hyp)
+    dp = np.empty((n + 1, m + 1), dtype=np.int32)
+    dp[0] = np.arange(m + 1)
+    for i in range(1, n + 1):
+        dp[i] = _next_row(dp[i - 1], ref[i - 1], hyp, i)
+
+    substituted = np.zeros(n, dtype=np.int32)
+    deleted = np.zeros(n, dtype=np.int32)
+    inserted = np.zeros(n + 1, dtype=np.int32)  # index 0: before the first word
+    i, j = n, m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and dp[i, j] == dp[i - 1, j - 1] + (ref[i - 1] != hyp[j - 1]):
+            substituted[i - 1] = ref[i - 1] != hyp[j - 1]
+            i, j = i - 1, j - 1
+        elif i > 0 and dp[i, j] == dp[i - 1, j] + 1:
+            deleted[i - 1] = 1
+            i -= 1
+        else:
+            inserted[i] += 1
+            j -= 1
+    # Insertions before the first word are charged to it
+    inserted[1] += inserted[0]
+    return substituted, deleted, inserted[1:]
+
+
+def word_sections(raw_text: str, offsets: Iterable[int]) -> List[str]:
+    """Section key of each word (offsets from tokenize), from the headers found in raw_text"""
+    # Located in the same NFC string as the word offsets
+    headers = find_section_headers(unicodedata.normalize("NFC", raw_text))
+    starts = [start for start, _, _ in headers]
+    keys = [key for _, _, key in headers]
+    positions = np.searchsorted(starts, list(offsets), side="right") - 1
+    return [keys[k] if k >= 0 else NO_SECTION for k in positions.tolist()]
+
+
+def score_note(note_id: str, raw_text: str, transcript: str) -> dict:
+    """WER/CER and per-section word errors for one note"""
+    ref_tokens = tokenize(raw_text)
+    ref_words = [word for word, _ in ref_tokens]
+    hyp_words = normalize(transcript).split()
+    ref_ids, hyp_ids = _encode(ref_words, hyp_words)
+
+    result = {"note_id": note_id, "ref_words": len(ref_words), "hyp_words": len(hyp_words)}
+    if len(ref_ids) * len(hyp_ids) <= MAX_BACKTRACE_CELLS and len(ref_ids) and len(hyp_ids):
+        substituted, deleted, inserted = align(ref_ids, hyp_ids)
+        result.update(
+            substitutions=int(substituted.sum()),
+            deletions=int(deleted.sum()),
+            insertions=int(inserted.sum()),
+        )
+        sections: Dict[str, List[int]] = {}
+        errors = substituted + deleted + inserted
+        for section, error in zip(word_sections(raw_text, [o for _, o in ref_tokens]), errors.tolist()):
+            totals = sections.setdefault(section, [0, 0])
+            totals[0] += 1
+            totals[1] += error
+        result["sections"] = sections
+        result["word_errors"] = int(errors.sum())
+    else:
+        result.update(substitutions=None, deletions=None, insertions=None, sections={})
+        result["word_errors"] = edit_distance(ref_ids, hyp_ids)
+
+    ref_chars = normalize(raw_text)
+    hyp_chars = normalize(transcript)
+    result["ref_chars"] = len(ref_chars)
+    # Character errors scale roughly with word errors, which sets the band
+    expected = result["word_errors"] * len(ref_chars) // max(len(ref_words), 1)
+    result["char_errors"] = edit_distance(
+        np.frombuffer(ref_chars.encode("utf-32-le"), dtype=np.int32),
+        np.frombuffer(hyp_chars.encode("utf-32-le"), dtype=np.int32),
+        expected,
+    )
+    return result
+
+
+def _score_task(task: Tuple[str, str, str, str]) -> dict:
+    note_id, key, raw_text, transcript = task
+    result = score_note(note_id, raw_text, transcript)
+    result["key"] = key
+    return result
+
+
+def pair_key(raw_text: str, transcript: str) -> str:
+    digest = hashlib.sha1()
+    digest.update(raw_text.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(transcript.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_transcripts(path: str) -> Dict[str, str]:
+    """note_id -> transcript from a CSV or JSONL file"""
+    if path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        return {row["note_id"]: row["transcript"] for row in rows}
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return dict(zip(df["note_id"], df["transcript"]))
+
+
+def load_cache(path: str) -> Dict[str, dict]:
+    """Latest cached result per note"""
+    cache: Dict[str, dict] = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    cache[entry["note_id"]] = entry
+    return cache
+
+
+def _rate(errors: int, total: int) -> Optional[float]:
+    return errors / total if total else None
+
+
+def build_report(results: List[dict], worst: int = 10) -> dict:
+    """Corpus-level WER/CER, per-section WER and per-note distribution"""
+    ref_words = sum(r["ref_words"] for r in results)
+    sections: Dict[str, List[int]] = {}
+    for r in results:
+        for section, (words, errors) in r["sections"].items():
+            totals = sections.setdefault(section, [0, 0])
+            totals[0] += words
+            totals[1] += errors
+    aligned = [r for r in results if r["substitutions"] is not None]
+    per_note = np.array([r["word_errors"] / r["ref_words"] for r in results if r["ref_words"]])
+
+    return {
+        "notes": len(results),
+        "ref_words": ref_words,
+        "wer": _rate(sum(r["word_errors"] for r in results), ref_words),
+        "cer": _rate(sum(r["char_errors"] for r in results), sum(r["ref_chars"] for r in results)),
+        "substitutions": sum(r["substitutions"] for r in aligned),
+        "deletions": sum(r["deletions"] for r in aligned),
+        "insertions": sum(r["insertions"] for r in aligned),
+        "note_wer": {
+            "mean": float(per_note.mean()) if len(per_note) else None,
+            "p50": float(np.percentile(per_note, 50)) if len(per_note) else None,
+            "p90": float(np.percentile(per_note, 90)) if len(per_note) else None,
+        },
+        "sections": {
+            section: {"label": SECTION_LABELS.get(section, section), "words": words, "wer": _rate(errors, words)}
+            for section, (words, errors) in sorted(sections.items(), key=lambda kv: -kv[1][0])
+        },
+        "worst": [
+            {"note_id": r["note_id"], "wer": r["word_errors"] / r["ref_words"]}
+            for r in sorted(
+                (r for r in results if r["ref_words"]),
+                key=lambda r: -r["word_errors"] / r["ref_words"],
+            )[:worst]
+        ],
+    }
+
+
+def print_report(report: dict):
+    def pct(value):
+        return "-" if value is None else f"{value:.1%}"
+
+    print(f"notes scored: {report['notes']} ({report['ref_words']} reference words)")
+    print(f"WER {pct(report['wer'])}  CER {pct(report['cer'])}  "
+          f"(S {report['substitutions']}, D {report['deletions']}, I {report['insertions']})")
+    note_wer = report["note_wer"]
+    print(f"per-note WER: mean {pct(note_wer['mean'])}, p50 {pct(note_wer['p50'])}, p90 {pct(note_wer['p90'])}")
+    print()
+    print(f"{'section':<45} {'words':>8} {'WER':>8}")
+    for section in report["sections"].values():
+        print(f"{section['label'][:45]:<45} {section['words']:>8} {pct(section['wer']):>8}")
+    if report["worst"]:
+        print()
+        print("highest WER:")
+        for entry in report["worst"]:
+            print(f"  {entry['note_id']:<40} {pct(entry['wer'])}")
+
+
+def evaluate(data_path: str, transcripts_path: Optional[str], cache_path: str, workers: int) -> dict:
+    import data_handler
+    data_handler.DATA_PATH = data_path
+    df = data_handler.load_data()
+
+    if transcripts_path:
+        transcripts = load_transcripts(transcripts_path)
+    elif "transcript" in df.columns:
+        transcripts = dict(zip(df["note_id"], df["transcript"].fillna("").astype(str)))
+    else:
+        raise SystemExit("No transcripts: pass --transcripts or add a transcript column")
+
+    cache = load_cache(cache_path)
+    results = []
+    tasks = []
+    for note_id, raw_text in zip(df["note_id"], df["raw_text"].fillna("").astype(str)):
+        transcript = transcripts.get(note_id, "")
+        if not transcript.strip():
+            continue
+        key = pair_key(raw_text, transcript)
+        cached = cache.get(note_id)
+        if cached is not None and cached["key"] == key:
+            results.append(cached)
+        else:
+            tasks.append((note_id, key, raw_text, transcript))
+
+    print(f"{len(results)} cached, {len(tasks)} to score")
+    start = time.perf_counter()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool, \
+                open(cache_path, "a", encoding="utf-8") as cache_file:
+            for i, result in enumerate(pool.map(_score_task, tasks, chunksize=8), start=1):
+                cache_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results.append(result)
+                if i % 500 == 0:
+                    print(f"  {i}/{len(tasks)} scored ({i / (time.perf_counter() - start):.1f} notes/s)")
+        elapsed = time.perf_counter() - start
+        print(f"scored {len(tasks)} notes in {elapsed:.1f}s ({len(tasks) / elapsed:.1f} notes/s)")
+    return build_report(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV")
+    parser.add_argument("--transcripts", default=None, help="CSV or JSONL with note_id and transcript")
+    parser.add_argument("--cache", default=CACHE_PATH, help="Per-note results cache (JSONL)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Scoring processes")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    report = evaluate(args.data, args.transcripts, args.cache, args.workers)
+    print()
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
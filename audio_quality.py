@@ -0,0 +1,111 @@
+"""
+Audio quality analysis for recordings, run before upload
+
+Computes duration, RMS and peak level, clipping ratio and speech ratio in a
+single pass over the samples. Long files are read in fixed-size chunks so
+memory stays bounded.
+"""
+import io
+import wave
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from config import (
+    AUDIO_MIN_SECONDS,
+    AUDIO_SILENCE_DBFS,
+    AUDIO_MAX_CLIP_RATIO,
+    AUDIO_MIN_SPEECH_RATIO,
+)
+
+FRAME_MS = 30
+CHUNK_FRAMES = 1000  # analysis frames per read (30 s at 30 ms)
+CLIP_LEVEL = 0.999
+SPEECH_DBFS = -40.0
+
+QUALITY_COLUMNS = {
+    "duration_s": "audio_duration_s",
+    "rms_dbfs": "audio_rms_dbfs",
+    "peak_dbfs": "audio_peak_dbfs",
+    "clip_ratio": "audio_clip_ratio",
+    "speech_ratio": "audio_speech_ratio",
+}
+
+_SCALE = {1: 128.0, 2: 32768.0, 4: 2147483648.0}
+_DTYPE = {1: np.uint8, 2: "<i2", 4: "<i4"}
+
+
+def _dbfs(value: float) -> float:
+    return float(20 * np.log10(value)) if value > 0 else float("-inf")
+
+
+def analyze_audio(data: Union[bytes, str]) -> Optional[Dict[str, float]]:
+    """
+    Analyze PCM WAV bytes, or a WAV file path (read in chunks)
+    Returns None if the input is not a WAV file this module can read.
+    """
+    try:
+        wav = wave.open(io.BytesIO(data) if isinstance(data, bytes) else data, "rb")
+    except (wave.Error, EOFError):
+        return None
+
+    with wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        if width not in _SCALE or not rate:
+            return None
+
+        frame_len = max(1, rate * FRAME_MS // 1000)
+        total = 0
+        sum_squares = 0.0
+        peak = 0.0
+        clipped = 0
+        speech_frames = 0
+        analysis_frames = 0
+        speech_threshold = 10 ** (SPEECH_DBFS / 20)
+
+        while True:
+            raw = wav.readframes(frame_len * CHUNK_FRAMES)
+            if not raw:
+                break
+            samples = np.frombuffer(raw, dtype=_DTYPE[width]).astype(np.float32)
+            if width == 1:
+                samples -= 128
+            samples /= _SCALE[width]
+            if channels > 1:
+                samples = samples[: len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+
+            squares = samples * samples
+            total += len(samples)
+            sum_squares += float(squares.sum())
+            peak = max(peak, float(np.abs(samples).max(initial=0.0)))
+            clipped += int(np.count_nonzero(np.abs(samples) >= CLIP_LEVEL))
+
+            usable = len(squares) // frame_len * frame_len
+            if usable:
+                frame_rms = np.sqrt(squares[:usable].reshape(-1, frame_len).mean(axis=1))
+                speech_frames += int(np.count_nonzero(frame_rms >= speech_threshold))
+                analysis_frames += len(frame_rms)
+
+    return {
+        "duration_s": total / rate,
+        "rms_dbfs": _dbfs((sum_squares / total) ** 0.5) if total else float("-inf"),
+        "peak_dbfs": _dbfs(peak),
+        "clip_ratio": clipped / total if total else 0.0,
+        "speech_ratio": speech_frames / analysis_frames if analysis_frames else 0.0,
+    }
+
+
+def quality_issues(stats: Dict[str, float]) -> List[str]:
+    """Human-readable problems with a recording, empty if it looks usable"""
+    issues = []
+    if stats["duration_s"] < AUDIO_MIN_SECONDS:
+        issues.append(f"Recording is very short ({stats['duration_s']:.1f} s)")
+    if stats["rms_dbfs"] < AUDIO_SILENCE_DBFS:
+        issues.append("Recording is silent or almost silent")
+    if stats["clip_ratio"] > AUDIO_MAX_CLIP_RATIO:
+        issues.append(f"Recording is clipped ({stats['clip_ratio']:.1%} of samples)")
+    if stats["speech_ratio"] < AUDIO_MIN_SPEECH_RATIO:
+        issues.append(f"Little speech detected ({stats['speech_ratio']:.0%} of the recording)")
+    return issues
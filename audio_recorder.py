@@ -1,15 +1,22 @@
 """
 Audio recorder component with pause/resume functionality
 """
+import json
+
 import streamlit.components.v1 as components
 
+from config import CHUNK_INGEST_PORT, CHUNK_INGEST_PUBLIC_URL, RECORDER_CHUNK_MS
+
 
-def audio_recorder_component():
+def audio_recorder_component(token: str, credential: str):
     """
     Custom audio recorder with pause/resume that looks like st.audio_input
-    Returns audio bytes when recording is stopped
+    Chunks are buffered in the browser's IndexedDB and uploaded in the
+    background to the chunk ingest endpoint under recording IDs prefixed
+    with token, authorized by credential; see chunk_ingest for picking up
+    finished recordings.
     """
-    
+
     component_html = """
     <!DOCTYPE html>
     <html>
@@ -110,13 +117,33 @@ def audio_recorder_component():
         </div>
 
         <script>
+            const TOKEN = __TOKEN__;
+            const AUTH = { 'Authorization': 'Bearer ' + __CREDENTIAL__ };
+            // The component is a srcdoc iframe (location is about:srcdoc), so
+            // the default endpoint is derived from the app page's origin
+            function appOrigin() {
+                try {
+                    if (window.parent.location.origin !== 'null') return window.parent.location.origin;
+                } catch (err) { /* cross-origin parent */ }
+                if (document.referrer) return new URL(document.referrer).origin;
+                return (window.location.ancestorOrigins && window.location.ancestorOrigins[0]) || window.location.origin;
+            }
+            const APP_URL = new URL(appOrigin());
+            const INGEST_URL = __INGEST_URL__ || (APP_URL.protocol + '//' + APP_URL.hostname + ':' + __INGEST_PORT__);
+            const CHUNK_MS = __CHUNK_MS__;
+            const MIME_TYPES = { 'audio/webm': 'webm', 'audio/ogg': 'ogg', 'audio/mp4': 'mp4' };
+
             let mediaRecorder;
-            let audioChunks = [];
+            let current = null;
             let startTime;
             let pausedTime = 0;
             let timerInterval;
             let stream;
-            
+            let db;
+            let syncing = false;
+            let retryDelay = 1000;
+            let retryTimer = null;
+
             const mainBtn = document.getElementById('mainBtn');
             const icon = document.getElementById('icon');
             const mainText = document.getElementById('mainText');
@@ -126,7 +153,100 @@ def audio_recorder_component():
             const stopBtn = document.getElementById('stopBtn');
             const timer = document.getElementById('timer');
             const status = document.getElementById('status');
-            
+
+            // Chunks are written to IndexedDB as they are captured, so a dropped
+            // connection or a page reload never loses audio; sync() uploads them
+            // to the ingest endpoint whenever the server is reachable.
+            function openDb() {
+                return new Promise((resolve, reject) => {
+                    const req = indexedDB.open('clinical-recorder', 1);
+                    req.onupgradeneeded = () => {
+                        req.result.createObjectStore('recordings', { keyPath: 'recordingId' });
+                        req.result.createObjectStore('chunks', { keyPath: ['recordingId', 'seq'] });
+                    };
+                    req.onsuccess = () => resolve(req.result);
+                    req.onerror = () => reject(req.error);
+                });
+            }
+
+            function request(storeName, mode, fn) {
+                return new Promise((resolve, reject) => {
+                    const tx = db.transaction(storeName, mode);
+                    const req = fn(tx.objectStore(storeName));
+                    tx.oncomplete = () => resolve(req ? req.result : undefined);
+                    tx.onerror = () => reject(tx.error);
+                });
+            }
+
+            function chunkRange(recordingId) {
+                return IDBKeyRange.bound([recordingId, 0], [recordingId, Infinity]);
+            }
+
+            async function dropRecording(recordingId) {
+                await request('chunks', 'readwrite', store => store.delete(chunkRange(recordingId)));
+                await request('recordings', 'readwrite', store => store.delete(recordingId));
+            }
+
+            function setStatus(text) {
+                if (!mediaRecorder || mediaRecorder.state === 'inactive') status.textContent = text;
+            }
+
+            function scheduleRetry() {
+                clearTimeout(retryTimer);
+                retryTimer = setTimeout(sync, retryDelay);
+                retryDelay = Math.min(retryDelay * 2, 30000);
+            }
+
+            async function syncRecording(rec) {
+                const base = INGEST_URL + '/recordings/' + rec.recordingId;
+                const resp = await fetch(base, { headers: AUTH });
+                if (resp.status === 410) return dropRecording(rec.recordingId);
+                if (!resp.ok) throw new Error('HTTP ' + resp.status);
+                const received = new Set((await resp.json()).received);
+
+                const keys = await request('chunks', 'readonly', store => store.getAllKeys(chunkRange(rec.recordingId)));
+                for (const [recordingId, seq] of keys) {
+                    if (received.has(seq)) continue;
+                    const chunk = await request('chunks', 'readonly', store => store.get([recordingId, seq]));
+                    const put = await fetch(base + '/chunks/' + seq + '?recorded=' + rec.recorded, { method: 'PUT', headers: AUTH, body: chunk.blob });
+                    if (put.status === 410) return dropRecording(rec.recordingId);
+                    if (!put.ok) throw new Error('HTTP ' + put.status);
+                    received.add(seq);
+                    setStatus('Syncing… ' + received.size + '/' + rec.recorded + ' chunks');
+                }
+
+                if (rec.stopped) {
+                    const done = await fetch(base + '/complete?chunks=' + rec.recorded + '&ext=' + rec.ext, { method: 'POST', headers: AUTH });
+                    if (done.ok || done.status === 410) {
+                        await dropRecording(rec.recordingId);
+                        setStatus('Recording synced');
+                    } else if (done.status !== 409) {
+                        throw new Error('HTTP ' + done.status);
+                    }
+                }
+            }
+
+            async function sync() {
+                if (syncing || !db) return;
+                if (!navigator.onLine) {
+                    setStatus('Offline — recording kept on this device');
+                    return;
+                }
+                syncing = true;
+                try {
+                    const recordings = await request('recordings', 'readonly', store => store.getAll());
+                    for (const rec of recordings) {
+                        if (rec.token === TOKEN) await syncRecording(rec);
+                    }
+                    retryDelay = 1000;
+                } catch (err) {
+                    setStatus('Server unreachable — recording kept on this device, retrying');
+                    scheduleRetry();
+                } finally {
+                    syncing = false;
+                }
+            }
+
             function updateTimer() {
                 const elapsed = Date.now() - startTime - pausedTime;
                 const totalSeconds = Math.floor(elapsed / 1000);
@@ -134,36 +254,56 @@ def audio_recorder_component():
                 const seconds = totalSeconds % 60;
                 timer.textContent = String(minutes).padStart(2, '0') + ':' + String(seconds).padStart(2, '0');
             }
-            
-            function sendToStreamlit(audioData) {
-                if (window.parent && window.parent.streamlitSetComponentValue) {
-                    window.parent.streamlitSetComponentValue(audioData);
+
+            function pickMimeType() {
+                for (const type of ['audio/webm;codecs=opus', 'audio/ogg;codecs=opus', 'audio/mp4']) {
+                    if (MediaRecorder.isTypeSupported(type)) return type;
                 }
+                return '';
             }
-            
+
             mainBtn.addEventListener('click', async () => {
+                if (mediaRecorder && mediaRecorder.state !== 'inactive') return;
                 try {
                     stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-                    
-                    mediaRecorder = new MediaRecorder(stream);
-                    audioChunks = [];
-                    
+
+                    const mimeType = pickMimeType();
+                    mediaRecorder = new MediaRecorder(stream, mimeType ? { mimeType } : {});
+                    current = {
+                        recordingId: TOKEN + '-' + Date.now().toString(36) + Math.random().toString(36).slice(2, 8),
+                        token: TOKEN,
+                        ext: MIME_TYPES[mediaRecorder.mimeType.split(';')[0]] || 'webm',
+                        recorded: 0,
+                        stopped: false,
+                    };
+                    await request('recordings', 'readwrite', store => store.put(current));
+
+                    // Chunks are queued in order on one promise chain so the
+                    // final chunk is stored before the recording is marked stopped
+                    let stored = Promise.resolve();
                     mediaRecorder.ondataavailable = (e) => {
-                        if (e.data.size > 0) audioChunks.push(e.data);
+                        if (e.data.size === 0) return;
+                        const rec = current;
+                        stored = stored.then(async () => {
+                            const seq = rec.recorded;
+                            await request('chunks', 'readwrite', store => store.put({ recordingId: rec.recordingId, seq: seq, blob: e.data }));
+                            rec.recorded = seq + 1;
+                            await request('recordings', 'readwrite', store => store.put(rec));
+                            sync();
+                        });
                     };
-                    
+
                     mediaRecorder.onstop = () => {
-                        const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
-                        const reader = new FileReader();
-                        reader.onloadend = () => {
-                            const base64 = reader.result.split(',')[1];
-                            sendToStreamlit(base64);
-                            status.textContent = 'Recording saved!';
-                        };
-                        reader.readAsDataURL(audioBlob);
-                        
+                        const rec = current;
+                        stored = stored.then(async () => {
+                            rec.stopped = true;
+                            await request('recordings', 'readwrite', store => store.put(rec));
+                            status.textContent = 'Recording saved on this device';
+                            sync();
+                        });
+
                         stream.getTracks().forEach(track => track.stop());
-                        
+
                         // Reset UI
                         mainBtn.classList.remove('recording');
                         icon.textContent = '🎤';
@@ -172,12 +312,12 @@ def audio_recorder_component():
                         timer.style.display = 'none';
                         timer.textContent = '00:00';
                     };
-                    
-                    mediaRecorder.start();
+
+                    mediaRecorder.start(CHUNK_MS);
                     startTime = Date.now();
                     pausedTime = 0;
                     timerInterval = setInterval(updateTimer, 100);
-                    
+
                     // Update UI
                     mainBtn.classList.add('recording');
                     icon.textContent = '🔴';
@@ -187,21 +327,21 @@ def audio_recorder_component():
                     pauseBtn.style.display = 'block';
                     resumeBtn.style.display = 'none';
                     status.textContent = '';
-                    
+
                 } catch (err) {
-                    status.textContent = 'Microphone access denied';
+                    status.textContent = db ? 'Microphone access denied' : 'Local storage unavailable';
                     console.error(err);
                 }
             });
-            
+
             pauseBtn.addEventListener('click', () => {
                 if (mediaRecorder && mediaRecorder.state === 'recording') {
                     mediaRecorder.pause();
                     const pauseStart = Date.now();
                     pauseBtn.dataset.pauseStart = pauseStart;
-                    
+
                     clearInterval(timerInterval);
-                    
+
                     pauseBtn.style.display = 'none';
                     resumeBtn.style.display = 'block';
                     icon.textContent = '⏸️';
@@ -210,15 +350,15 @@ def audio_recorder_component():
                     status.textContent = 'Recording paused';
                 }
             });
-            
+
             resumeBtn.addEventListener('click', () => {
                 if (mediaRecorder && mediaRecorder.state === 'paused') {
                     const pauseStart = parseInt(pauseBtn.dataset.pauseStart);
                     pausedTime += Date.now() - pauseStart;
-                    
+
                     mediaRecorder.resume();
                     timerInterval = setInterval(updateTimer, 100);
-                    
+
                     resumeBtn.style.display = 'none';
                     pauseBtn.style.display = 'block';
                     icon.textContent = '🔴';
@@ -227,7 +367,7 @@ def audio_recorder_component():
                     status.textContent = '';
                 }
             });
-            
+
             stopBtn.addEventListener('click', () => {
                 if (mediaRecorder) {
                     mediaRecorder.stop();
@@ -235,9 +375,27 @@ def audio_recorder_component():
                     status.textContent = 'Processing...';
                 }
             });
+
+            window.addEventListener('online', () => { retryDelay = 1000; sync(); });
+            window.addEventListener('offline', () => setStatus('Offline — recording kept on this device'));
+            setInterval(sync, 15000);
+
+            // Resume uploads left over from an earlier page load
+            openDb().then(d => { db = d; sync(); }).catch(err => {
+                status.textContent = 'Local storage unavailable';
+                console.error(err);
+            });
         </script>
     </body>
     </html>
     """
     
+    component_html = (
+        component_html
+        .replace("__TOKEN__", json.dumps(token))
+        .replace("__CREDENTIAL__", json.dumps(credential))
+        .replace("__INGEST_URL__", json.dumps(CHUNK_INGEST_PUBLIC_URL))
+        .replace("__INGEST_PORT__", str(CHUNK_INGEST_PORT))
+        .replace("__CHUNK_MS__", str(RECORDER_CHUNK_MS))
+    )
     return components.html(component_html, height=120)
\ No newline at end of file
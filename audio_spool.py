@@ -0,0 +1,101 @@
+"""
+Disk-spooled recordings for session state
+
+Recordings are written to a temp file once per widget value and sessions keep
+only a small handle, so idle sessions holding multi-minute takes do not grow
+worker RSS. Nothing reads a take back into memory: quality analysis and the
+save stream it from the spool file. The takes a process holds on disk are
+exported as metrics.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+import metrics
+from config import AUDIO_SPOOL_MAX_AGE_S
+
+SPOOL_DIR = os.path.join(tempfile.gettempdir(), "clinical-audio-spool")
+COPY_CHUNK = 1024 * 1024
+
+
+class SpooledAudio(NamedTuple):
+    """Handle to a recording spooled to disk"""
+    path: str
+    size: int
+    sha256: str
+    source_id: str
+
+
+_lock = threading.Lock()
+_held: Dict[str, int] = {}  # spool files of this process -> size
+_last_cleanup = 0.0
+
+
+def _publish():
+    """Call under _lock"""
+    metrics.set_gauge("audio.spool_bytes", sum(_held.values()))
+    metrics.set_gauge("audio.spool_recordings", len(_held))
+
+
+def _cleanup_stale():
+    """Remove spool files left behind by sessions that ended without saving"""
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < 600:
+        return
+    _last_cleanup = now
+    for name in os.listdir(SPOOL_DIR):
+        path = os.path.join(SPOOL_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > AUDIO_SPOOL_MAX_AGE_S:
+                os.remove(path)
+                with _lock:
+                    if _held.pop(path, None) is not None:
+                        _publish()
+        except OSError:
+            pass
+
+
+def spool(fileobj, source_id: str = "", suffix: str = ".wav") -> SpooledAudio:
+    """Copy a file-like recording to the spool in chunks and return its handle"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    _cleanup_stale()
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(dir=SPOOL_DIR, suffix=suffix)
+    with os.fdopen(fd, "wb") as out:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(COPY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    metrics.incr("audio.spooled_bytes", size)
+    with _lock:
+        _held[path] = size
+        _publish()
+    return SpooledAudio(path, size, digest.hexdigest(), source_id)
+
+
+def spool_bytes(data: bytes, source_id: str = "") -> SpooledAudio:
+    """Spool an in-memory recording"""
+    return spool(io.BytesIO(data), source_id)
+
+
+def release(handle: Optional[SpooledAudio]):
+    """Delete a recording's spool file"""
+    if handle is None:
+        return
+    with _lock:
+        _held.pop(handle.path, None)
+        _publish()
+    try:
+        os.remove(handle.path)
+    except FileNotFoundError:
+        pass
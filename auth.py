@@ -4,6 +4,8 @@ Authentication module for Clinical Notes Application
 import streamlit as st
 from typing import Dict, Optional
 
+from config import ADMIN_USERS
+
 
 def get_users() -> Dict[str, str]:
     """Get users from Streamlit secrets or use defaults"""
@@ -72,4 +74,13 @@ def check_authentication() -> bool:
 
 def get_current_username() -> Optional[str]:
     """Get current logged in username"""
-    return st.session_state.get("username", None)
\ No newline at end of file
+    return st.session_state.get("username", None)
+
+
+def is_admin(username: Optional[str]) -> bool:
+    """Check if a user can open the progress dashboard"""
+    try:
+        admins = list(st.secrets["admin"]["users"])
+    except (KeyError, FileNotFoundError):  # no [admin] section, or no secrets file
+        admins = ADMIN_USERS
+    return username in admins
@@ -0,0 +1,74 @@
+"""
+Synthetic clinical notes used by the benchmark scripts
+
+The notes are generated from a fixed pool of anonymized sentences with a seeded
+RNG, so every run benchmarks the same inputs.
+"""
+import csv
+import random
+from typing import List
+
+SECTION_HEADERS = [
+    "ATCD :",
+    "FDRCV :",
+    "HDM :",
+    "EXAMEN CLINIQUE :",
+    "BILAN BIOLOGIQUE :",
+    "ECG :",
+    "ETT :",
+    "CORONAROGRAPHIE :",
+    "CONDUITE TENUE :",
+    "EVOLUTION :",
+    "CAT :",
+]
+
+SENTENCES = [
+    "Patient de 62 ans admis pour douleur thoracique typique évoluant depuis 3 heures.",
+    "Tabagisme actif à 30 PA, HTA sous amlodipine 5 mg, diabète de type 2 sous metformine.",
+    "Examen : TA 145/85 mmHg, FC 92 bpm, SpO2 96 % à l'air ambiant, pas de souffle.",
+    "Troponine Hs 1250 ng/L, créatinine 9 mg/L, hémoglobine 13,2 g/dL.",
+    "Sus-décalage du segment ST en territoire antérieur étendu avec miroir inférieur.",
+    "FEVG estimée à 45 % avec akinésie apicale, pas d'épanchement péricardique.",
+    "Coronarographie : occlusion de l'IVA proximale, angioplastie avec pose d'un stent actif.",
+    "Aspirine 250 mg IVD, clopidogrel 600 mg, héparine 5000 UI, morphine titrée.",
+    "Évolution favorable, disparition de la douleur, pas de récidive ischémique.",
+    "Sortie prévue à J5 sous double antiagrégation plaquettaire, bêtabloquant et statine.",
+]
+
+
+def make_note(rng: random.Random, paragraphs_per_section: int = 1) -> str:
+    """Build one synthetic French admission note"""
+    lines = []
+    for header in SECTION_HEADERS:
+        lines.append(header)
+        for _ in range(paragraphs_per_section):
+            lines.append(" ".join(rng.sample(SENTENCES, 3)))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def make_note_of_size(target_bytes: int, seed: int = 0) -> str:
+    """Build a synthetic note of roughly target_bytes UTF-8 bytes"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < target_bytes:
+        part = make_note(rng)
+        parts.append(part)
+        size += len(part.encode("utf-8"))
+    text = "\n".join(parts)
+    return text.encode("utf-8")[:target_bytes].decode("utf-8", errors="ignore")
+
+
+def write_dataset(path: str, num_notes: int = 60, seed: int = 0) -> List[str]:
+    """Write a synthetic clinical_notes.csv and return its note IDs"""
+    rng = random.Random(seed)
+    note_ids = []
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["note_id", "raw_text", "audio_file", "validated", "additional_notes"])
+        for i in range(num_notes):
+            note_id = f"admissions:{i:08d}"
+            note_ids.append(note_id)
+            writer.writerow([note_id, make_note(rng, rng.randint(1, 4)), "", "", ""])
+    return note_ids
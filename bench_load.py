@@ -0,0 +1,327 @@
+"""
+Load-testing harness for the Clinical Notes Application
+
+Drives simulated doctor sessions through the app headlessly with Streamlit's
+AppTest, against a local stub of the Supabase storage endpoint.
+
+Latencies run to the end of the first script run of an interaction; the
+reruns it triggers (such as the 3 s loop of the save success banners) are
+reported separately, as the script run count and the p50 including them.
+
+Usage:
+    python bench_load.py --workers 4 --iterations 5
+"""
+import argparse
+import array
+import io
+import json
+import math
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Pool
+from typing import List, Tuple
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(APP_DIR, "app.py")
+
+INTERACTIONS = ["login", "select_note", "next_card", "prev_card", "save_audio", "save_notes"]
+
+
+class StubStorageHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Supabase storage upload endpoint"""
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps({"Key": self.path}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency: float = 0.0) -> ThreadingHTTPServer:
+    """Start the stub storage server on a free local port"""
+    StubStorageHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubStorageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_secrets(workdir: str, storage_url: str):
+    """Write a secrets.toml with test passwords and the stub storage endpoint"""
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w") as f:
+        f.write(
+            "[passwords]\n"
+            'dr_smith = "load-test-smith"\n'
+            'dr_jones = "load-test-jones"\n'
+            "\n[supabase]\n"
+            f'SUPABASE_URL = "{storage_url}"\n'
+            'SUPABASE_KEY = "stub"\n'
+            'BUCKET_NAME = "recordings"\n'
+        )
+
+
+def make_wav(seconds: float = 3.0, rate: int = 16000) -> bytes:
+    """Build a mono 16-bit WAV tone that passes the pre-upload quality checks"""
+    samples = array.array("h", (
+        int(10000 * math.sin(2 * math.pi * 220 * i / rate)) for i in range(int(seconds * rate))
+    ))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def _count_script_runs() -> dict:
+    """Count script runs (and when each started) by wrapping st.set_page_config, called once per run"""
+    import streamlit as st
+
+    counter = {"runs": 0, "starts": []}
+    original = st.set_page_config
+
+    def counting_set_page_config(*args, **kwargs):
+        counter["runs"] += 1
+        counter["starts"].append(time.perf_counter())
+        return original(*args, **kwargs)
+
+    st.set_page_config = counting_set_page_config
+    return counter
+
+
+def _find_button(at, label: str):
+    for button in at.button:
+        if button.label == label:
+            return button
+    return None
+
+
+def _find_button_by_key(at, key: str):
+    for button in at.button:
+        if button.key == key:
+            return button
+    return None
+
+
+def run_worker(args: Tuple[int, str, str, int, float]) -> dict:
+    """Run one simulated doctor for a number of iterations"""
+    worker_id, username, password, iterations, timeout = args
+    from streamlit.testing.v1 import AppTest
+    from audio_spool import spool_bytes
+
+    runs = _count_script_runs()
+    timings = defaultdict(list)
+    totals = defaultdict(list)
+    script_runs = defaultdict(list)
+    errors = defaultdict(int)
+    audio = make_wav()
+
+    def measure(name, action):
+        before = runs["runs"]
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception:
+            errors[name] += 1
+            return
+        end = time.perf_counter()
+        # The first run ends where the rerun it triggered starts
+        first_end = runs["starts"][before + 1] if runs["runs"] > before + 1 else end
+        timings[name].append(first_end - start)
+        totals[name].append(end - start)
+        script_runs[name].append(runs["runs"] - before)
+
+    for iteration in range(iterations):
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        at.run()
+
+        def login():
+            at.selectbox[0].select(username)
+            at.text_input[0].input(password)
+            _find_button(at, "🚀 Login").click().run()
+
+        measure("login", login)
+        if not at.session_state["logged_in"]:
+            errors["login"] += 1
+            continue
+
+        def select_note():
+            selector = at.selectbox[0]
+            selector.select_index(iteration % len(selector.options)).run()
+
+        measure("select_note", select_note)
+
+        def next_card():
+            button = _find_button_by_key(at, "nav_next")
+            if button is not None and not button.disabled:
+                button.click().run()
+
+        def prev_card():
+            button = _find_button_by_key(at, "nav_prev")
+            if button is not None and not button.disabled:
+                button.click().run()
+
+        measure("next_card", next_card)
+        measure("prev_card", prev_card)
+
+        def save_audio():
+            # As the recorder widgets do, so the app only ever sees spooled takes
+            at.session_state["recorded_audio"] = spool_bytes(audio)
+            _find_button(at, "💾 Save Audio").click().run()
+
+        measure("save_audio", save_audio)
+
+        def save_notes():
+            at.text_area[0].input(f"Note de test {worker_id}/{iteration}")
+            _find_button(at, "💾 Save Notes").click().run()
+
+        measure("save_notes", save_notes)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "worker": worker_id,
+        "username": username,
+        "timings": dict(timings),
+        "totals": dict(totals),
+        "script_runs": dict(script_runs),
+        "errors": dict(errors),
+        "cpu_user_s": usage.ru_utime,
+        "cpu_system_s": usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "max_rss_mb": usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(results: List[dict]) -> dict:
+    """Aggregate worker results into per-interaction statistics"""
+    summary = {"interactions": {}, "workers": []}
+    for name in INTERACTIONS:
+        timings = [t for r in results for t in r["timings"].get(name, [])]
+        totals = [t for r in results for t in r["totals"].get(name, [])]
+        runs = [n for r in results for n in r["script_runs"].get(name, [])]
+        summary["interactions"][name] = {
+            "count": len(timings),
+            "errors": sum(r["errors"].get(name, 0) for r in results),
+            "p50_ms": percentile(timings, 50) * 1000,
+            "p95_ms": percentile(timings, 95) * 1000,
+            "p99_ms": percentile(timings, 99) * 1000,
+            "script_runs_avg": statistics.mean(runs) if runs else 0.0,
+            "with_reruns_p50_ms": percentile(totals, 50) * 1000,
+        }
+    for r in results:
+        summary["workers"].append({
+            "worker": r["worker"],
+            "username": r["username"],
+            "cpu_s": r["cpu_user_s"] + r["cpu_system_s"],
+            "max_rss_mb": r["max_rss_mb"],
+        })
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"{'interaction':<14}{'n':>6}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'runs':>7}{'all runs p50':>14}")
+    for name, stats in summary["interactions"].items():
+        print(
+            f"{name:<14}{stats['count']:>6}{stats['errors']:>6}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            f"{stats['script_runs_avg']:>7.2f}{stats['with_reruns_p50_ms']:>14.1f}"
+        )
+    print()
+    print(f"{'worker':<8}{'username':<20}{'cpu s':>8}{'rss MB':>10}")
+    for w in summary["workers"]:
+        print(f"{w['worker']:<8}{w['username']:<20}{w['cpu_s']:>8.2f}{w['max_rss_mb']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent simulated doctors")
+    parser.add_argument("--iterations", type=int, default=5, help="Sessions per doctor")
+    parser.add_argument("--data", default=None, help="Dataset to copy (default: synthetic notes)")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="Stub upload latency in seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-run AppTest timeout in seconds")
+    parser.add_argument("--json", dest="json_path", default=None, help="Also write the summary as JSON")
+    parser.add_argument("--partitioned", action="store_true", help="Split the dataset into per-doctor partitions")
+    parser.add_argument("--storage", choices=["supabase", "local"], default="supabase",
+                        help="Storage backend (supabase: local stub server)")
+    args = parser.parse_args()
+
+    from auth import get_users
+    from bench_fixtures import write_dataset
+
+    workdir = tempfile.mkdtemp(prefix="clinical-load-")
+    server = start_stub_server(args.storage_latency)
+    write_secrets(workdir, f"http://127.0.0.1:{server.server_address[1]}")
+
+    try:
+        os.chdir(workdir)
+        if args.storage == "local":
+            os.environ["CLINICAL_STORAGE"] = "local"
+            os.environ["CLINICAL_STORAGE_DIR"] = os.path.join(workdir, "storage")
+        if args.data:
+            shutil.copy(args.data, os.path.join(workdir, "clinical_notes.csv"))
+        else:
+            write_dataset(os.path.join(workdir, "clinical_notes.csv"))
+        if args.partitioned:
+            import data_handler
+            import partitions
+            data_handler.DATA_PATH = os.path.join(workdir, "clinical_notes.csv")
+            partitions.build(data_handler.load_data(), data_handler.DOCTOR_ASSIGNMENTS,
+                             partitions.partition_root(data_handler.DATA_PATH))
+
+        users = list(get_users().items())
+        jobs = [
+            (i, users[i % len(users)][0], users[i % len(users)][1], args.iterations, args.timeout)
+            for i in range(args.workers)
+        ]
+
+        start = time.perf_counter()
+        with Pool(args.workers) as pool:
+            results = pool.map(run_worker, jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    summary = summarize(results)
+    summary["wall_s"] = elapsed
+    print_summary(summary)
+    print(f"\nwall time: {elapsed:.1f}s")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, APP_DIR)
+    main()
@@ -0,0 +1,88 @@
+"""
+Cold-start benchmark for the Streamlit entry point
+
+Imports the login path (app) and the full post-login module set in fresh
+interpreters with `python -X importtime`, reports total import time and the
+slowest modules, and checks that the login path does not pull in pandas or
+requests beyond what streamlit itself loads.
+
+Usage:
+    python bench_startup.py --repeat 5
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TARGETS = {
+    "streamlit only": "import streamlit",
+    "login path": "import app",
+    "after login": "import app, data_handler, text_formatter, ui_components",
+}
+
+HEAVY_MODULES = ["pandas", "requests", "numpy"]
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(statement: str) -> Tuple[Dict[str, int], List[str]]:
+    """Run statement in a fresh interpreter; return cumulative us per top-level module and loaded heavy modules"""
+    probe = f"{statement}; import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=APP_DIR, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            cumulative[match.group(4)] = int(match.group(2))
+    heavy = [m for m in proc.stdout.strip().split(",") if m]
+    return cumulative, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    loaded = {}
+    for label, statement in TARGETS.items():
+        totals = []
+        per_module: Dict[str, List[int]] = {}
+        heavy: List[str] = []
+        for _ in range(args.repeat):
+            cumulative, heavy = import_profile(statement)
+            totals.append(sum(cumulative.values()))
+            for module, us in cumulative.items():
+                per_module.setdefault(module, []).append(us)
+
+        print(f"{label}: median {statistics.median(totals) / 1000:.1f} ms over {args.repeat} runs")
+        slowest = sorted(per_module.items(), key=lambda kv: statistics.median(kv[1]), reverse=True)
+        for module, values in slowest[:args.top]:
+            print(f"    {module:<40}{statistics.median(values) / 1000:>10.1f} ms")
+        print(f"    heavy modules loaded: {', '.join(heavy) or 'none'}")
+        print()
+
+        loaded[label] = set(heavy)
+
+    extra = loaded["login path"] - loaded["streamlit only"]
+    if extra:
+        print(
+            f"Login path imports {', '.join(sorted(extra))}; "
+            "check top-level imports in app.py and its dependencies"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Micro-benchmarks for the text formatting and layout pipeline
+
+Runs format_clinical_text, clean_content, calculate_line_height and
+split_content_dynamically over synthetic French admission notes from 1 KB to
+1 MB, reports throughput and peak allocations, and appends each run to a
+JSONL history file so results can be compared over time.
+
+Usage:
+    python bench_text_formatter.py
+    python bench_text_formatter.py --sizes 1024 10240 --compare
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from bench_fixtures import make_note_of_size
+from text_formatter import (
+    calculate_line_height,
+    clean_content,
+    format_clinical_text,
+    split_content_dynamically,
+)
+
+DEFAULT_SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024]
+HISTORY_PATH = "bench_history.jsonl"
+
+
+def build_cases(text: str) -> Dict[str, Callable[[], object]]:
+    """Build the benchmarked callables for one input note"""
+    formatted = format_clinical_text(text)
+    lines = formatted.split("<br>")
+    return {
+        "format_clinical_text": lambda: format_clinical_text(text),
+        "clean_content": lambda: clean_content(formatted),
+        "calculate_line_height": lambda: [calculate_line_height(line) for line in lines],
+        "split_content_dynamically": lambda: split_content_dynamically(formatted, max_height=500),
+    }
+
+
+def time_case(func: Callable[[], object], min_time: float, max_rounds: int) -> List[float]:
+    """Run func repeatedly until min_time has elapsed and return per-call times"""
+    func()  # warm-up
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_rounds and (time.perf_counter() - start < min_time or len(times) < 3):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def peak_allocation(func: Callable[[], object]) -> int:
+    """Peak traced memory in bytes for a single call"""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes: List[int], min_time: float, max_rounds: int) -> List[dict]:
+    results = []
+    for size in sizes:
+        text = make_note_of_size(size, seed=size)
+        nbytes = len(text.encode("utf-8"))
+        for name, func in build_cases(text).items():
+            times = sorted(time_case(func, min_time, max_rounds))
+            median = times[len(times) // 2]
+            results.append({
+                "case": name,
+                "size_bytes": nbytes,
+                "rounds": len(times),
+                "min_ms": times[0] * 1000,
+                "median_ms": median * 1000,
+                "throughput_mb_s": nbytes / median / 1e6 if median else 0.0,
+                "peak_alloc_kb": peak_allocation(func) / 1024,
+            })
+    return results
+
+
+def load_previous(history_path: str) -> Dict[tuple, dict]:
+    """Load the most recent result for each (case, size) from the history file"""
+    previous = {}
+    if not os.path.exists(history_path):
+        return previous
+    with open(history_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            run_record = json.loads(line)
+            for r in run_record["results"]:
+                previous[(r["case"], r["size_bytes"])] = r
+    return previous
+
+
+def print_results(results: List[dict], previous: Dict[tuple, dict]):
+    print(f"{'case':<27}{'size':>10}{'median ms':>12}{'MB/s':>10}{'peak KB':>11}{'vs last':>9}")
+    for r in results:
+        prev = previous.get((r["case"], r["size_bytes"]))
+        delta = f"{(r['median_ms'] / prev['median_ms'] - 1) * 100:+.0f}%" if prev and prev["median_ms"] else ""
+        print(
+            f"{r['case']:<27}{r['size_bytes']:>10}{r['median_ms']:>12.3f}"
+            f"{r['throughput_mb_s']:>10.2f}{r['peak_alloc_kb']:>11.1f}{delta:>9}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Note sizes in bytes")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds per case")
+    parser.add_argument("--max-rounds", type=int, default=1000, help="Maximum calls per case")
+    parser.add_argument("--history", default=HISTORY_PATH, help="JSONL file results are appended to")
+    parser.add_argument("--compare", action="store_true", help="Show change against the last recorded run")
+    parser.add_argument("--no-record", action="store_true", help="Do not append this run to the history")
+    args = parser.parse_args()
+
+    previous = load_previous(args.history) if args.compare else {}
+    results = run(args.sizes, args.min_time, args.max_rounds)
+    print_results(results, previous)
+
+    if not args.no_record:
+        record = {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Local content-addressed blob store with asynchronous replication
+
+Blobs are keyed by their SHA-256 and written to sharded directories
+(<root>/ab/cd/<sha><ext>), so saving the same recording twice is a no-op.
+The local copy is the primary write target; new blobs are replicated to
+the storage backend under <kind>/<sha><ext> through the process-wide upload scheduler.
+Pending replications are tracked as marker files, created before the blob
+is moved into place, and resumed after a restart (a marker left without its
+blob is dropped). Replicated blobs can be evicted locally once the store grows past
+its size budget, which is checked against a running size total (counted
+once, then kept up to date as blobs are written and evicted). retention.py marks a blob's marker "archived" before
+deleting its remote copy: it is not uploaded on restart, but saving the
+same content again uploads it.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Callable, Optional
+
+import metrics
+from upload_scheduler import UploadRejected, get_upload_scheduler
+from config import AUDIO_DIR, NOTES_DIR, LOCAL_STORE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+PENDING_DIR = ".pending"
+ARCHIVED = "archived"  # Marker content: the remote copy was removed by retention.py
+RETRY_DELAYS = [1, 5, 30, 120]
+
+
+class BlobStore:
+    """SHA-256 keyed files under one root directory"""
+
+    def __init__(self, root: str, kind: str, ext: str, mimetype: str,
+                 max_bytes: int = LOCAL_STORE_MAX_BYTES,
+                 uploader: Optional[Callable[[str, bytes, str], object]] = None):
+        self.root = root
+        self.kind = kind
+        self.ext = ext
+        self.mimetype = mimetype
+        self.max_bytes = max_bytes
+        self._uploader = uploader
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._bytes: Optional[int] = None  # Size of the held blobs, counted on first use
+        os.makedirs(os.path.join(root, PENDING_DIR), exist_ok=True)
+
+    def path(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha[2:4], sha + self.ext)
+
+    def remote_key(self, sha: str) -> str:
+        """Object name used in remote storage"""
+        return f"{self.kind}/{sha}{self.ext}"
+
+    def _pending_marker(self, sha: str) -> str:
+        return os.path.join(self.root, PENDING_DIR, sha)
+
+    def exists(self, sha: str) -> bool:
+        return os.path.exists(self.path(sha))
+
+    def _marker(self, sha: str) -> Optional[str]:
+        try:
+            with open(self._pending_marker(sha)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _reuse(self, sha: str) -> bool:
+        """
+        Whether a blob is already held locally; an archived one is queued for
+        upload again, since its remote copy is gone
+        """
+        with self._lock:
+            if not os.path.exists(self.path(sha)):
+                return False
+            if self._marker(sha) == ARCHIVED:
+                open(self._pending_marker(sha), "w").close()
+            return True
+
+    def put(self, data: bytes) -> str:
+        """Store bytes and return their SHA-256; existing content is not rewritten"""
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.path(sha)
+        if self._reuse(sha):
+            metrics.incr(f"blob_store.{self.kind}.dedup_hits")
+            return sha
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # Marked pending before it appears, so it is never taken as replicated
+            open(self._pending_marker(sha), "w").close()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._count(len(data))
+        metrics.incr(f"blob_store.{self.kind}.bytes_written", len(data))
+        return sha
+
+    def put_file(self, path: str, sha: str) -> str:
+        """Store a file whose SHA-256 is already known, without reading it into memory"""
+        target = self.path(sha)
+        if self._reuse(sha):
+            metrics.incr(f"blob_store.{self.kind}.dedup_hits")
+            return sha
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            open(self._pending_marker(sha), "w").close()
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        size = os.path.getsize(target)
+        self._count(size)
+        metrics.incr(f"blob_store.{self.kind}.bytes_written", size)
+        return sha
+
+    def get(self, sha: str) -> Optional[bytes]:
+        """Read a blob, or None if it is not (or no longer) held locally"""
+        try:
+            with open(self.path(sha), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(self.path(sha))
+        return data
+
+    def is_replicated(self, sha: str) -> bool:
+        return not os.path.exists(self._pending_marker(sha))
+
+    def mark_archived(self, sha: str):
+        """
+        Record that the remote copy of a replicated blob is being deleted
+        (call before deleting it), so saving the same content uploads it again
+        """
+        with self._lock:
+            if os.path.exists(self.path(sha)) and self.is_replicated(sha):
+                with open(self._pending_marker(sha), "w") as f:
+                    f.write(ARCHIVED)
+
+    def unmark_archived(self, sha: str):
+        """Undo mark_archived when the remote copy was not deleted after all"""
+        with self._lock:
+            if self._marker(sha) == ARCHIVED:
+                self._clear_pending(sha)
+
+    def replicate(self, sha: str, owner: str = ""):
+        """Queue a blob for upload to remote storage on behalf of owner (a doctor)"""
+        with self._lock:
+            if sha in self._in_flight or self.is_replicated(sha):
+                return
+            self._in_flight.add(sha)
+        self._schedule(sha, owner, 0)
+
+    def resume_pending(self):
+        """Queue every blob whose replication did not finish"""
+        for sha in os.listdir(os.path.join(self.root, PENDING_DIR)):
+            if self._marker(sha) != ARCHIVED:
+                self.replicate(sha)
+
+    def _schedule(self, sha: str, owner: str, attempt: int):
+        try:
+            size = os.path.getsize(self.path(sha))
+        except OSError:
+            size = 0
+        try:
+            future = get_upload_scheduler().submit(owner or self.kind, size, self._upload, sha)
+        except UploadRejected as e:
+            self._retry(sha, owner, attempt, e)
+            return
+        future.add_done_callback(lambda f: self._finished(sha, owner, attempt, f))
+
+    def _finished(self, sha: str, owner: str, attempt: int, future):
+        error = future.exception()
+        if error is not None:
+            self._retry(sha, owner, attempt, error)
+            return
+        with self._lock:
+            self._in_flight.discard(sha)
+            idle = not self._in_flight
+        if idle and self.stored_bytes() > self.max_bytes:
+            self.evict()
+
+    def _retry(self, sha: str, owner: str, attempt: int, error: BaseException):
+        # Retries wait on a timer rather than in an upload slot
+        if attempt >= len(RETRY_DELAYS):
+            logger.error(f"Replication of {sha} failed, will retry on restart: {error}")
+            with self._lock:
+                self._in_flight.discard(sha)
+            return
+        logger.warning(f"Replication of {sha} failed (attempt {attempt + 1}): {error}")
+        timer = threading.Timer(RETRY_DELAYS[attempt], self._schedule, (sha, owner, attempt + 1))
+        timer.daemon = True
+        timer.start()
+
+    def _clear_pending(self, sha: str):
+        try:
+            os.remove(self._pending_marker(sha))
+        except FileNotFoundError:
+            pass  # replicated concurrently by another process
+
+    def _upload(self, sha: str):
+        if self.is_replicated(sha):
+            return
+        data = self.get(sha)
+        if data is None:
+            logger.error(f"Blob {sha} missing locally, cannot replicate")
+            self._clear_pending(sha)
+            return
+        uploader = self._uploader
+        if uploader is None:
+            from storage import get_storage
+            uploader = get_storage().put
+        uploader(self.remote_key(sha), data, self.mimetype)
+        self._clear_pending(sha)
+        metrics.incr(f"blob_store.{self.kind}.replicated")
+
+    def _count(self, size: int):
+        with self._lock:
+            if self._bytes is None:
+                return
+            self._bytes += size
+            total = self._bytes
+        metrics.set_gauge(f"blob_store.{self.kind}.bytes", total)
+
+    def _set_total(self, total: int):
+        with self._lock:
+            self._bytes = total
+        metrics.set_gauge(f"blob_store.{self.kind}.bytes", total)
+
+    def _scan(self) -> list:
+        """(atime, mtime, size, sha, path) of every blob, by walking the tree"""
+        blobs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if PENDING_DIR in dirnames:
+                dirnames.remove(PENDING_DIR)
+            for name in filenames:
+                if not name.endswith(self.ext):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                blobs.append((stat.st_atime, stat.st_mtime, stat.st_size, name[:-len(self.ext)], path))
+        return blobs
+
+    def stored_bytes(self) -> int:
+        """Size of the blobs held locally (the tree is walked only the first time)"""
+        if self._bytes is None:
+            self._set_total(sum(blob[2] for blob in self._scan()))
+        return self._bytes
+
+    def evict(self):
+        """Remove least recently used replicated blobs until under max_bytes"""
+        # The walk also corrects the running total for changes by other processes
+        blobs = self._scan()
+        total = sum(blob[2] for blob in blobs)
+        if total <= self.max_bytes:
+            self._set_total(total)
+            return
+
+        for atime, mtime, size, sha, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            # Archived blobs also have a cold copy; _reuse re-queues them under the lock
+            with self._lock:
+                marker = self._marker(sha)
+                if marker is not None and marker != ARCHIVED:
+                    continue
+                os.remove(path)
+                if marker == ARCHIVED:
+                    self._clear_pending(sha)
+            total -= size
+            metrics.incr(f"blob_store.{self.kind}.evicted_bytes", size)
+        self._set_total(total)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+AUDIO_MIMETYPES = {
+    ".wav": "audio/wav",
+    ".webm": "audio/webm",
+    ".ogg": "audio/ogg",
+    ".mp4": "audio/mp4",
+}
+
+
+def _get_store(kind: str, root: str, ext: str, mimetype: str) -> BlobStore:
+    with _stores_lock:
+        store = _stores.get((kind, ext))
+        if store is None:
+            store = BlobStore(root, kind, ext, mimetype)
+            store.resume_pending()
+            _stores[(kind, ext)] = store
+        return store
+
+
+def audio_root(ext: str) -> str:
+    """Root of the store for recordings in one container format"""
+    # Formats other than WAV get their own root so pending markers never mix
+    return AUDIO_DIR if ext == ".wav" else os.path.join(AUDIO_DIR, ext.lstrip("."))
+
+
+def get_audio_store(ext: str = ".wav") -> BlobStore:
+    """Process-wide store for recordings in one container format"""
+    return _get_store("audio", audio_root(ext), ext, AUDIO_MIMETYPES[ext])
+
+
+def get_notes_store() -> BlobStore:
+    """Process-wide store for additional notes"""
+    return _get_store("notes", NOTES_DIR, ".txt", "text/plain")
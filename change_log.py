@@ -0,0 +1,172 @@
+"""
+Log of rows appended to the clinical notes dataset
+
+Ingestion never rewrites a dataset file: new rows are written to the end of
+DATA_PATH (or of a partition) and the byte range they occupy is recorded in
+INGEST_LOG, with the file's size and mtime before and after the append. A
+worker holding a frame read at some (size, mtime) stamp can then tell whether
+the file on disk differs from it only by logged appends, and read just those
+bytes; any other change (a save by another worker) breaks the chain and the
+file is read in full. Appends and full rewrites of the dataset files are
+serialized across processes by dataset_lock().
+"""
+import contextlib
+import csv
+import io
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks (Windows): appends are not serialized with saves
+    fcntl = None
+
+import pandas as pd
+
+from config import DATA_PATH, INGEST_LOG
+
+Stamp = Tuple[int, float]
+
+_lock = threading.Lock()
+# log path -> (bytes consumed, entries)
+_logs: Dict[str, Tuple[int, List[dict]]] = {}
+
+
+def data_dir(data_path: str = DATA_PATH) -> str:
+    return os.path.dirname(os.path.abspath(data_path))
+
+
+def log_path(data_path: str = DATA_PATH) -> str:
+    """Change log of a dataset"""
+    return os.path.join(data_dir(data_path), INGEST_LOG)
+
+
+def stamp(path: str) -> Stamp:
+    """(size, mtime) of a file"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+@contextlib.contextmanager
+def dataset_lock(data_path: str = DATA_PATH):
+    """Exclusive lock held while a dataset file is appended to or rewritten"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.abspath(data_path) + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_csv(path: str, **kwargs) -> Tuple[pd.DataFrame, Stamp]:
+    """Read a CSV together with the stamp of the bytes that were read"""
+    mtime = os.stat(path).st_mtime
+    with open(path, "rb") as f:
+        data = f.read()
+    # A write after the stat leaves a stamp that matches neither the file nor
+    # any log entry, so the next check falls back to a full read
+    return pd.read_csv(io.BytesIO(data), **kwargs), (len(data), mtime)
+
+
+def read_appended(path: str, start: int, end: int, **kwargs) -> pd.DataFrame:
+    """Parse the rows stored in bytes [start, end) of a CSV, using its header"""
+    with open(path, "rb") as f:
+        header = f.readline() if start else b""
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(header + data), **kwargs)
+
+
+def entries(data_path: str = DATA_PATH) -> List[dict]:
+    """All logged appends, reading only lines added since the last call"""
+    path = log_path(data_path)
+    with _lock:
+        offset, logged = _logs.get(path, (0, []))
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return logged
+        # Only consume complete lines; the ingester may be mid-write
+        end = data.rfind(b"\n") + 1
+        if end:
+            logged = logged + [json.loads(line) for line in data[:end].decode("utf-8").splitlines() if line]
+            _logs[path] = (offset + end, logged)
+        return logged
+
+
+def appended_range(path: str, since: Stamp, current: Optional[Stamp] = None,
+                   data_path: str = DATA_PATH) -> Optional[Tuple[int, int, Stamp]]:
+    """
+    (start, end, stamp) of the bytes appended to path since it had stamp
+    since, or None if the file is unchanged or changed in any other way
+    """
+    current = current or stamp(path)
+    if tuple(current) == tuple(since):
+        return None
+    name = os.path.relpath(os.path.abspath(path), data_dir(data_path))
+    links = {
+        (entry["offset"], entry["before"]): entry
+        for entry in entries(data_path) if entry["file"] == name
+    }
+    at = tuple(since)
+    for _ in range(len(links)):
+        entry = links.get(at)
+        if entry is None:
+            return None
+        at = (entry["end"], entry["after"])
+        if at == tuple(current):
+            return since[0], current[0], at
+    return None
+
+
+def append_rows(path: str, columns: List[str], rows: List[list], note_ids: List[str],
+                row_numbers: List[int], data_path: str = DATA_PATH) -> dict:
+    """
+    Append rows to a CSV (writing the header if the file is new) and log the
+    append. Call under dataset_lock().
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    with open(path, "ab+") as f:
+        before = os.fstat(f.fileno())
+        if before.st_size == 0:
+            writer.writerow(columns)
+        else:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                buffer.write("\n")  # hand-edited file without a final newline
+        writer.writerows(rows)
+        f.write(buffer.getvalue().encode("utf-8"))
+        f.flush()
+        after = os.fstat(f.fileno())
+
+    entry = {
+        "file": os.path.relpath(os.path.abspath(path), data_dir(data_path)),
+        "offset": before.st_size,
+        "before": before.st_mtime,
+        "end": after.st_size,
+        "after": after.st_mtime,
+        "rows": row_numbers,
+        "note_ids": note_ids,
+        "time": datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(log_path(data_path), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return entry
+
+
+def read_header(path: str) -> Optional[List[str]]:
+    """Column names of a CSV, or None if it does not exist or is empty"""
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f), None)
+    except FileNotFoundError:
+        return None
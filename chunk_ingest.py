@@ -0,0 +1,452 @@
+"""
+Chunk ingest endpoint for the offline-capable recorder
+
+The browser recorder keeps chunks in IndexedDB and uploads them here as
+connectivity allows:
+
+    GET  /recordings/<id>                    -> {"received": [seq, ...], "complete": bool}
+    PUT  /recordings/<id>/chunks/<seq>?recorded=N  -> store one chunk (idempotent)
+    POST /recordings/<id>/complete?chunks=N  -> assemble once all N chunks are in
+
+Recording IDs start with a per-doctor token handed to the component, so the
+doctor's next session picks up uploads that finished after a disconnect.
+Every request carries an upload credential (Authorization: Bearer) issued
+to the Streamlit session for that token; it expires after
+CHUNK_INGEST_TOKEN_TTL_S. Credentials are signed with a key derived from
+[chunk_ingest] SECRET (or CHUNK_INGEST_SECRET), so every process of the app
+shares it; without one, a random key is kept in the private INGEST_DIR. Browsers are only allowed from
+CHUNK_INGEST_ALLOWED_ORIGINS, and uploads are capped per recording and in
+total. The server binds to CHUNK_INGEST_HOST (loopback by default: put it
+behind the proxy that fronts the app and set CHUNK_INGEST_PUBLIC_URL).
+Chunks land on disk as they arrive; the assembled file is handed to the
+audio spool and the recording is then discarded.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import metrics
+from config import (
+    AUDIO_SPOOL_MAX_AGE_S,
+    CHUNK_INGEST_ALLOWED_ORIGINS,
+    CHUNK_INGEST_HOST,
+    CHUNK_INGEST_MAX_CHUNK_BYTES,
+    CHUNK_INGEST_MAX_RECORDING_BYTES,
+    CHUNK_INGEST_MAX_TOTAL_BYTES,
+    CHUNK_INGEST_PORT,
+    CHUNK_INGEST_TOKEN_TTL_S,
+)
+
+logger = logging.getLogger(__name__)
+
+INGEST_DIR = os.path.join(tempfile.gettempdir(), "clinical-chunk-ingest")
+ASSEMBLED_EXTS = ("webm", "ogg", "mp4")
+STORED = "stored"  # _reserve: the chunk needs no write
+
+_ROUTE = re.compile(r"^/recordings/([A-Za-z0-9_-]{8,80})(?:/(chunks/(\d{1,6})|complete))?/?$")
+
+_lock = threading.Lock()
+_server: Optional[ThreadingHTTPServer] = None
+_recorded: Dict[str, int] = {}  # chunks the browser reports having captured
+_discarded = set()  # recordings already saved; late retries are refused
+_usage: Dict[str, int] = {}  # bytes on disk per recording
+_writing = set()  # chunk files being written
+_total_bytes = 0
+_last_cleanup = 0.0
+_secret: Optional[bytes] = None
+
+
+def _check_private(st_result: os.stat_result, path: str):
+    if st_result.st_uid != os.getuid() or st_result.st_mode & 0o077:
+        raise PermissionError(f"{path} must be owned by this user and not accessible to others")
+
+
+def _ingest_dir() -> str:
+    """INGEST_DIR, created private to this user (it holds the key and the chunks)"""
+    try:
+        os.mkdir(INGEST_DIR, 0o700)
+    except FileExistsError:
+        pass
+    _check_private(os.lstat(INGEST_DIR), INGEST_DIR)
+    return INGEST_DIR
+
+
+def _configured_secret() -> Optional[str]:
+    """[chunk_ingest] SECRET from Streamlit secrets, or CHUNK_INGEST_SECRET"""
+    try:
+        import streamlit as st
+        return st.secrets["chunk_ingest"]["SECRET"]
+    except Exception:
+        return os.environ.get("CHUNK_INGEST_SECRET") or None
+
+
+def _key() -> bytes:
+    """
+    Signing key shared by the app's processes
+    Derived from the configured secret; without one, a random key is kept in
+    INGEST_DIR, readable only by this user.
+    """
+    global _secret
+    with _lock:
+        if _secret is None:
+            configured = _configured_secret()
+            if configured:
+                _secret = hashlib.sha256(b"chunk-ingest:" + configured.encode("utf-8")).digest()
+            else:
+                _secret = _key_file(os.path.join(_ingest_dir(), ".key"))
+        return _secret
+
+
+def _key_file(key_path: str) -> bytes:
+    # Written in full before it is linked into place, so processes starting
+    # together all read the key of whichever one linked first
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(key_path))  # mode 0o600
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(tmp_path, key_path)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_path)
+    fd = os.open(key_path, os.O_RDONLY | os.O_NOFOLLOW)
+    with os.fdopen(fd, "rb") as f:
+        _check_private(os.fstat(f.fileno()), key_path)
+        return f.read()
+
+
+def _sign(message: str) -> str:
+    return hmac.new(_key(), message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def session_token(username: str) -> str:
+    """Stable, unguessable prefix for a doctor's recording IDs"""
+    return _sign(username)[:24]
+
+
+def upload_credential(token: str, ttl: float = CHUNK_INGEST_TOKEN_TTL_S) -> str:
+    """Short-lived credential for uploading recordings under token"""
+    expires = int(time.time() + ttl)
+    return f"{expires}.{_sign(f'upload:{token}:{expires}')}"
+
+
+def credential_expiry(credential: str) -> float:
+    return float(credential.split(".", 1)[0])
+
+
+def _authorized(recording_id: str, credential: str) -> bool:
+    """Whether credential is unexpired and was issued for recording_id's token"""
+    expires, _, signature = credential.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    token = recording_id.split("-", 1)[0]
+    return hmac.compare_digest(signature, _sign(f"upload:{token}:{expires}"))
+
+
+def _recording_dir(recording_id: str) -> str:
+    return os.path.join(INGEST_DIR, recording_id)
+
+
+def _received(recording_id: str) -> List[int]:
+    path = _recording_dir(recording_id)
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(name[:-5]) for name in os.listdir(path) if name.endswith(".part"))
+
+
+def _assembled_path(recording_id: str) -> Optional[str]:
+    for ext in ASSEMBLED_EXTS:
+        path = os.path.join(_recording_dir(recording_id), f"recording.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def recording_status(recording_id: str) -> Dict:
+    """Upload progress of one recording"""
+    path = _recording_dir(recording_id)
+    assembled = _assembled_path(recording_id)
+    received = _received(recording_id)
+    complete = assembled is not None
+    size = os.path.getsize(assembled) if complete else sum(
+        os.path.getsize(os.path.join(path, f"{seq:06d}.part")) for seq in received
+    )
+    return {
+        "recording_id": recording_id,
+        "received": received,
+        "recorded": max(_recorded.get(recording_id, 0), len(received)),
+        "bytes": size,
+        "complete": complete,
+        "path": assembled if complete else None,
+    }
+
+
+def _scan_usage():
+    """Count the bytes already on disk (call under _lock, before serving)"""
+    global _total_bytes
+    _usage.clear()
+    for name in os.listdir(INGEST_DIR):
+        path = _recording_dir(name)
+        if os.path.isdir(path):
+            _usage[name] = sum(
+                os.path.getsize(os.path.join(path, f)) for f in os.listdir(path) if not f.endswith(".tmp")
+            )
+    _total_bytes = sum(_usage.values())
+
+
+def _reserve(recording_id: str, part: str, size: int) -> Optional[str]:
+    """
+    Claim a chunk file and account for its size
+    Returns the quota exceeded, or STORED if the chunk is stored or being
+    stored by another request; otherwise call _release once it is written.
+    """
+    global _total_bytes
+    with _lock:
+        if part in _writing or os.path.exists(part):
+            return STORED
+        if _usage.get(recording_id, 0) + size > CHUNK_INGEST_MAX_RECORDING_BYTES:
+            return "recording too large"
+        if _total_bytes + size > CHUNK_INGEST_MAX_TOTAL_BYTES:
+            return "ingest storage full"
+        _usage[recording_id] = _usage.get(recording_id, 0) + size
+        _total_bytes += size
+        _writing.add(part)
+    return None
+
+
+def _release(recording_id: str, part: str, unused: int = 0):
+    """End a _reserve claim, returning unused bytes if the chunk was not written"""
+    global _total_bytes
+    with _lock:
+        _writing.discard(part)
+        if unused and recording_id in _usage:
+            _usage[recording_id] -= unused
+            _total_bytes -= unused
+
+
+def _forget(recording_id: str):
+    """Stop accounting for a recording whose directory is being removed"""
+    global _total_bytes
+    with _lock:
+        _total_bytes -= _usage.pop(recording_id, 0)
+        _recorded.pop(recording_id, None)
+
+
+def _cleanup_stale():
+    """Remove uploads that stopped arriving; the browser still holds their chunks"""
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < 600:
+        return
+    _last_cleanup = now
+    for name in os.listdir(INGEST_DIR):
+        path = _recording_dir(name)
+        try:
+            if os.path.isdir(path) and now - os.path.getmtime(path) > AUDIO_SPOOL_MAX_AGE_S:
+                _forget(name)
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def recordings_for(token: str) -> List[Dict]:
+    """Status of every recording uploaded under a doctor's token, oldest first"""
+    if not os.path.isdir(INGEST_DIR):
+        return []
+    _cleanup_stale()
+    names = [n for n in os.listdir(INGEST_DIR) if n.startswith(token + "-")]
+    names.sort(key=lambda n: os.path.getctime(_recording_dir(n)))
+    return [recording_status(n) for n in names]
+
+
+def discard(recording_id: str):
+    """Delete a recording's chunks once it has been spooled"""
+    with _lock:
+        _discarded.add(recording_id)
+    _forget(recording_id)
+    shutil.rmtree(_recording_dir(recording_id), ignore_errors=True)
+
+
+def _assemble(recording_id: str, num_chunks: int, ext: str) -> bool:
+    global _total_bytes
+    path = _recording_dir(recording_id)
+    if _assembled_path(recording_id):
+        return True
+    if _received(recording_id) != list(range(num_chunks)):
+        return False
+    assembled = os.path.join(path, f"recording.{ext}")
+    with _lock:
+        if _assembled_path(recording_id):
+            return True
+        tmp_path = assembled + ".tmp"
+        with open(tmp_path, "wb") as out:
+            for seq in range(num_chunks):
+                with open(os.path.join(path, f"{seq:06d}.part"), "rb") as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(tmp_path, assembled)
+        size = os.path.getsize(assembled)
+        _usage[recording_id] = _usage.get(recording_id, 0) + size
+        _total_bytes += size
+    metrics.incr("ingest.recordings_completed")
+    return True
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    def _send(self, status: int, body: Optional[dict] = None):
+        data = json.dumps(body or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        origin = self.headers.get("Origin")
+        if origin in CHUNK_INGEST_ALLOWED_ORIGINS:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Access-Control-Allow-Methods", "GET, PUT, POST, OPTIONS")
+            self.send_header("Access-Control-Allow-Headers", "Authorization, Content-Type")
+        self.send_header("Vary", "Origin")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        """Match the path of an allowed, authorized request, or answer it"""
+        origin = self.headers.get("Origin")
+        if origin is not None and origin not in CHUNK_INGEST_ALLOWED_ORIGINS:
+            self._send(403, {"error": "origin not allowed"})
+            return None
+        match = _ROUTE.match(urlparse(self.path).path)
+        if match is None:
+            self._send(404, {"error": "not found"})
+            return None
+        scheme, _, credential = self.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not _authorized(match.group(1), credential):
+            self._send(401, {"error": "missing or expired upload credential"})
+            return None
+        return match
+
+    def do_OPTIONS(self):
+        origin = self.headers.get("Origin")
+        self._send(204 if origin in CHUNK_INGEST_ALLOWED_ORIGINS else 403)
+
+    def do_GET(self):
+        match = self._route()
+        if match and match.group(2) is None:
+            if match.group(1) in _discarded:
+                self._send(410, {"error": "recording already saved"})
+                return
+            status = recording_status(match.group(1))
+            status.pop("path")
+            self._send(200, status)
+        elif match:
+            self._send(405)
+
+    def do_PUT(self):
+        match = self._route()
+        if not match:
+            return
+        if match.group(3) is None:
+            self._send(405)
+            return
+        header = self.headers.get("Content-Length")
+        if header is None:
+            self._send(411, {"error": "Content-Length required"})
+            return
+        if not header.strip().isdigit():
+            self._send(400, {"error": "invalid Content-Length"})
+            return
+        length = int(header)
+        if length > CHUNK_INGEST_MAX_CHUNK_BYTES:
+            self._send(413, {"error": "chunk too large"})
+            return
+        data = self.rfile.read(length)
+        recording_id, seq = match.group(1), int(match.group(3))
+        if recording_id in _discarded:
+            self._send(410, {"error": "recording already saved"})
+            return
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            recorded = int(query.get("recorded", ["0"])[0])
+        except ValueError:
+            recorded = 0
+        path = _recording_dir(recording_id)
+        part = os.path.join(path, f"{seq:06d}.part")
+        exceeded = _reserve(recording_id, part, len(data))
+        if exceeded and exceeded != STORED:
+            metrics.incr("ingest.rejected_quota")
+            self._send(507, {"error": exceeded})
+            return
+        if not exceeded:
+            try:
+                os.makedirs(path, exist_ok=True)
+                with open(part + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(part + ".tmp", part)
+            except BaseException:
+                _release(recording_id, part, len(data))
+                raise
+            _release(recording_id, part)
+            metrics.incr("ingest.chunks")
+            metrics.incr("ingest.bytes", len(data))
+        with _lock:
+            _recorded[recording_id] = max(_recorded.get(recording_id, 0), recorded, seq + 1)
+        self._send(200, {"seq": seq})
+
+    def do_POST(self):
+        match = self._route()
+        if not match:
+            return
+        if match.group(2) != "complete":
+            self._send(405)
+            return
+        if match.group(1) in _discarded:
+            self._send(410, {"error": "recording already saved"})
+            return
+        query = parse_qs(urlparse(self.path).query)
+        ext = query.get("ext", ["webm"])[0]
+        try:
+            num_chunks = int(query["chunks"][0])
+        except (KeyError, ValueError):
+            self._send(400, {"error": "chunks parameter required"})
+            return
+        if num_chunks < 1:
+            self._send(400, {"error": "chunks must be at least 1"})
+            return
+        if ext not in ASSEMBLED_EXTS:
+            self._send(400, {"error": "unsupported format"})
+            return
+        if not os.path.isdir(_recording_dir(match.group(1))):
+            self._send(404, {"error": "unknown recording"})
+            return
+        if _assemble(match.group(1), num_chunks, ext):
+            self._send(200, {"complete": True})
+        else:
+            self._send(409, {"complete": False, "received": _received(match.group(1))})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_ingest_server(port: int = CHUNK_INGEST_PORT):
+    """Serve the chunk ingest endpoint (once per process)"""
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        _ingest_dir()
+        _scan_usage()
+        try:
+            _server = ThreadingHTTPServer((CHUNK_INGEST_HOST, port), _IngestHandler)
+        except OSError as e:
+            logger.warning(f"Chunk ingest server not started on port {port}: {e}")
+            _server = False
+            return
+    threading.Thread(target=_server.serve_forever, name="chunk-ingest", daemon=True).start()
@@ -4,16 +4,73 @@ Configuration file for Clinical Notes Application
 
 # File paths
 DATA_PATH = "clinical_notes.csv"
-AUDIO_DIR = "audios"  # Local fallback only
-NOTES_DIR = "additional_notes"  # Local fallback only
+TAKES_PATH = "audio_takes.csv"  # Append-only history of saved audio and notes
+AUDIO_DIR = "audios"  # Local content-addressed store, replicated to Supabase
+NOTES_DIR = "additional_notes"  # Local content-addressed store, replicated to Supabase
+LOCAL_STORE_MAX_BYTES = 2 * 1024 ** 3  # Replicated blobs are evicted past this size
+PARTITION_DIR = "partitions"  # Per-doctor-group partitions of DATA_PATH, if built
+INGEST_DIR = "inbox"  # Drop directory watched by ingest.py
+INGEST_LOG = "ingest_log.jsonl"  # Rows appended by ingest.py, next to DATA_PATH
+INGEST_POLL_SECONDS = 5
+INGEST_MAX_NOTE_BYTES = 1024 ** 2
+PROGRESS_SUMMARY = "progress_summary.json"  # Materialized dashboard counters, next to DATA_PATH
+
+# Users who can open the progress dashboard (overridden by [admin] users in secrets)
+ADMIN_USERS = ["Dr. Kadri", "Dr. Smith"]
 
 # Supabase configuration (loaded from secrets/env at runtime)
 # No hardcoded values needed here - handled in utils.py
 
+# Remote storage backend: "supabase", "local" or "s3" (overridden by CLINICAL_STORAGE)
+STORAGE_BACKEND = "supabase"
+LOCAL_STORAGE_DIR = "storage"  # Root of the local backend
+STORAGE_MAX_WORKERS = 8  # Parallel downloads in get_many (uploads use UPLOAD_MAX_CONCURRENT)
+
+# Retention of old recordings (retention.py)
+RETENTION_GRACE_DAYS = 14  # Superseded takes and orphans are left alone this long
+ARCHIVE_STORAGE = "local"  # Cold tier: "local" (ARCHIVE_DIR) or a backend name (overridden by CLINICAL_ARCHIVE)
+ARCHIVE_DIR = "cold_storage"  # Root of the local cold tier
+ARCHIVE_LOG = "retention_log.jsonl"  # Where each archived or deleted object went
+ARCHIVE_OPUS_BITRATE = "24k"  # Used when ffmpeg is available
+RETENTION_BATCH_SIZE = 50
+
 # UI Configuration
 VISIBLE_CARDS = 3
 MAX_CARD_HEIGHT = 500
 CARD_WIDTH_CHARS = 55
+NOTE_PAGE_SIZE = 50
+
+# Audio quality thresholds (checked before upload)
+AUDIO_MIN_SECONDS = 2.0
+AUDIO_SILENCE_DBFS = -50.0
+AUDIO_MAX_CLIP_RATIO = 0.01
+AUDIO_MIN_SPEECH_RATIO = 0.2
+
+# Recordings held between capture and save
+AUDIO_SPOOL_MAX_AGE_S = 24 * 3600  # Unsaved spool files are removed after this
+
+# Upload scheduling (process-wide, shared by all sessions)
+UPLOAD_MAX_CONCURRENT = 4
+UPLOAD_BYTES_PER_SECOND = 0  # 0 disables the byte-rate limit
+UPLOAD_BURST_BYTES = 8 * 1024 ** 2
+UPLOAD_MAX_QUEUED = 512  # Further uploads are rejected and retried later
+
+# Offline-capable recorder (chunks buffered in IndexedDB, synced in the background)
+OFFLINE_RECORDER = False  # Use it instead of st.audio_input
+RECORDER_CHUNK_MS = 2000  # MediaRecorder timeslice
+CHUNK_INGEST_PORT = 8502
+CHUNK_INGEST_PUBLIC_URL = ""  # Defaults to the app page's host on CHUNK_INGEST_PORT
+CHUNK_INGEST_MAX_CHUNK_BYTES = 8 * 1024 ** 2
+CHUNK_INGEST_MAX_RECORDING_BYTES = 256 * 1024 ** 2
+CHUNK_INGEST_MAX_TOTAL_BYTES = 4 * 1024 ** 3  # Across all recordings not yet saved
+CHUNK_INGEST_HOST = "127.0.0.1"  # Serve it through the proxy in front of the app ("0.0.0.0" to expose the port)
+CHUNK_INGEST_ALLOWED_ORIGINS = ["http://localhost:8501", "http://127.0.0.1:8501"]  # App origins allowed by CORS
+CHUNK_INGEST_TOKEN_TTL_S = 12 * 3600  # Lifetime of a session's upload credential
+
+# Rendering cache
+RENDER_CACHE_SIZE = 256
+PREFETCH_NOTES = 2
+STREAM_LAYOUT_MIN_CHARS = 20_000  # Longer notes are laid out card by card, first card first
 
 # Section colors and styles
 SECTION_STYLES = {
@@ -1,62 +1,477 @@
 """
 Data handling functions for Clinical Notes Application
 """
+import os
+import tempfile
+import threading
+import weakref
 import pandas as pd
-from typing import Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set
+
+import change_log
+import metrics
+import partitions
+import progress_summary
 from config import DATA_PATH
+from note_index import NoteIndex
+from audio_quality import QUALITY_COLUMNS
+
+DOCTOR_ASSIGNMENTS = {
+    "Dr. Kadri": [0, 32, 53],
+    "Dr. Mohand Akli": [0, 32, 53],
+    "Dr. Khacef": [0, 32, 53],
+    "Dr. Himer": [0, 32, 53],
+    "Dr. Smith": list(range(0, 3)),
+    "Dr. Jhones": list(range(3, 7))
+}
+
+ROW_LOCK_STRIPES = 64
+
+# Compare-and-swap runs under a per-row (striped) lock, so saves to different
+# notes do not wait on each other. The frame lock only covers the in-memory
+# cell writes, which must not interleave under pandas copy-on-write.
+_row_locks = [threading.Lock() for _ in range(ROW_LOCK_STRIPES)]
+_frame_lock = threading.RLock()
+
+_cache_lock = threading.Lock()
+_cached_df: Optional[pd.DataFrame] = None
+_cached_stamp: Optional[change_log.Stamp] = None
+_cached_index: Optional[NoteIndex] = None
+# Frames replaced by _append_cached (id -> weak reference): sessions may still
+# hold one, and their writes and saves go to the current frame instead
+_superseded: Dict[int, weakref.ref] = {}
+
+# Partitioned layout: partition frames are shared by the process and are the
+# authoritative copy; each doctor gets a view (their partitions concatenated)
+# that is rebuilt when one of its partitions changes generation.
+_parts: Dict[str, pd.DataFrame] = {}
+_part_stamps: Dict[str, change_log.Stamp] = {}
+_part_gens: Dict[str, int] = {}
+_dirty_parts: Set[str] = set()
+
+# Row number -> doctors assigned to it, for attributing summary deltas
+_row_doctors: Optional[Dict[int, List[str]]] = None
+
+_DTYPES = {
+    "audio_file": "string",
+    "validated": "boolean",
+    "additional_notes": "string"
+}
+
+
+class _PartitionView:
+    """A doctor's rows, assembled from the partitions that hold them"""
+
+    def __init__(self, df: pd.DataFrame, names: List[str], gens: tuple):
+        self.df = df
+        self.names = names
+        self.gens = gens
+        self.index: Optional[NoteIndex] = None
+
+
+_views: Dict[Optional[str], _PartitionView] = {}
+
+
+def load_data(username: Optional[str] = None) -> pd.DataFrame:
+    """
+    Load clinical notes data from CSV
+    The frame is shared by all sessions of the process and re-read only when
+    the file changes on disk; rows appended by ingest.py are read on their
+    own and added to it. If the dataset is partitioned, only the partitions
+    holding username's rows are read (all of them for None).
+    """
+    global _cached_df, _cached_stamp, _cached_index
+    root = partitions.partition_root(DATA_PATH)
+    manifest = partitions.load_manifest(root)
+    if manifest is not None:
+        return _load_view(root, manifest, username)
+
+    with _cache_lock:
+        if _cached_df is not None:
+            current = change_log.stamp(DATA_PATH)
+            if current == _cached_stamp:
+                metrics.incr("cache_hits.dataset")
+                return _cached_df
+            appended = change_log.appended_range(DATA_PATH, _cached_stamp, current, DATA_PATH)
+            if appended is not None:
+                _append_cached(*appended)
+                return _cached_df
+        metrics.incr("cache_misses.dataset")
+        _cached_df, _cached_stamp = _read_data_stamped()
+        _cached_index = None
+        _superseded.clear()
+        return _cached_df
+
+
+def _append_cached(start: int, end: int, stamp: change_log.Stamp):
+    """Extend the shared frame with rows appended to the CSV (call under _cache_lock)"""
+    global _cached_df, _cached_stamp, _cached_index
+    rows = _normalize(change_log.read_appended(DATA_PATH, start, end, dtype=_DTYPES))
+    rows.index = pd.RangeIndex(len(_cached_df), len(_cached_df) + len(rows))
+    # A new frame, so sessions still holding the old one read consistent rows;
+    # swapped in under the frame lock so no write lands in the old one after
+    # it was copied (_current redirects later writes)
+    with _frame_lock:
+        df = pd.concat([_cached_df, rows])
+        for key, ref in list(_superseded.items()):
+            if ref() is None:
+                del _superseded[key]
+        _superseded[id(_cached_df)] = weakref.ref(_cached_df)
+        if _cached_index is not None:
+            _cached_index = _cached_index.extended(rows, DOCTOR_ASSIGNMENTS)
+        _cached_df, _cached_stamp = df, stamp
+    metrics.incr("dataset.rows_appended", len(rows))
+
+
+def _current(df: pd.DataFrame) -> pd.DataFrame:
+    """The shared frame that replaced df, or df itself (call under _frame_lock)"""
+    ref = _superseded.get(id(df))
+    return _cached_df if ref is not None and ref() is df else df
+
+
+def is_partitioned() -> bool:
+    """Whether DATA_PATH has been split into partitions"""
+    return partitions.load_manifest(partitions.partition_root(DATA_PATH)) is not None
+
+
+def _load_view(root: str, manifest: dict, username: Optional[str]) -> pd.DataFrame:
+    """Assemble a doctor's frame from their partitions, re-reading changed files"""
+    names = partitions.partitions_for(manifest, username)
+    with _cache_lock:
+        for name in names:
+            if name in _parts:
+                current = change_log.stamp(partitions.partition_path(root, name))
+                if current == _part_stamps[name]:
+                    continue
+                if _append_partition(root, name, current):
+                    continue
+                # Unsaved local writes win over the file until save_data runs
+                if name in _dirty_parts:
+                    continue
+            metrics.incr("cache_misses.partition")
+            df, stamp = partitions.read_partition(root, name, _DTYPES)
+            _parts[name] = _normalize(df)
+            _part_stamps[name] = stamp
+            _part_gens[name] = _part_gens.get(name, 0) + 1
+
+        gens = tuple(_part_gens[name] for name in names)
+        view = _views.get(username)
+        if view is not None and view.gens == gens:
+            metrics.incr("cache_hits.dataset")
+            return view.df
+
+        metrics.incr("cache_misses.dataset")
+        with _frame_lock:
+            if names:
+                df = pd.concat([_parts[name] for name in names]).sort_index()
+            else:
+                df = _normalize(pd.DataFrame(columns=manifest["columns"]).astype(_DTYPES))
+        _views[username] = _PartitionView(df, names, gens)
+        return df
+
+
+def _append_partition(root: str, name: str, current: Optional[change_log.Stamp] = None) -> bool:
+    """
+    Add rows appended to a partition file to its frame (call under _cache_lock)
+    Returns False if the file changed in some other way.
+    """
+    path = partitions.partition_path(root, name)
+    appended = change_log.appended_range(path, _part_stamps[name], current, DATA_PATH)
+    if appended is None:
+        return False
+    start, end, stamp = appended
+    rows = _normalize(partitions.read_appended(root, name, start, end, _DTYPES))
+    with _frame_lock:
+        _parts[name] = pd.concat([_parts[name], rows])
+    _part_stamps[name] = stamp
+    _part_gens[name] += 1
+    metrics.incr("dataset.rows_appended", len(rows))
+    return True
+
 
+def _view_for(df: pd.DataFrame) -> Optional[_PartitionView]:
+    for view in list(_views.values()):
+        if view.df is df:
+            return view
+    return None
 
-def load_data() -> pd.DataFrame:
-    """Load clinical notes data from CSV"""
-    df = pd.read_csv(DATA_PATH, dtype={
-        "audio_file": "string",
-        "validated": "boolean",
-        "additional_notes": "string"
-    })
+
+def _read_data() -> pd.DataFrame:
+    """Read the CSV and fill missing status values"""
+    return _read_data_stamped()[0]
+
+
+def _read_data_stamped():
+    df, stamp = change_log.read_csv(DATA_PATH, dtype=_DTYPES)
+    return _normalize(df), stamp
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """Fill missing status values and columns added since the file was written"""
     df["audio_file"] = df["audio_file"].fillna("")
     df["validated"] = df["validated"].fillna(False)
     df["additional_notes"] = df["additional_notes"].fillna("")
+    for column in ("audio_hash", "notes_hash"):
+        if column not in df.columns:
+            df[column] = ""
+        df[column] = df[column].astype("string").fillna("")
+    for column in QUALITY_COLUMNS.values():
+        if column not in df.columns:
+            df[column] = float("nan")
+    if "version" not in df.columns:
+        df["version"] = 0
+    df["version"] = df["version"].fillna(0).astype("int64")
     return df
 
 
 def save_data(df: pd.DataFrame):
-    """Save clinical notes data to CSV"""
-    df.to_csv(DATA_PATH, index=False)
+    """
+    Save clinical notes data to CSV
+    For a partitioned dataset only the partitions written since the last save
+    are rewritten. Saving the shared frame (or one it replaced) writes the
+    current shared frame, after reading rows ingested since it was loaded;
+    other frames are written as they are. The progress summary is updated
+    with the writes made since the last save.
+    """
+    global _cached_stamp
+    view = _view_for(df)
+    if view is not None:
+        _save_partitions(view.names)
+        return
+    with change_log.dataset_lock(DATA_PATH), _cache_lock:
+        with _frame_lock:
+            df = _current(df)
+        if df is _cached_df:
+            appended = change_log.appended_range(DATA_PATH, _cached_stamp, data_path=DATA_PATH)
+            if appended is not None:
+                _append_cached(*appended)
+                df = _cached_df
+        with _frame_lock:
+            snapshot = df.copy()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(DATA_PATH)), suffix=".tmp")
+        with os.fdopen(fd, "w", newline="") as f:
+            snapshot.to_csv(f, index=False)
+            f.flush()
+            written = os.fstat(f.fileno())
+        os.replace(tmp_path, DATA_PATH)
+        # Otherwise the file now holds writes the cached frame lacks; re-read it
+        if df is _cached_df:
+            _cached_stamp = (written.st_size, written.st_mtime)
+        # Also counts writes made since the snapshot; the next save persists them
+        progress_summary.flush(DATA_PATH)
+
+
+def _save_partitions(names: List[str]):
+    root = partitions.partition_root(DATA_PATH)
+    with change_log.dataset_lock(DATA_PATH), _cache_lock:
+        for name in names:
+            if name not in _dirty_parts:
+                continue
+            # Keep rows ingested into the partition since it was read
+            _append_partition(root, name)
+            # Writes made after the snapshot mark the partition dirty again
+            with _frame_lock:
+                _dirty_parts.discard(name)
+                snapshot = _parts[name].copy()
+            _part_stamps[name] = partitions.write_partition(root, name, snapshot)
+            metrics.incr("partitions.written")
+        progress_summary.flush(DATA_PATH)
+
+
+def _is_shared(df: pd.DataFrame) -> bool:
+    return df is _cached_df or _view_for(df) is not None
+
+
+def get_note_index(df: pd.DataFrame) -> NoteIndex:
+    """Get the lookup index for a dataset (cached for the shared frame)"""
+    global _cached_index
+    view = _view_for(df)
+    if view is not None:
+        with _cache_lock:
+            if view.index is None:
+                view.index = NoteIndex(df, DOCTOR_ASSIGNMENTS)
+            else:
+                metrics.incr("cache_hits.note_index")
+            return view.index
+    if df is not _cached_df:
+        return NoteIndex(df, DOCTOR_ASSIGNMENTS)
+    with _cache_lock:
+        if _cached_index is None:
+            _cached_index = NoteIndex(df, DOCTOR_ASSIGNMENTS)
+        else:
+            metrics.incr("cache_hits.note_index")
+        return _cached_index
+
+
+def _update_index(df: pd.DataFrame, column: str, note_ids: Iterable[str], value):
+    """Keep the cached index in step with a write to the shared frame"""
+    if df is _cached_df and _cached_index is not None:
+        _cached_index.update(column, note_ids, value)
+    view = _view_for(df)
+    if view is not None and view.index is not None:
+        view.index.update(column, note_ids, value)
+
+
+def _doctors_for_row(row) -> List[str]:
+    global _row_doctors
+    if _row_doctors is None:
+        by_row: Dict[int, List[str]] = {}
+        for doctor, rows in DOCTOR_ASSIGNMENTS.items():
+            for assigned in rows:
+                by_row.setdefault(assigned, []).append(doctor)
+        _row_doctors = by_row
+    return _row_doctors.get(row, [])
+
+
+def _write_partitions(df: pd.DataFrame, positions: List[int], changes: Dict[str, Any]):
+    """
+    Mirror a write to a view into its partition frames and mark them dirty
+    Call under _frame_lock; row versions are taken from the partitions.
+    """
+    view = _view_for(df)
+    if view is None:
+        return
+    manifest = partitions.load_manifest(partitions.partition_root(DATA_PATH))
+    by_part: Dict[str, List[int]] = {}
+    for position in positions:
+        by_part.setdefault(manifest["row_partition"][df.index[position]], []).append(position)
+    for name, part_positions in by_part.items():
+        part = _parts[name]
+        rows = df.index[part_positions]
+        for column, value in changes.items():
+            part.loc[rows, column] = value
+        part.loc[rows, "version"] += 1
+        df.iloc[part_positions, df.columns.get_loc("version")] = part.loc[rows, "version"].to_numpy()
+        _part_gens[name] += 1
+        _dirty_parts.add(name)
 
 
 def get_doctor_note_indices(username: str) -> list:
     """Get note indices assigned to a specific doctor"""
-    doctor_assignments = {
-        "Dr. Kadri": [0, 32, 53],
-        "Dr. Mohand Akli": [0, 32, 53],
-        "Dr. Khacef": [0, 32, 53],
-        "Dr. Himer": [0, 32, 53],
-        "Dr. Smith": list(range(0, 3)),
-        "Dr. Jhones": list(range(3, 7))
-    }
-    return doctor_assignments.get(username, [])
+    return DOCTOR_ASSIGNMENTS.get(username, [])
 
 
 def get_doctor_notes(df: pd.DataFrame, username: str) -> pd.DataFrame:
     """Get notes assigned to a specific doctor"""
-    indices = get_doctor_note_indices(username)
+    indices = [i for i in get_doctor_note_indices(username) if i in df.index]
     if indices:
-        return df.iloc[indices]
+        return df.loc[indices]
     return pd.DataFrame()
 
 
-def update_audio_file(df: pd.DataFrame, note_id: str, file_path: str):
-    """Update audio file path for a note"""
-    df.loc[df["note_id"] == note_id, "audio_file"] = file_path
+class UpdateResult(NamedTuple):
+    """Outcome of a compare-and-swap row update"""
+    ok: bool
+    version: int
+    current: Dict[str, Any]
+
+
+def _positions(df: pd.DataFrame, note_id: str) -> List[int]:
+    if _is_shared(df):
+        position = get_note_index(df).position(note_id)
+        return [] if position is None else [position]
+    return (df["note_id"] == note_id).to_numpy().nonzero()[0].tolist()
+
+
+def compare_and_swap(df: pd.DataFrame, note_id: str, changes: Dict[str, Any],
+                     expected_version: Optional[int] = None) -> UpdateResult:
+    """
+    Apply changes to a note if its version still matches expected_version
+    On success the row version is incremented. On conflict nothing is written
+    and the current version and values are returned. expected_version=None
+    writes unconditionally.
+    """
+    with _frame_lock:
+        df = _current(df)
+    # Rows are only ever appended, so positions hold in a replacing frame
+    positions = _positions(df, note_id)
+    if not positions:
+        return UpdateResult(False, -1, {})
+
+    # Views may lag behind their partitions; those hold the current version
+    view = _view_for(df)
+    source = df
+    row = positions[0]
+    if view is not None:
+        manifest = partitions.load_manifest(partitions.partition_root(DATA_PATH))
+        source = _parts[manifest["row_partition"][df.index[row]]]
+        row = source.index.get_loc(df.index[row])
+
+    with _row_locks[hash(note_id) % ROW_LOCK_STRIPES], _frame_lock:
+        if view is None:
+            df = source = _current(df)
+        version = int(source["version"].iat[row])
+        if expected_version is not None and expected_version != version:
+            metrics.incr("updates.conflicts")
+            current = {column: source[column].iat[row] for column in changes}
+            return UpdateResult(False, version, current)
+
+        before = {column: source[column].iat[row] for column in progress_summary.TRACKED_COLUMNS}
+        progress_summary.record(_doctors_for_row(df.index[positions[0]]), before, changes)
+        for column, value in changes.items():
+            df.iloc[positions, df.columns.get_loc(column)] = value
+        df.iloc[positions, df.columns.get_loc("version")] = version + 1
+        _write_partitions(df, positions, changes)
+        for column, value in changes.items():
+            _update_index(df, column, [note_id], value)
+        metrics.incr("updates.applied")
+        return UpdateResult(True, version + 1, changes)
+
+
+def update_audio_file(df: pd.DataFrame, note_id: str, file_path: str, content_hash: str = "",
+                      quality: Optional[Dict[str, float]] = None,
+                      expected_version: Optional[int] = None) -> UpdateResult:
+    """Update audio file path (and its SHA-256 and quality stats) for a note"""
+    changes = {"audio_file": file_path, "audio_hash": content_hash}
+    for stat, column in QUALITY_COLUMNS.items():
+        changes[column] = quality.get(stat, float("nan")) if quality else float("nan")
+    return compare_and_swap(df, note_id, changes, expected_version)
+
+
+def update_additional_notes(df: pd.DataFrame, note_id: str, notes_path: str, content_hash: str = "",
+                            expected_version: Optional[int] = None) -> UpdateResult:
+    """Update additional notes path (and its SHA-256) for a note"""
+    changes = {"additional_notes": notes_path, "notes_hash": content_hash}
+    return compare_and_swap(df, note_id, changes, expected_version)
 
 
-def update_additional_notes(df: pd.DataFrame, note_id: str, notes_path: str):
-    """Update additional notes path for a note"""
-    df.loc[df["note_id"] == note_id, "additional_notes"] = notes_path
+def apply_validation(df: pd.DataFrame, changes: Dict[str, bool]) -> int:
+    """
+    Set the validated flag for many notes at once
+    changes maps note_id -> validated; returns the number of rows updated.
+    Call save_data once afterwards to persist the whole batch.
+    """
+    updated = 0
+    stripes = sorted({hash(note_id) % ROW_LOCK_STRIPES for note_id in changes})
+    for stripe in stripes:
+        _row_locks[stripe].acquire()
+    try:
+        for value in (True, False):
+            note_ids = [note_id for note_id, validated in changes.items() if validated is value]
+            if not note_ids:
+                continue
+            with _frame_lock:
+                df = _current(df)
+                mask = df["note_id"].isin(note_ids)
+                previous = df.loc[mask, "validated"]
+                for row, validated in zip(previous.index.tolist(), previous.tolist()):
+                    progress_summary.record(_doctors_for_row(row), {"validated": validated}, {"validated": value})
+                df.loc[mask, "validated"] = value
+                df.loc[mask, "version"] += 1
+                _write_partitions(df, mask.to_numpy().nonzero()[0].tolist(), {"validated": value})
+                _update_index(df, "validated", note_ids, value)
+            updated += int(mask.sum())
+    finally:
+        for stripe in reversed(stripes):
+            _row_locks[stripe].release()
+    return updated
 
 
 def get_note_by_id(df: pd.DataFrame, note_id: str) -> Optional[pd.Series]:
     """Get a specific note by ID"""
+    if _is_shared(df):
+        position = get_note_index(df).position(note_id)
+        return None if position is None else df.iloc[position]
     notes = df[df["note_id"] == note_id]
     if notes.empty:
         return None
@@ -0,0 +1,313 @@
+"""
+Export recorded notes as an ASR training dataset
+
+Streams the notes that have audio (from the partitions when the dataset is
+partitioned), fetches recordings in parallel (local content-addressed store
+first, then the storage backend), resamples them to 16 kHz mono 16-bit WAV
+and writes WebDataset-style tar shards. Each sample is added to the open
+shard as soon as it is ready, so only the recordings in flight are held in
+memory. WebM/Ogg/MP4 takes from the offline recorder are decoded with
+ffmpeg; rows that cannot be decoded are counted and reported.
+
+    <key>.wav  <key>.txt  <key>.transcript.txt  <key>.json
+
+Completed shards are listed in manifest.jsonl with the note IDs they hold;
+re-running the command exports only notes not yet in a shard, so audio saved
+between runs neither shifts nor duplicates what was already written.
+
+Usage:
+    python export_dataset.py out_dir --shard-size 500 --workers 8
+"""
+import argparse
+import io
+import json
+import math
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+import wave
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+import partitions
+from config import DATA_PATH
+from utils import safe_filename
+
+TARGET_RATE = 16000
+RESAMPLE_ZERO_CROSSINGS = 16  # Filter half-length, in zero crossings of the sinc
+RESAMPLE_ROLLOFF = 0.95  # Passband edge as a fraction of the lower Nyquist rate
+MANIFEST = "manifest.jsonl"
+
+
+def iter_recorded_notes(data_path: str, chunksize: int = 1000) -> Iterator[dict]:
+    """
+    Yield rows that have audio, reading the CSV in chunks
+    A partitioned dataset is saved only to its partitions, so those are read
+    (one after another) instead of the CSV.
+    """
+    root = partitions.partition_root(data_path)
+    manifest = partitions.load_manifest(root)
+    if manifest is None:
+        paths = [data_path]
+    else:
+        paths = [partitions.partition_path(root, name) for name in manifest["partitions"]]
+    for path in paths:
+        for chunk in pd.read_csv(path, chunksize=chunksize, dtype=str, keep_default_na=False):
+            chunk = chunk[chunk["audio_file"] != ""]
+            for row in chunk.to_dict("records"):
+                yield row
+
+
+def fetch_audio(row: dict) -> bytes:
+    """
+    Get a recording from the local store if present, else from the storage
+    backend, else (rows saved before content addressing) from its URL
+    """
+    content_hash = row.get("audio_hash", "")
+    if content_hash:
+        from blob_store import get_audio_store
+        from storage import get_storage
+        ext = os.path.splitext(urlparse(row["audio_file"]).path)[1] or ".wav"
+        store = get_audio_store(ext)
+        data = store.get(content_hash)
+        if data is None:
+            data = get_storage().get(store.remote_key(content_hash))
+        if data is not None:
+            return data
+    from utils import get_http_session
+    response = get_http_session().get(row["audio_file"], timeout=60)
+    response.raise_for_status()
+    return response.content
+
+
+def decode_wav(data: bytes):
+    """Decode PCM WAV bytes to (mono float32 samples in [-1, 1], sample rate)"""
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype="<i4").astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def _resample_weights(up: int, down: int):
+    """Windowed-sinc taps for each of the up output phases, and taps per side"""
+    cutoff = RESAMPLE_ROLLOFF * min(1.0, up / down)  # fraction of the input Nyquist rate
+    half = int(np.ceil(RESAMPLE_ZERO_CROSSINGS / cutoff))
+    offsets = np.arange(-half, half + 1)
+    distance = np.arange(up)[:, None] / up - offsets[None, :]
+    window = np.clip(distance / (half + 1), -1, 1)
+    blackman = 0.42 + 0.5 * np.cos(np.pi * window) + 0.08 * np.cos(2 * np.pi * window)
+    weights = cutoff * np.sinc(cutoff * distance) * blackman
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32), half
+
+
+def decode_audio(data: bytes, ext: str):
+    """Decode a recording to (mono float32 samples, sample rate): WAV natively, others with ffmpeg"""
+    if data[:4] == b"RIFF":
+        return decode_wav(data)
+    if not shutil.which("ffmpeg"):
+        raise ValueError(f"ffmpeg is required to decode {ext or 'non-WAV'} recordings")
+    result = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", "pipe:0", "-ac", "1", "-ar", str(TARGET_RATE),
+         "-f", "s16le", "pipe:1"],
+        input=data, capture_output=True, check=True,
+    )
+    return np.frombuffer(result.stdout, dtype="<i2").astype(np.float32) / 32768, TARGET_RATE
+
+
+def resample(samples: np.ndarray, rate: int, target_rate: int = TARGET_RATE) -> np.ndarray:
+    """
+    Polyphase resampling with a windowed-sinc low-pass filter
+    Content above the lower of the two Nyquist rates is filtered out rather
+    than aliased into the output.
+    """
+    if rate == target_rate or not len(samples):
+        return samples
+    g = math.gcd(rate, target_rate)
+    up, down = target_rate // g, rate // g
+    weights, half = _resample_weights(up, down)
+    padded = np.pad(samples.astype(np.float32), (half, half + 1))
+    taps = np.arange(2 * half + 1)
+    target_len = int(round(len(samples) * up / down))
+    out = np.empty(target_len, dtype=np.float32)
+    block = max(1, 4_000_000 // len(taps))
+    for start in range(0, target_len, block):
+        position = np.arange(start, min(start + block, target_len)) * down
+        base, phase = position // up, position % up
+        out[start:start + len(base)] = (padded[base[:, None] + taps] * weights[phase]).sum(axis=1)
+    return out
+
+
+def encode_wav(samples: np.ndarray, rate: int = TARGET_RATE) -> bytes:
+    """Encode float samples as mono 16-bit PCM WAV"""
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def prepare_sample(row: dict) -> Optional[dict]:
+    """Fetch and resample one recording; None if it cannot be used"""
+    try:
+        ext = os.path.splitext(urlparse(row["audio_file"]).path)[1]
+        samples, rate = decode_audio(fetch_audio(row), ext)
+    except Exception as e:
+        print(f"skipping {row['note_id']}: {e}")
+        return None
+    samples = resample(samples, rate)
+    return {
+        "key": safe_filename(row["note_id"]).replace(".", "_"),
+        "wav": encode_wav(samples),
+        "text": row.get("raw_text", ""),
+        "transcript": row.get("transcript", ""),
+        "metadata": {
+            "note_id": row["note_id"],
+            "audio_file": row["audio_file"],
+            "audio_hash": row.get("audio_hash", ""),
+            "validated": row.get("validated", ""),
+            "duration_s": len(samples) / TARGET_RATE,
+            "sample_rate": TARGET_RATE,
+        },
+    }
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def prepare_samples(pool: Executor, rows: Iterable[dict], in_flight: int) -> Iterator[dict]:
+    """Prepared samples of rows in completion order, with at most in_flight pending"""
+    pending = set()
+    for row in rows:
+        pending.add(pool.submit(prepare_sample, row))
+        if len(pending) >= in_flight:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (f.result() for f in finished if f.result() is not None)
+    while pending:
+        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+        yield from (f.result() for f in finished if f.result() is not None)
+
+
+def write_shard(out_dir: str, shard: int, samples: Iterable[dict]) -> Tuple[str, List[dict]]:
+    """
+    Write one tar shard atomically, adding samples as they are produced
+    Returns its file name and the metadata of the samples written.
+    """
+    name = f"shard-{shard:06d}.tar"
+    tmp_path = os.path.join(out_dir, name + ".tmp")
+    written = []
+    with tarfile.open(tmp_path, "w") as tar:
+        for sample in samples:
+            key = sample["key"]
+            _add_member(tar, f"{key}.wav", sample["wav"])
+            _add_member(tar, f"{key}.txt", sample["text"].encode("utf-8"))
+            _add_member(tar, f"{key}.transcript.txt", sample["transcript"].encode("utf-8"))
+            _add_member(tar, f"{key}.json", json.dumps(sample["metadata"], ensure_ascii=False).encode("utf-8"))
+            written.append(sample["metadata"])
+    os.replace(tmp_path, os.path.join(out_dir, name))
+    return name, written
+
+
+def load_manifest(out_dir: str) -> List[dict]:
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def exported_note_ids(out_dir: str, entry: dict) -> List[str]:
+    """Note IDs in a completed shard (read from the shard for older manifests)"""
+    if "note_ids" in entry:
+        return entry["note_ids"]
+    with tarfile.open(os.path.join(out_dir, entry["shard"])) as tar:
+        return [
+            json.load(tar.extractfile(member))["note_id"]
+            for member in tar.getmembers() if member.name.endswith(".json")
+        ]
+
+
+def export(data_path: str, out_dir: str, shard_size: int, workers: int):
+    os.makedirs(out_dir, exist_ok=True)
+    completed = load_manifest(out_dir)
+    done = {note_id for entry in completed for note_id in exported_note_ids(out_dir, entry)}
+    shard = len(completed)
+    if completed:
+        print(f"resuming after {shard} shard(s), skipping {len(done)} exported notes")
+
+    rows = (row for row in iter_recorded_notes(data_path) if row["note_id"] not in done)
+
+    start = time.perf_counter()
+    exported = 0
+    skipped = 0
+    audio_seconds = 0.0
+    out_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            batch = [row for _, row in zip(range(shard_size), rows)]
+            if not batch:
+                break
+            name, samples = write_shard(out_dir, shard, prepare_samples(pool, batch, 2 * workers))
+
+            with open(os.path.join(out_dir, MANIFEST), "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "shard": name, "rows": len(batch), "samples": len(samples),
+                    "skipped": len(batch) - len(samples),
+                    "note_ids": [metadata["note_id"] for metadata in samples],
+                }, ensure_ascii=False) + "\n")
+
+            shard += 1
+            exported += len(samples)
+            skipped += len(batch) - len(samples)
+            audio_seconds += sum(metadata["duration_s"] for metadata in samples)
+            out_bytes += os.path.getsize(os.path.join(out_dir, name))
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name}: {len(samples)} samples | {exported / elapsed:.1f} notes/s, "
+                f"{out_bytes / elapsed / 1e6:.2f} MB/s, {audio_seconds / elapsed:.1f} audio s/s"
+            )
+
+    print(f"done: {exported} samples in {time.perf_counter() - start:.1f}s")
+    if skipped:
+        print(f"{skipped} row(s) with audio skipped (see the messages above); they are retried on the next run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Directory for shards and manifest")
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV (its partitions are read if it has been partitioned)")
+    parser.add_argument("--shard-size", type=int, default=500, help="Notes per shard")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel audio fetches")
+    args = parser.parse_args()
+    export(args.data, args.out_dir, args.shard_size, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Incremental ingestion of new clinical notes
+
+Watches a drop directory (INGEST_DIR) for new admissions instead of editing
+the dataset by hand. Accepted formats:
+
+    *.csv   a raw_text column and optionally note_id (other columns are ignored)
+    *.json  an object, or a list of objects, with raw_text and optionally note_id
+    *.txt   one note per file
+
+Every note is validated and deduplicated against the dataset by a SHA-256 of
+its text (whitespace at line ends ignored); notes without a note_id get one
+derived from that hash. A file with an invalid note is rejected as a whole.
+Accepted notes are appended without rewriting existing rows: to the end of
+DATA_PATH, or to the unassigned partition if the dataset is partitioned. Each
+append is recorded in the change log (see change_log.py), so running workers
+read only the new rows on their next load instead of the whole file. The new
+row numbers are printed, for adding the notes to DOCTOR_ASSIGNMENTS.
+
+Processed files are moved to <drop dir>/processed; rejected ones to
+<drop dir>/rejected, with the reasons in <name>.errors.txt. Write files
+elsewhere and move them in, or they may be picked up half-written.
+
+Usage:
+    python ingest.py                # process the drop directory once
+    python ingest.py --watch        # keep polling it
+    python ingest.py --dry-run      # report without writing anything
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Set, Tuple
+
+import pandas as pd
+
+import change_log
+import metrics
+import partitions
+import progress_summary
+from config import DATA_PATH, INGEST_DIR, INGEST_MAX_NOTE_BYTES, INGEST_POLL_SECONDS
+
+FORMATS = (".csv", ".json", ".txt")
+PROCESSED = "processed"
+REJECTED = "rejected"
+SETTLE_SECONDS = 2  # Files modified more recently may still be being written
+
+
+class IngestError(Exception):
+    """A drop file that cannot be read"""
+
+
+def clean_text(text: str) -> str:
+    """Normalize line endings and strip trailing whitespace"""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def note_hash(text: str) -> str:
+    """Content hash used for deduplication"""
+    return hashlib.sha256(clean_text(text).encode("utf-8")).hexdigest()
+
+
+def read_drop_file(path: str) -> List[dict]:
+    """Parse a drop file into [{"note_id", "raw_text"}]"""
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == ".txt":
+            with open(path, encoding="utf-8") as f:
+                return [{"note_id": "", "raw_text": f.read()}]
+        if ext == ".json":
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            records = data if isinstance(data, list) else [data]
+            if not all(isinstance(record, dict) for record in records):
+                raise IngestError("expected an object or a list of objects")
+        elif ext == ".csv":
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)
+            if "raw_text" not in df.columns:
+                raise IngestError("missing raw_text column")
+            records = df.to_dict("records")
+        else:
+            raise IngestError(f"unsupported format {ext}")
+    except (UnicodeDecodeError, ValueError, pd.errors.ParserError) as e:
+        raise IngestError(str(e)) from e
+    return [
+        {"note_id": str(record.get("note_id") or "").strip(), "raw_text": record.get("raw_text")}
+        for record in records
+    ]
+
+
+def validate(records: List[dict], known_ids: Set[str],
+             known_hashes: Set[str]) -> Tuple[List[dict], int, List[str]]:
+    """
+    Check a file's records against the dataset and earlier files
+    Returns (new notes, number of duplicates, errors).
+    """
+    accepted = []
+    duplicates = 0
+    errors = []
+    ids = set()
+    hashes = set()
+    for i, record in enumerate(records, start=1):
+        text = record["raw_text"]
+        if not isinstance(text, str) or not clean_text(text):
+            errors.append(f"record {i}: empty or missing raw_text")
+            continue
+        text = clean_text(text)
+        if len(text.encode("utf-8")) > INGEST_MAX_NOTE_BYTES:
+            errors.append(f"record {i}: raw_text larger than {INGEST_MAX_NOTE_BYTES} bytes")
+            continue
+        digest = note_hash(text)
+        if digest in known_hashes or digest in hashes:
+            duplicates += 1
+            continue
+        note_id = record["note_id"] or f"ingest:{digest[:16]}"
+        if any(c in note_id for c in "\r\n"):
+            errors.append(f"record {i}: note_id contains a line break")
+            continue
+        if note_id in known_ids or note_id in ids:
+            errors.append(f"record {i}: note_id {note_id} already exists with different text")
+            continue
+        ids.add(note_id)
+        hashes.add(digest)
+        accepted.append({"note_id": note_id, "raw_text": text, "hash": digest})
+    return accepted, duplicates, errors
+
+
+def _load_dataset(data_path: str) -> pd.DataFrame:
+    import data_handler
+    data_handler.DATA_PATH = data_path
+    return data_handler.load_data()
+
+
+def _row(columns: List[str], row_number: int, note: dict) -> list:
+    values = {"row": row_number, "note_id": note["note_id"], "raw_text": note["raw_text"], "version": 0}
+    return [values.get(column, "") for column in columns]
+
+
+def _summary_deltas(rows: List[int]) -> Dict[str, Dict[str, int]]:
+    """Note counts added to the progress summary by appending rows"""
+    from data_handler import DOCTOR_ASSIGNMENTS
+    new_rows = set(rows)
+    deltas = {progress_summary.ALL: {"total": len(rows)}}
+    for doctor, assigned in DOCTOR_ASSIGNMENTS.items():
+        count = len(new_rows.intersection(assigned))
+        if count:
+            deltas[doctor] = {"total": count}
+    return deltas
+
+
+def append_notes(notes: List[dict], data_path: str = DATA_PATH) -> List[int]:
+    """
+    Append notes to the dataset (or its unassigned partition) and log the
+    append; returns their row numbers
+    """
+    root = partitions.partition_root(data_path)
+    note_ids = [note["note_id"] for note in notes]
+    with change_log.dataset_lock(data_path):
+        manifest = partitions.load_manifest(root)
+        if manifest is None:
+            columns = change_log.read_header(data_path)
+            first = len(_load_dataset(data_path))
+            rows = list(range(first, first + len(notes)))
+            change_log.append_rows(
+                data_path, columns, [_row(columns, n, note) for n, note in zip(rows, notes)],
+                note_ids, rows, data_path,
+            )
+            progress_summary.apply_deltas(_summary_deltas(rows), data_path)
+            return rows
+
+        manifest = partitions.read_manifest(root)
+        first = max((row for info in manifest["partitions"].values() for row in info["rows"]), default=-1) + 1
+        rows = list(range(first, first + len(notes)))
+        path = partitions.partition_path(root, partitions.UNASSIGNED)
+        columns = change_log.read_header(path) or ["row"] + manifest["columns"]
+        change_log.append_rows(
+            path, columns, [_row(columns, n, note) for n, note in zip(rows, notes)],
+            note_ids, rows, data_path,
+        )
+        # Rows are in the file before the manifest lists them
+        unassigned = manifest["partitions"].setdefault(partitions.UNASSIGNED, {"doctors": [], "rows": []})
+        unassigned["rows"].extend(rows)
+        partitions.write_manifest(root, manifest)
+        progress_summary.apply_deltas(_summary_deltas(rows), data_path)
+        return rows
+
+
+def _move(path: str, folder: str) -> str:
+    os.makedirs(folder, exist_ok=True)
+    base, ext = os.path.splitext(os.path.basename(path))
+    target = os.path.join(folder, base + ext)
+    suffix = 1
+    while os.path.exists(target):
+        target = os.path.join(folder, f"{base}.{suffix}{ext}")
+        suffix += 1
+    shutil.move(path, target)
+    return target
+
+
+def pending_files(drop_dir: str) -> List[str]:
+    """Drop files ready to be ingested, oldest first"""
+    if not os.path.isdir(drop_dir):
+        return []
+    now = time.time()
+    files = []
+    for name in os.listdir(drop_dir):
+        path = os.path.join(drop_dir, name)
+        if name.startswith(".") or not name.lower().endswith(FORMATS) or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) < SETTLE_SECONDS:
+            continue
+        files.append(path)
+    return sorted(files, key=os.path.getmtime)
+
+
+def ingest_once(drop_dir: str = INGEST_DIR, data_path: str = DATA_PATH,
+                dry_run: bool = False) -> Dict[str, int]:
+    """Ingest every pending file in the drop directory as one append"""
+    summary = {"files": 0, "notes": 0, "duplicates": 0, "rejected": 0}
+    files = pending_files(drop_dir)
+    if not files:
+        return summary
+
+    df = _load_dataset(data_path)
+    known_ids = set(df["note_id"])
+    known_hashes = {note_hash(text) for text in df["raw_text"].fillna("").astype(str)}
+
+    batch = []
+    outcomes = []
+    for path in files:
+        try:
+            accepted, duplicates, errors = validate(read_drop_file(path), known_ids, known_hashes)
+        except (OSError, IngestError) as e:
+            accepted, duplicates, errors = [], 0, [str(e)]
+        summary["files"] += 1
+        summary["duplicates"] += duplicates
+        if errors:
+            summary["rejected"] += 1
+            outcomes.append((path, None, duplicates, errors))
+            continue
+        known_ids.update(note["note_id"] for note in accepted)
+        known_hashes.update(note["hash"] for note in accepted)
+        outcomes.append((path, accepted, duplicates, errors))
+        batch.extend(accepted)
+
+    rows = []
+    if batch and not dry_run:
+        rows = append_notes(batch, data_path)
+        metrics.incr("ingest.notes", len(batch))
+    summary["notes"] = len(batch)
+    row_of = dict(zip((note["note_id"] for note in batch), rows))
+
+    for path, accepted, duplicates, errors in outcomes:
+        name = os.path.basename(path)
+        if accepted is None:
+            print(f"REJECTED {name}: " + "; ".join(errors))
+            if not dry_run:
+                target = _move(path, os.path.join(drop_dir, REJECTED))
+                with open(target + ".errors.txt", "w", encoding="utf-8") as f:
+                    f.write("\n".join(errors) + "\n")
+            continue
+        added = ", ".join(f"{note['note_id']} (row {row_of.get(note['note_id'], '?')})" for note in accepted)
+        print(f"{name}: {len(accepted)} new, {duplicates} duplicate" + (f" - {added}" if added else ""))
+        if not dry_run:
+            _move(path, os.path.join(drop_dir, PROCESSED))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drop-dir", default=INGEST_DIR, help="Directory watched for new notes")
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV")
+    parser.add_argument("--watch", action="store_true", help="Keep polling the drop directory")
+    parser.add_argument("--interval", type=float, default=INGEST_POLL_SECONDS, help="Polling interval (s)")
+    parser.add_argument("--dry-run", action="store_true", help="Validate and report without writing")
+    args = parser.parse_args()
+
+    os.makedirs(args.drop_dir, exist_ok=True)
+    while True:
+        summary = ingest_once(args.drop_dir, args.data, args.dry_run)
+        if summary["files"] or not args.watch:
+            print(
+                f"{summary['files']} file(s): {summary['notes']} note(s) "
+                f"{'to append' if args.dry_run else 'appended'}, "
+                f"{summary['duplicates']} duplicate(s), {summary['rejected']} rejected"
+            )
+        if not args.watch:
+            break
+        try:
+            time.sleep(args.interval)
+        except KeyboardInterrupt:
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Opt-in instrumentation for the Clinical Notes Application
+
+Set CLINICAL_METRICS=1 to enable timing spans and counters. Each rerun is then
+logged as one JSON line, and CLINICAL_METRICS_PORT exposes the process totals
+in Prometheus text format. When disabled, spans are a shared no-op context and
+decorated functions are returned unchanged.
+
+Set CLINICAL_PROFILE=cprofile (or pyinstrument) to allow per-session profile
+capture; a session opts in with the ?profile=1 query parameter.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+ENABLED = os.environ.get("CLINICAL_METRICS", "").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.environ.get("CLINICAL_METRICS_PORT", "0") or 0)
+PROFILER = os.environ.get("CLINICAL_PROFILE", "").lower()
+PROFILE_DIR = os.environ.get("CLINICAL_PROFILE_DIR", "profiles")
+
+logger = logging.getLogger("clinical.metrics")
+if ENABLED and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_NOOP = nullcontext()
+_lock = threading.Lock()
+_local = threading.local()
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_span_totals: Dict[str, list] = {}
+_server: Optional[ThreadingHTTPServer] = None
+
+
+def _current_rerun() -> Optional[dict]:
+    return getattr(_local, "rerun", None)
+
+
+def _record(name: str, elapsed: float):
+    with _lock:
+        totals = _span_totals.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+    rerun = _current_rerun()
+    if rerun is not None:
+        spans = rerun["spans"]
+        spans[name] = spans.get(name, 0.0) + elapsed * 1000
+
+
+@contextmanager
+def _timed_span(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def span(name: str):
+    """Time a block of code as a named stage of the current rerun"""
+    if not ENABLED:
+        return _NOOP
+    return _timed_span(name)
+
+
+def timed(name: str):
+    """Decorator version of span; a no-op when metrics are disabled"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _timed_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(name: str, seconds: float):
+    """Record a duration measured elsewhere (e.g. time spent queued) as a span"""
+    if not ENABLED:
+        return
+    _record(name, seconds)
+
+
+def incr(name: str, value: float = 1):
+    """Increment a process-wide counter"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    rerun = _current_rerun()
+    if rerun is not None:
+        counters = rerun["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float):
+    """Set a process-wide gauge"""
+    if not ENABLED:
+        return
+    with _lock:
+        _gauges[name] = value
+
+
+def _start_profiler():
+    if PROFILER == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def _stop_profiler(profiler, session_id: str):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    base = os.path.join(PROFILE_DIR, f"{session_id}_{stamp}_{time.time_ns() % 10**6:06d}")
+    if hasattr(profiler, "output_html"):
+        profiler.stop()
+        with open(base + ".html", "w") as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        profiler.dump_stats(base + ".prof")
+
+
+@contextmanager
+def rerun(session_id: str = "", profile: bool = False):
+    """Wrap one script run: collect its spans and emit a JSON log line"""
+    if not ENABLED:
+        yield
+        return
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
+    _local.rerun = {"spans": {}, "counters": {}}
+    profiler = _start_profiler() if profile and PROFILER else None
+    start = time.perf_counter()
+    try:
+        with _timed_span("rerun"):
+            yield
+    finally:
+        total_ms = (time.perf_counter() - start) * 1000
+        if profiler is not None:
+            _stop_profiler(profiler, session_id or "session")
+        record = _local.rerun
+        _local.rerun = None
+        incr("reruns")
+        logger.info(json.dumps({
+            "event": "rerun",
+            "session": session_id,
+            "total_ms": round(total_ms, 3),
+            "spans_ms": {k: round(v, 3) for k, v in record["spans"].items()},
+            "counters": record["counters"],
+        }))
+
+
+def _metric_name(name: str) -> str:
+    return "clinical_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def render_prometheus() -> str:
+    """Render process totals in Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            metric = _metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in sorted(_gauges.items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        if _span_totals:
+            lines.append("# TYPE clinical_span_seconds summary")
+        for name, (count, total) in sorted(_span_totals.items()):
+            lines.append(f'clinical_span_seconds_count{{span="{name}"}} {count}')
+            lines.append(f'clinical_span_seconds_sum{{span="{name}"}} {total:.6f}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int):
+    """Serve /metrics on the given port (once per process)"""
+    global _server
+    with _lock:
+        if _server is not None:
+            return
+        try:
+            _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            logger.warning(f"Metrics server not started on port {port}: {e}")
+            _server = False
+            return
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
@@ -0,0 +1,99 @@
+"""
+In-memory index over the clinical notes dataset
+
+Keeps note_id -> row position, doctor -> assigned note IDs and the set of
+notes in each status (audio, additional notes, validated), so per-doctor
+lookups and progress summaries cost O(assigned notes) instead of a scan of
+the whole DataFrame. The index is updated in place by the data_handler
+write functions, and extended when ingested rows are appended to the frame.
+"""
+import copy
+from typing import Dict, Iterable, List, Set
+
+import pandas as pd
+
+STATUS_COLUMNS = ("audio_file", "additional_notes", "validated")
+
+
+def is_set(column: str, value) -> bool:
+    if column == "validated":
+        return bool(value) if not pd.isna(value) else False
+    return bool(value) if isinstance(value, str) else False
+
+
+class NoteIndex:
+    """Lookup structures built once per loaded dataset"""
+
+    def __init__(self, df: pd.DataFrame, assignments: Dict[str, List[int]]):
+        note_ids = df["note_id"].tolist()
+        self.positions: Dict[str, int] = {note_id: i for i, note_id in enumerate(note_ids)}
+        # Assignments refer to row numbers, which are the index labels (a
+        # partitioned frame holds only some rows)
+        self.by_row: Dict[int, str] = dict(zip(df.index.tolist(), note_ids))
+        self.doctor_notes: Dict[str, List[str]] = {
+            doctor: [self.by_row[i] for i in indices if i in self.by_row]
+            for doctor, indices in assignments.items()
+        }
+        self.status: Dict[str, Set[str]] = {column: set() for column in STATUS_COLUMNS}
+        self._add_status(df)
+
+    def _add_status(self, df: pd.DataFrame):
+        for column in STATUS_COLUMNS:
+            if column == "validated":
+                mask = df[column].fillna(False).astype(bool)
+            else:
+                mask = df[column].fillna("").astype(str).str.len() > 0
+            self.status[column].update(df.loc[mask.to_numpy(), "note_id"])
+
+    def extended(self, rows: pd.DataFrame, assignments: Dict[str, List[int]]) -> "NoteIndex":
+        """
+        Copy of the index for the frame with rows appended at the end
+        Only the doctors assigned one of the new rows are recomputed; the
+        original is left untouched for sessions still holding the old frame.
+        """
+        index = copy.copy(self)
+        start = len(self.by_row)
+        note_ids = rows["note_id"].tolist()
+        index.positions = dict(self.positions)
+        index.positions.update((note_id, start + i) for i, note_id in enumerate(note_ids))
+        index.by_row = dict(self.by_row)
+        index.by_row.update(zip(rows.index.tolist(), note_ids))
+        new_rows = set(rows.index.tolist())
+        index.doctor_notes = dict(self.doctor_notes)
+        for doctor, indices in assignments.items():
+            if new_rows.intersection(indices):
+                index.doctor_notes[doctor] = [index.by_row[i] for i in indices if i in index.by_row]
+        index.status = {column: set(notes) for column, notes in self.status.items()}
+        index._add_status(rows)
+        return index
+
+    def position(self, note_id: str):
+        """Row position of a note, or None"""
+        return self.positions.get(note_id)
+
+    def notes_for(self, username: str) -> List[str]:
+        """Note IDs assigned to a doctor, in assignment order"""
+        return self.doctor_notes.get(username, [])
+
+    def has(self, column: str, note_id: str) -> bool:
+        return note_id in self.status[column]
+
+    def update(self, column: str, note_ids: Iterable[str], value):
+        """Record a write to a status column"""
+        if column not in self.status:
+            return
+        target = self.status[column]
+        if is_set(column, value):
+            target.update(note_ids)
+        else:
+            target.difference_update(note_ids)
+
+    def progress(self, username: str) -> Dict[str, int]:
+        """Per-doctor counts of assigned, recorded, annotated and validated notes"""
+        assigned = set(self.notes_for(username))
+        return {
+            "total": len(assigned),
+            "audio": len(assigned & self.status["audio_file"]),
+            "notes": len(assigned & self.status["additional_notes"]),
+            "validated": len(assigned & self.status["validated"]),
+        }
@@ -0,0 +1,193 @@
+"""
+Partitioned storage layout for the clinical notes dataset
+
+Rows are grouped by the set of doctors assigned to them, and each group is
+stored as its own CSV under <data dir>/PARTITION_DIR, with a manifest mapping
+partitions to doctors and row numbers. Every row lives in exactly one
+partition, so a session loads only the partitions of its doctor and a save
+rewrites only the partitions it touched. Row numbers (positions in the
+original CSV) are kept as the frame index, so DOCTOR_ASSIGNMENTS still apply.
+
+Build or rebuild the partitions (also after changing assignments):
+    python partitions.py build
+Write the partitions back to a single CSV (for export tools):
+    python partitions.py merge --out clinical_notes.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import change_log
+from config import DATA_PATH, PARTITION_DIR
+
+MANIFEST = "manifest.json"
+UNASSIGNED = "unassigned"
+
+_lock = threading.Lock()
+_manifest_cache: Dict[str, tuple] = {}
+
+
+def partition_root(data_path: str = DATA_PATH) -> str:
+    """Directory holding the partitions of a dataset"""
+    return os.path.join(os.path.dirname(os.path.abspath(data_path)), PARTITION_DIR)
+
+
+def partition_name(doctors: List[str]) -> str:
+    """Stable file name for the partition shared by a set of doctors"""
+    if not doctors:
+        return UNASSIGNED
+    key = "\n".join(sorted(doctors)).encode("utf-8")
+    return "group-" + hashlib.sha1(key).hexdigest()[:12]
+
+
+def partition_path(root: str, name: str) -> str:
+    return os.path.join(root, name + ".csv")
+
+
+def load_manifest(root: str) -> Optional[dict]:
+    """
+    Read the manifest (cached until the file changes), or None if the dataset
+    is not partitioned. Adds a "row_partition" map of row number -> partition.
+    """
+    path = os.path.join(root, MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _manifest_cache.get(root)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest["row_partition"] = {
+            row: name for name, info in manifest["partitions"].items() for row in info["rows"]
+        }
+        _manifest_cache[root] = (mtime, manifest)
+        return manifest
+
+
+def partitions_for(manifest: dict, username: Optional[str] = None) -> List[str]:
+    """Partitions holding a doctor's rows, or every partition if username is None"""
+    return sorted(
+        name for name, info in manifest["partitions"].items()
+        if username is None or username in info["doctors"]
+    )
+
+
+def read_partition(root: str, name: str, dtype: Dict[str, str]) -> Tuple[pd.DataFrame, change_log.Stamp]:
+    """Read one partition, indexed by row number, with the stamp of the file read"""
+    df, stamp = change_log.read_csv(partition_path(root, name), dtype=dtype, index_col="row")
+    df.index.name = None
+    return df, stamp
+
+
+def read_appended(root: str, name: str, start: int, end: int, dtype: Dict[str, str]) -> pd.DataFrame:
+    """Read the rows appended to a partition in bytes [start, end)"""
+    df = change_log.read_appended(partition_path(root, name), start, end, dtype=dtype, index_col="row")
+    df.index.name = None
+    return df
+
+
+def _atomic_write(path: str, write) -> change_log.Stamp:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            write(f)
+            f.flush()
+            written = os.fstat(f.fileno())
+        os.replace(tmp_path, path)
+        return written.st_size, written.st_mtime
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_partition(root: str, name: str, df: pd.DataFrame) -> change_log.Stamp:
+    """Atomically replace one partition file; returns the stamp of the new file"""
+    return _atomic_write(partition_path(root, name), lambda f: df.to_csv(f, index_label="row"))
+
+
+def write_manifest(root: str, manifest: dict):
+    """Atomically replace the manifest (without the derived row_partition map)"""
+    manifest = {key: value for key, value in manifest.items() if key != "row_partition"}
+    _atomic_write(os.path.join(root, MANIFEST), lambda f: json.dump(manifest, f, indent=1))
+
+
+def read_manifest(root: str) -> dict:
+    """Uncached copy of the manifest, for modifying it"""
+    with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build(df: pd.DataFrame, assignments: Dict[str, List[int]], root: str) -> dict:
+    """
+    Split a full dataset (indexed by row number) into partitions and write the
+    manifest last, so readers never see a manifest without its files
+    """
+    os.makedirs(root, exist_ok=True)
+    doctors_by_row: Dict[int, List[str]] = {}
+    for doctor, rows in assignments.items():
+        for row in rows:
+            if row in df.index:
+                doctors_by_row.setdefault(row, []).append(doctor)
+
+    groups: Dict[str, List[int]] = {}
+    members: Dict[str, List[str]] = {}
+    for row in df.index:
+        doctors = sorted(set(doctors_by_row.get(row, [])))
+        name = partition_name(doctors)
+        groups.setdefault(name, []).append(int(row))
+        members[name] = doctors
+
+    for name, rows in groups.items():
+        write_partition(root, name, df.loc[rows])
+
+    manifest = {
+        "columns": list(df.columns),
+        "partitions": {
+            name: {"doctors": members[name], "rows": rows} for name, rows in groups.items()
+        },
+    }
+    write_manifest(root, manifest)
+
+    # Remove partitions left over from an earlier assignment layout
+    for file_name in os.listdir(root):
+        if file_name.endswith(".csv") and file_name[:-4] not in groups:
+            os.remove(os.path.join(root, file_name))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["build", "merge"])
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV")
+    parser.add_argument("--out", help="Output CSV for merge (default: --data)")
+    args = parser.parse_args()
+
+    import data_handler
+    data_handler.DATA_PATH = args.data
+    root = partition_root(args.data)
+
+    # Rebuilds start from the partitions, which hold the latest writes
+    with change_log.dataset_lock(args.data):
+        df = data_handler.load_data()
+        if args.command == "build":
+            manifest = build(df, data_handler.DOCTOR_ASSIGNMENTS, root)
+            for name, info in sorted(manifest["partitions"].items()):
+                print(f"{name}: {len(info['rows'])} rows, doctors: {', '.join(info['doctors']) or '-'}")
+        else:
+            out = args.out or args.data
+            _atomic_write(os.path.abspath(out), lambda f: df.to_csv(f, index=False))
+            print(f"Wrote {len(df)} rows to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Materialized progress summary for the admin dashboard
+
+Counts of notes with audio, with additional notes and validated, plus the
+recorded seconds, for all notes and per doctor, kept in a small JSON file
+next to the dataset (PROGRESS_SUMMARY). The counters are never recomputed on
+a page load: data_handler records the change each write makes to a note's
+status, and the pending changes are added to the file when the dataset is
+saved, under the same lock. The dashboard reads only this file, so it costs
+the same however many notes there are.
+
+The file is rebuilt from the saved dataset when it is missing. Writes from a
+worker holding an out-of-date frame can make the counters drift; rebuild
+them after changing DOCTOR_ASSIGNMENTS or rebuilding the partitions:
+    python progress_summary.py rebuild
+    python progress_summary.py show
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+import change_log
+import partitions
+from audio_quality import QUALITY_COLUMNS
+from config import DATA_PATH, PROGRESS_SUMMARY
+from note_index import is_set
+
+COUNTERS = ("total", "audio", "notes", "validated", "audio_seconds")
+ALL = ""  # Delta scope of the all-notes counters; other scopes are doctors
+DURATION_COLUMN = QUALITY_COLUMNS["duration_s"]
+# Columns a write must report (before and after) for its delta to be computed
+TRACKED_COLUMNS = ("audio_file", "additional_notes", "validated", DURATION_COLUMN)
+
+_DTYPES = {
+    "audio_file": "string",
+    "validated": "boolean",
+    "additional_notes": "string"
+}
+
+_lock = threading.Lock()
+# Deltas of writes not yet added to the file: scope -> counter -> delta
+_pending: Dict[str, Dict[str, float]] = {}
+_cache: Dict[str, tuple] = {}
+
+
+def summary_path(data_path: str = DATA_PATH) -> str:
+    return os.path.join(change_log.data_dir(data_path), PROGRESS_SUMMARY)
+
+
+def _empty() -> Dict[str, float]:
+    return {counter: 0 for counter in COUNTERS}
+
+
+def _counts(values: dict) -> Dict[str, float]:
+    """Counter contributions of one note's tracked values"""
+    audio = is_set("audio_file", values.get("audio_file"))
+    seconds = values.get(DURATION_COLUMN)
+    return {
+        "audio": int(audio),
+        "notes": int(is_set("additional_notes", values.get("additional_notes"))),
+        "validated": int(is_set("validated", values.get("validated"))),
+        "audio_seconds": float(seconds) if audio and not pd.isna(seconds) else 0.0,
+    }
+
+
+def record(doctors: Iterable[str], before: dict, changes: dict):
+    """Record the effect of a write on one note (before: its TRACKED_COLUMNS values)"""
+    old = _counts(before)
+    new = _counts({**before, **changes})
+    deltas = {counter: new[counter] - old[counter] for counter in old if new[counter] != old[counter]}
+    if not deltas:
+        return
+    with _lock:
+        for scope in (ALL, *doctors):
+            pending = _pending.setdefault(scope, {})
+            for counter, delta in deltas.items():
+                pending[counter] = pending.get(counter, 0) + delta
+
+
+def flush(data_path: str = DATA_PATH):
+    """Add the recorded deltas to the summary file (call under change_log.dataset_lock)"""
+    global _pending
+    with _lock:
+        deltas, _pending = _pending, {}
+    apply_deltas(deltas, data_path)
+
+
+def apply_deltas(deltas: Dict[str, Dict[str, float]], data_path: str = DATA_PATH):
+    """Add deltas to the summary file (call under change_log.dataset_lock)"""
+    if not deltas:
+        return
+    path = summary_path(data_path)
+    summary = _read(path)
+    if summary is None:
+        return  # Rebuilt from the saved dataset on the next read
+    for scope, counts in deltas.items():
+        target = summary["all"] if scope == ALL else summary["doctors"].setdefault(scope, _empty())
+        for counter, delta in counts.items():
+            target[counter] = target.get(counter, 0) + delta
+    summary["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    _write(path, summary)
+
+
+def _read(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write(path: str, summary: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_saved(data_path: str) -> pd.DataFrame:
+    """The dataset as saved, indexed by row number"""
+    root = partitions.partition_root(data_path)
+    manifest = partitions.load_manifest(root)
+    if manifest is None:
+        return change_log.read_csv(data_path, dtype=_DTYPES)[0]
+    frames = [partitions.read_partition(root, name, _DTYPES)[0] for name in manifest["partitions"]]
+    if not frames:
+        return pd.DataFrame(columns=manifest["columns"])
+    return pd.concat(frames)
+
+
+def compute(df: pd.DataFrame, assignments: Dict[str, List[int]]) -> dict:
+    """Full recount of a dataset frame"""
+    audio = df["audio_file"].fillna("").astype(str).str.len() > 0
+    notes = df["additional_notes"].fillna("").astype(str).str.len() > 0
+    validated = df["validated"].fillna(False).astype(bool)
+    if DURATION_COLUMN in df.columns:
+        seconds = pd.to_numeric(df[DURATION_COLUMN], errors="coerce").fillna(0.0).where(audio, 0.0)
+    else:
+        seconds = pd.Series(0.0, index=df.index)
+
+    def counts(rows) -> Dict[str, float]:
+        return {
+            "total": int(len(rows)),
+            "audio": int(audio.loc[rows].sum()),
+            "notes": int(notes.loc[rows].sum()),
+            "validated": int(validated.loc[rows].sum()),
+            "audio_seconds": float(seconds.loc[rows].sum()),
+        }
+
+    present = set(df.index.tolist())
+    now = datetime.now().isoformat(timespec="seconds")
+    return {
+        "all": counts(df.index),
+        "doctors": {
+            doctor: counts([row for row in rows if row in present])
+            for doctor, rows in assignments.items()
+        },
+        "rebuilt_at": now,
+        "updated_at": now,
+    }
+
+
+def rebuild(data_path: str = DATA_PATH) -> dict:
+    """Recount the saved dataset and replace the summary file"""
+    from data_handler import DOCTOR_ASSIGNMENTS
+    with change_log.dataset_lock(data_path):
+        summary = compute(_read_saved(data_path), DOCTOR_ASSIGNMENTS)
+        _write(summary_path(data_path), summary)
+    return summary
+
+
+def load_summary(data_path: str = DATA_PATH) -> dict:
+    """The summary (cached until the file changes), rebuilt if missing"""
+    path = summary_path(data_path)
+    try:
+        current = change_log.stamp(path)
+    except FileNotFoundError:
+        rebuild(data_path)
+        current = change_log.stamp(path)
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == current:
+            return cached[1]
+    summary = _read(path)
+    with _lock:
+        _cache[path] = (current, summary)
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"{'':<20} {'total':>6} {'audio':>6} {'notes':>6} {'valid':>6} {'minutes':>8}")
+    scopes = [("all notes", summary["all"])] + sorted(summary["doctors"].items())
+    for name, counts in scopes:
+        print(
+            f"{name:<20} {counts['total']:>6} {counts['audio']:>6} {counts['notes']:>6} "
+            f"{counts['validated']:>6} {counts['audio_seconds'] / 60:>8.1f}"
+        )
+    print(f"updated {summary['updated_at']}, last recount {summary['rebuilt_at']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild", "show"])
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        summary = rebuild(args.data)
+    else:
+        summary = load_summary(args.data)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Rendered card cache and background prefetcher
+
+format_clinical_text + split_content_dynamically results are cached per
+(note_id, text, max_height) in a process-wide LRU. While a doctor works on a
+note, the next notes in their list are rendered into the cache by a single
+low-priority worker thread, so switching notes does not wait on layout.
+
+Notes of STREAM_LAYOUT_MIN_CHARS or more use the streaming layout
+(text_formatter.iter_cards); render_note_stream hands out their cards as they
+are laid out, so the first ones can be shown before the rest of the note has
+been processed.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Iterator, List, Tuple, Union
+
+import metrics
+from config import RENDER_CACHE_SIZE, STREAM_LAYOUT_MIN_CHARS
+from text_formatter import format_clinical_text, iter_cards, split_content_dynamically
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, List[str]]" = OrderedDict()
+_pending = set()
+_queue: "queue.Queue[tuple]" = queue.Queue()
+_worker = None
+
+
+def _key(note_id: str, raw_text: str, max_height: int) -> tuple:
+    return (note_id, hash(raw_text), max_height)
+
+
+def _get(key: tuple):
+    with _lock:
+        sections = _cache.get(key)
+        if sections is not None:
+            _cache.move_to_end(key)
+        return sections
+
+
+def _put(key: tuple, sections: List[str]):
+    with _lock:
+        _cache[key] = sections
+        _cache.move_to_end(key)
+        while len(_cache) > RENDER_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _render(raw_text: str, max_height: int) -> List[str]:
+    if len(raw_text) >= STREAM_LAYOUT_MIN_CHARS:
+        with metrics.span("iter_cards"):
+            return list(iter_cards(raw_text, max_height))
+    with metrics.span("format_clinical_text"):
+        formatted_text = format_clinical_text(raw_text)
+    with metrics.span("split_content_dynamically"):
+        return split_content_dynamically(formatted_text, max_height=max_height)
+
+
+def render_note(note_id: str, raw_text: str, max_height: int = 500) -> List[str]:
+    """Get the content cards for a note, rendering them on a cache miss"""
+    key = _key(note_id, raw_text, max_height)
+    sections = _get(key)
+    if sections is not None:
+        metrics.incr("cache_hits.render")
+        return sections
+    metrics.incr("cache_misses.render")
+    sections = _render(raw_text, max_height)
+    _put(key, sections)
+    return sections
+
+
+def render_note_stream(note_id: str, raw_text: str, max_height: int = 500) -> Union[List[str], Iterator[str]]:
+    """
+    Like render_note, but a long note that is not cached yet is returned as a
+    generator of cards, which caches the full list once it is exhausted
+    """
+    key = _key(note_id, raw_text, max_height)
+    if len(raw_text) < STREAM_LAYOUT_MIN_CHARS or _get(key) is not None:
+        return render_note(note_id, raw_text, max_height)
+    metrics.incr("cache_misses.render")
+    return _stream(key, raw_text, max_height)
+
+
+def _stream(key: tuple, raw_text: str, max_height: int) -> Iterator[str]:
+    sections = []
+    start = time.perf_counter()
+    for card in iter_cards(raw_text, max_height):
+        if not sections:
+            metrics.observe("render.first_card", time.perf_counter() - start)
+        sections.append(card)
+        yield card
+    metrics.observe("render.all_cards", time.perf_counter() - start)
+    _put(key, sections)
+
+
+def _prefetch_worker():
+    while True:
+        key, raw_text = _queue.get()
+        try:
+            if _get(key) is None:
+                _put(key, _render(raw_text, key[2]))
+                metrics.incr("render.prefetched")
+        except Exception:
+            # The note is rendered again when it is shown
+            logger.exception(f"Prefetch of note {key[0]} failed")
+            metrics.incr("render.prefetch_errors")
+        finally:
+            with _lock:
+                _pending.discard(key)
+            # Yield the GIL between notes so script threads stay responsive
+            time.sleep(0.01)
+
+
+def prefetch(notes: Iterable[Tuple[str, str]], max_height: int = 500):
+    """Queue (note_id, raw_text) pairs to be rendered in the background"""
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_prefetch_worker, name="clinical-prefetch", daemon=True)
+            _worker.start()
+        for note_id, raw_text in notes:
+            key = _key(note_id, raw_text, max_height)
+            if key in _cache or key in _pending:
+                continue
+            _pending.add(key)
+            _queue.put((key, raw_text))
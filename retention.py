@@ -0,0 +1,310 @@
+"""
+Retention job for recordings in remote storage
+
+Every save of a recording adds an object under audio/ and nothing is ever
+removed, so the bucket grows without bound. This job lists the hot storage
+backend and sorts each object into one of:
+
+    keep      the current recording of a note (linked from the dataset or the
+              latest take in the takes log)
+    recent    superseded or orphaned, but within RETENTION_GRACE_DAYS
+    archive   a superseded take: recompressed and moved to the cold tier
+    delete    an orphan referenced by neither the dataset nor the takes log
+
+Archived recordings are re-encoded to Opus if ffmpeg is available, otherwise
+to 16 kHz mono WAV compressed with xz, and stored in the cold tier under
+archive/<key>. Objects are processed in parallel batches; a hot object is only
+deleted once its archive copy is stored. References are re-checked right
+before each batch is deleted, holding the dataset lock until the deletes are
+done, so no save can link an object in between; the local copies are marked
+archived first, so saving the same audio later uploads it again.
+Each archived or deleted object is recorded in ARCHIVE_LOG.
+
+Without --apply only the report of what would be moved and reclaimed is
+printed. Run it on the app host, where the dataset lock and the local blob
+stores are.
+
+Usage:
+    python retention.py                       # dry-run report
+    python retention.py --apply --grace-days 30 --cold local
+"""
+import argparse
+import json
+import lzma
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from config import (
+    ARCHIVE_DIR,
+    ARCHIVE_LOG,
+    ARCHIVE_OPUS_BITRATE,
+    ARCHIVE_STORAGE,
+    DATA_PATH,
+    RETENTION_BATCH_SIZE,
+    RETENTION_GRACE_DAYS,
+    STORAGE_MAX_WORKERS,
+)
+import change_log
+from storage import LocalStorage, ObjectInfo, StorageBackend, create_storage, get_storage
+
+CATEGORIES = ["keep", "recent", "archive", "delete"]
+ARCHIVE_PREFIX = "archive/"
+_CONTENT_KEY = re.compile(r"^audio/([0-9a-f]{64})(\.\w+)$")
+
+
+class Candidate(NamedTuple):
+    """A classified object; since is when it was superseded (or last modified)"""
+    info: ObjectInfo
+    note_id: str
+    since: float
+
+
+def _timestamp(created_at: str) -> float:
+    return datetime.fromisoformat(created_at).timestamp()
+
+
+def protected_keys(hot: StorageBackend, objects: List[ObjectInfo]) -> Tuple[Set[str], Dict[str, List[dict]]]:
+    """Keys that must stay in hot storage, and the audio takes of every note"""
+    import data_handler
+    from takes import get_takes_log
+
+    df = data_handler.load_data()
+    by_url = {hot.public_url(info.key): info.key for info in objects}
+    referenced = {by_url[url] for url in df["audio_file"].fillna("") if url in by_url}
+    takes = get_takes_log().by_note("audio")
+    latest = {note_takes[-1]["storage_key"] for note_takes in takes.values() if note_takes}
+    return referenced | latest, takes
+
+
+def classify(hot: StorageBackend, objects: List[ObjectInfo], grace_days: float,
+             now: Optional[float] = None) -> Dict[str, List[Candidate]]:
+    """Sort listed objects into CATEGORIES"""
+    now = now or datetime.now().timestamp()
+    protected, takes = protected_keys(hot, objects)
+    superseded: Dict[str, Tuple[str, float]] = {}
+    for note_id, note_takes in takes.items():
+        for take, newer in zip(note_takes, note_takes[1:]):
+            superseded.setdefault(take["storage_key"], (note_id, _timestamp(newer["created_at"])))
+
+    plan: Dict[str, List[Candidate]] = {category: [] for category in CATEGORIES}
+    for info in objects:
+        if info.key in protected:
+            plan["keep"].append(Candidate(info, "", info.modified))
+            continue
+        note_id, since = superseded.get(info.key, ("", info.modified))
+        if now - since < grace_days * 86400:
+            plan["recent"].append(Candidate(info, note_id, since))
+        else:
+            plan["archive" if note_id else "delete"].append(Candidate(info, note_id, since))
+    return plan
+
+
+def recompress(data: bytes, key: str) -> Tuple[bytes, str]:
+    """Archival encoding of a recording as (bytes, extension)"""
+    if shutil.which("ffmpeg"):
+        result = subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", "pipe:0", "-ac", "1", "-c:a", "libopus",
+             "-b:a", ARCHIVE_OPUS_BITRATE, "-f", "ogg", "pipe:1"],
+            input=data, capture_output=True, check=True,
+        )
+        return result.stdout, ".opus"
+    if key.endswith(".wav"):
+        from export_dataset import decode_wav, encode_wav, resample
+        try:
+            samples, rate = decode_wav(data)
+        except Exception:
+            return lzma.compress(data), ".wav.xz"
+        return lzma.compress(encode_wav(resample(samples, rate))), ".wav.xz"
+    # webm/ogg/mp4 from the offline recorder are already compressed
+    return data, os.path.splitext(key)[1]
+
+
+def archive_key(key: str, ext: str) -> str:
+    return ARCHIVE_PREFIX + os.path.splitext(key)[0] + ext
+
+
+def _local_copy(key: str):
+    """(local blob store, sha) of a content-addressed recording, or (None, "")"""
+    from blob_store import AUDIO_MIMETYPES, BlobStore, audio_root
+    match = _CONTENT_KEY.match(key)
+    if not match or match.group(2) not in AUDIO_MIMETYPES:
+        return None, ""
+    sha, ext = match.groups()
+    # Not get_audio_store: that would resume the app's pending uploads here
+    return BlobStore(audio_root(ext), "audio", ext, AUDIO_MIMETYPES[ext]), sha
+
+
+def _log(log_path: str, entries: List[dict]):
+    with open(log_path, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+
+
+def _batches(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _remove(hot: StorageBackend, candidate: Candidate, entry: dict) -> Optional[dict]:
+    """Delete one hot object; returns its log entry, or None if the delete failed"""
+    store, sha = _local_copy(candidate.info.key)
+    if store is not None:
+        store.mark_archived(sha)
+    try:
+        hot.delete(candidate.info.key)
+    except Exception as e:
+        print(f"cannot delete {candidate.info.key}: {e}")
+        if store is not None:
+            store.unmark_archived(sha)
+        return None
+    return {**entry, "time": _now()}
+
+
+def _remove_batch(hot: StorageBackend, items: List[Tuple[Candidate, dict]], workers: int,
+                  log_path: str) -> Tuple[List[Tuple[Candidate, dict]], int]:
+    """
+    Delete the objects that are still unreferenced, in parallel, logging each
+    as it goes; returns (removed, failures)
+    """
+    import data_handler
+    removed = []
+    # Saves wait until the deletes are done, so a reference cannot appear
+    # after the re-check; a save's upload runs after its dataset write
+    with change_log.dataset_lock(data_handler.DATA_PATH):
+        protected, _ = protected_keys(hot, [candidate.info for candidate, _ in items])
+        items = [(candidate, entry) for candidate, entry in items if candidate.info.key not in protected]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_remove, hot, candidate, entry): candidate for candidate, entry in items}
+            for future in as_completed(futures):
+                entry = future.result()
+                if entry is not None:
+                    _log(log_path, [entry])
+                    removed.append((futures[future], entry))
+    return removed, len(items) - len(removed)
+
+
+def archive(hot: StorageBackend, cold: StorageBackend, candidates: List[Candidate],
+            batch_size: int, workers: int, log_path: str) -> Dict[str, int]:
+    """Recompress superseded takes into the cold tier, then delete them from hot storage"""
+    totals = {"objects": 0, "bytes": 0, "archived_bytes": 0, "errors": 0}
+
+    def encode(candidate: Candidate, data: Optional[bytes]):
+        if data is None:
+            return candidate, None, ""
+        try:
+            encoded, ext = recompress(data, candidate.info.key)
+        except Exception as e:
+            print(f"cannot recompress {candidate.info.key}: {e}")
+            return candidate, None, ""
+        return candidate, encoded, ext
+
+    for batch in _batches(candidates, batch_size):
+        blobs, read_errors = hot.get_many([candidate.info.key for candidate in batch], workers)
+        for key, error in read_errors.items():
+            if error is not None:
+                print(f"cannot read {key}: {error}")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            encoded = list(pool.map(lambda c: encode(c, blobs[c.info.key]), batch))
+        ready = {archive_key(c.info.key, ext): (c, data) for c, data, ext in encoded if data is not None}
+        totals["errors"] += len(batch) - len(ready)
+        errors = cold.put_many(
+            [(key, data, "application/octet-stream") for key, (_, data) in ready.items()], "retention"
+        )
+        stored = {c.info.key: (key, len(data)) for key, (c, data) in ready.items() if errors.get(key) is None}
+        totals["errors"] += len(ready) - len(stored)
+
+        items = [
+            (candidate, {
+                "key": candidate.info.key, "action": "archived", "cold_key": stored[candidate.info.key][0],
+                "note_id": candidate.note_id, "bytes": candidate.info.size,
+                "archived_bytes": stored[candidate.info.key][1],
+            })
+            for candidate in batch if candidate.info.key in stored
+        ]
+        removed, failed = _remove_batch(hot, items, workers, log_path)
+        totals["errors"] += failed
+        for candidate, entry in removed:
+            totals["objects"] += 1
+            totals["bytes"] += candidate.info.size
+            totals["archived_bytes"] += entry["archived_bytes"]
+        print(f"archived {totals['objects']}/{len(candidates)}")
+    return totals
+
+
+def collect(hot: StorageBackend, candidates: List[Candidate], batch_size: int,
+            workers: int, log_path: str) -> Dict[str, int]:
+    """Delete orphaned objects from hot storage"""
+    totals = {"objects": 0, "bytes": 0, "errors": 0}
+    for batch in _batches(candidates, batch_size):
+        items = [
+            (candidate, {"key": candidate.info.key, "action": "deleted", "bytes": candidate.info.size})
+            for candidate in batch
+        ]
+        removed, failed = _remove_batch(hot, items, workers, log_path)
+        totals["errors"] += failed
+        totals["objects"] += len(removed)
+        totals["bytes"] += sum(candidate.info.size for candidate, _ in removed)
+    return totals
+
+
+def create_archive_storage(name: str) -> StorageBackend:
+    """Cold tier backend: a local directory, or any storage backend by name"""
+    if name == "local":
+        return LocalStorage(os.environ.get("CLINICAL_ARCHIVE_DIR", ARCHIVE_DIR))
+    return create_storage(name)
+
+
+def print_report(plan: Dict[str, List[Candidate]]):
+    print(f"{'category':<10} {'objects':>8} {'MB':>10}")
+    for category in CATEGORIES:
+        size = sum(candidate.info.size for candidate in plan[category])
+        print(f"{category:<10} {len(plan[category]):>8} {size / 1e6:>10.1f}")
+    reclaim = sum(c.info.size for category in ("archive", "delete") for c in plan[category])
+    print(f"hot storage to reclaim: {reclaim / 1e6:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="Archive and delete (default: report only)")
+    parser.add_argument("--data", default=DATA_PATH, help="Clinical notes CSV")
+    parser.add_argument("--prefix", default="audio/", help="Hot storage prefix to scan")
+    parser.add_argument("--grace-days", type=float, default=RETENTION_GRACE_DAYS,
+                        help="Leave superseded takes and orphans alone this long")
+    parser.add_argument("--cold", default=os.environ.get("CLINICAL_ARCHIVE", ARCHIVE_STORAGE),
+                        help="Cold tier: local or a storage backend name")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=STORAGE_MAX_WORKERS)
+    parser.add_argument("--log", default=ARCHIVE_LOG, help="Log of archived and deleted objects (JSONL)")
+    args = parser.parse_args()
+
+    import data_handler
+    data_handler.DATA_PATH = args.data
+    hot = get_storage()
+    objects = hot.list_objects(args.prefix)
+    plan = classify(hot, objects, args.grace_days)
+    print_report(plan)
+    if not args.apply:
+        print("dry run: nothing changed (use --apply)")
+        return
+
+    cold = create_archive_storage(args.cold)
+    archived = archive(hot, cold, plan["archive"], args.batch_size, args.workers, args.log)
+    deleted = collect(hot, plan["delete"], args.batch_size, args.workers, args.log)
+    print(
+        f"archived {archived['objects']} object(s): {archived['bytes'] / 1e6:.1f} MB -> "
+        f"{archived['archived_bytes'] / 1e6:.1f} MB in the cold tier ({archived['errors']} failed); "
+        f"deleted {deleted['objects']} orphan(s): {deleted['bytes'] / 1e6:.1f} MB ({deleted['errors']} failed)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Full-text search over clinical notes
+
+An in-process inverted index over raw_text and the section headers found by
+text_formatter. Tokens are lowercased with accents stripped, so "evolution"
+matches "Évolution" and "coronarographie" matches a "CORONAROGRAPHIE :"
+header. Results are ranked with BM25. The index is synced incrementally:
+only notes whose text changed since the last sync are re-tokenized.
+"""
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from text_formatter import SECTION_LABELS, find_section_headers
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Section headers are worth more than a word in the body
+SECTION_BOOST = 3
+
+K1 = 1.2
+B = 0.75
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split normalized text into search tokens (elisions like l'IVA become iva)"""
+    return [t for t in _TOKEN_RE.findall(normalize(text)) if len(t) > 1 or t.isdigit()]
+
+
+def _section_tokens(text: str) -> List[str]:
+    tokens = []
+    for key in {key for _, _, key in find_section_headers(text)}:
+        tokens.append(key)
+        tokens.extend(tokenize(SECTION_LABELS[key]))
+    return tokens
+
+
+class SearchIndex:
+    """Inverted index: token -> {note_id: weighted term frequency}"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.doc_hash: Dict[str, int] = {}
+        self.total_len = 0
+        self._lock = threading.RLock()
+        self._synced_df = None
+
+    def add(self, note_id: str, text: str):
+        """Index (or re-index) one note"""
+        with self._lock:
+            self.remove(note_id)
+            terms = Counter(tokenize(text))
+            for token in _section_tokens(text):
+                terms[token] += SECTION_BOOST
+            for token, tf in terms.items():
+                self.postings.setdefault(token, {})[note_id] = tf
+            length = sum(terms.values())
+            self.doc_terms[note_id] = terms
+            self.doc_len[note_id] = length
+            self.doc_hash[note_id] = hash(text)
+            self.total_len += length
+
+    def remove(self, note_id: str):
+        """Drop one note from the index"""
+        with self._lock:
+            terms = self.doc_terms.pop(note_id, None)
+            if terms is None:
+                return
+            for token in terms:
+                docs = self.postings.get(token)
+                if docs is not None:
+                    docs.pop(note_id, None)
+                    if not docs:
+                        del self.postings[token]
+            self.total_len -= self.doc_len.pop(note_id)
+            self.doc_hash.pop(note_id, None)
+
+    def sync(self, df, prune: bool = True):
+        """
+        Bring the index in line with a dataset, re-indexing only changed notes
+        With prune=False notes missing from df are kept, for frames holding
+        only part of the dataset (one doctor's partitions).
+        """
+        with self._lock:
+            if df is self._synced_df:
+                return
+            seen = set()
+            changed = 0
+            for note_id, text in zip(df["note_id"], df["raw_text"].fillna("").astype(str)):
+                seen.add(note_id)
+                if self.doc_hash.get(note_id) != hash(text):
+                    self.add(note_id, text)
+                    changed += 1
+            if prune:
+                for note_id in [n for n in self.doc_terms if n not in seen]:
+                    self.remove(note_id)
+            self._synced_df = df
+            metrics.incr("search_index.reindexed", changed)
+
+    def _expand(self, token: str, prefix: bool) -> List[str]:
+        if not prefix:
+            return [token] if token in self.postings else []
+        return [t for t in self.postings if t.startswith(token)]
+
+    def search(self, query: str, note_ids: Optional[Iterable[str]] = None,
+               limit: int = 50) -> List[Tuple[str, float]]:
+        """
+        Rank notes against a query with BM25
+        The last query token also matches as a prefix, for search-as-you-type.
+        Returns [(note_id, score)] best first, optionally restricted to note_ids.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        allowed = set(note_ids) if note_ids is not None else None
+
+        with self._lock:
+            num_docs = len(self.doc_len)
+            if not num_docs:
+                return []
+            avg_len = self.total_len / num_docs
+            scores: Dict[str, float] = {}
+            for i, token in enumerate(tokens):
+                for term in self._expand(token, prefix=i == len(tokens) - 1):
+                    docs = self.postings[term]
+                    idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for note_id, tf in docs.items():
+                        if allowed is not None and note_id not in allowed:
+                            continue
+                        norm = K1 * (1 - B + B * self.doc_len[note_id] / avg_len)
+                        scores[note_id] = scores.get(note_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda kv: -kv[1])[:limit]
+
+
+_index = SearchIndex()
+
+
+def get_search_index(df, prune: bool = True) -> SearchIndex:
+    """Get the process-wide search index, synced with df"""
+    _index.sync(df, prune)
+    return _index
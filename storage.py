@@ -0,0 +1,395 @@
+"""
+Pluggable object storage for the Clinical Notes Application
+
+StorageBackend is the interface every remote store implements: put/get,
+streaming reads, existence checks, listing (with sizes and modification
+times) and deletion, plus put_many and get_many which move many objects
+concurrently and report failures per object. put_many goes through the
+upload scheduler, so bulk uploads share its concurrency, byte-rate and
+queue limits with the app's; get_many downloads on its own thread pool
+(the scheduler only governs uploads). Backends:
+
+    supabase  Supabase Storage over its REST API (default)
+    local     a directory on disk, for running and benchmarking offline
+    s3        any S3-compatible service, e.g. MinIO (requires boto3)
+
+The backend is chosen with CLINICAL_STORAGE (default: STORAGE_BACKEND) and
+created once per process by get_storage().
+"""
+import os
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import metrics
+from config import STORAGE_BACKEND, LOCAL_STORAGE_DIR, STORAGE_MAX_WORKERS
+
+STREAM_CHUNK = 1024 * 1024
+
+
+class ObjectInfo(NamedTuple):
+    """A listed object: key, size in bytes and last-modified Unix time"""
+    key: str
+    size: int
+    modified: float
+
+
+class StorageBackend(ABC):
+    """Key/value object store addressed by slash-separated keys"""
+
+    name = "storage"
+
+    def put(self, key: str, data: bytes, content_type: str = "application/octet-stream"):
+        """Store an object, replacing any existing one"""
+        with metrics.span("upload"):
+            self._put(key, data, content_type)
+        metrics.incr("uploads")
+        metrics.incr("upload_bytes", len(data))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Read an object, or None if it does not exist"""
+        with metrics.span("download"):
+            data = self._get(key)
+        if data is not None:
+            metrics.incr("download_bytes", len(data))
+        return data
+
+    @abstractmethod
+    def _put(self, key: str, data: bytes, content_type: str):
+        ...
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        """Read an object in chunks; raises FileNotFoundError if it does not exist"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove an object; missing objects are ignored"""
+
+    @abstractmethod
+    def list_objects(self, prefix: str = "") -> List[ObjectInfo]:
+        """All objects under prefix, with their sizes and modification times"""
+
+    def list_keys(self, prefix: str = "") -> List[str]:
+        """Keys of all objects under prefix"""
+        return [info.key for info in self.list_objects(prefix)]
+
+    @abstractmethod
+    def public_url(self, key: str) -> str:
+        """URL stored in the dataset for an object"""
+
+    def put_many(self, items: Iterable[Tuple[str, bytes, str]],
+                 owner: str = "bulk") -> Dict[str, Optional[Exception]]:
+        """
+        Store (key, data, content_type) items through the upload scheduler on
+        behalf of owner; maps key -> error or None
+        """
+        from upload_scheduler import UploadRejected, get_upload_scheduler
+        scheduler = get_upload_scheduler()
+        errors: Dict[str, Optional[Exception]] = {}
+        futures = {}
+        for key, data, content_type in items:
+            try:
+                futures[key] = scheduler.submit(owner, len(data), self.put, key, data, content_type)
+            except UploadRejected as e:
+                errors[key] = e
+        for key, future in futures.items():
+            errors[key] = future.exception()
+        return errors
+
+    def get_many(self, keys: Iterable[str], workers: int = STORAGE_MAX_WORKERS
+                 ) -> Tuple[Dict[str, Optional[bytes]], Dict[str, Optional[Exception]]]:
+        """
+        Read objects concurrently; returns key -> bytes (None if missing or
+        failed) and, like put_many, key -> error or None
+        """
+        def get_one(key):
+            try:
+                return key, self.get(key), None
+            except Exception as e:
+                return key, None, e
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(get_one, keys))
+        return {key: data for key, data, _ in results}, {key: error for key, _, error in results}
+
+
+class SupabaseStorage(StorageBackend):
+    """Supabase Storage bucket accessed over HTTP with the shared session"""
+
+    name = "supabase"
+
+    def __init__(self, url: str, key: str, bucket: str):
+        self.url = url.rstrip("/")
+        self.key = key
+        self.bucket = bucket
+
+    def _object_url(self, key: str) -> str:
+        return f"{self.url}/storage/v1/object/{self.bucket}/{key}"
+
+    def _headers(self, **extra) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.key}", **extra}
+
+    def _session(self):
+        from utils import get_http_session
+        return get_http_session()
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        response = self._session().post(
+            self._object_url(key),
+            headers=self._headers(**{"Content-Type": content_type, "x-upsert": "true"}),
+            data=data,
+            timeout=60,
+        )
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Upload failed: {response.status_code} - {response.text}")
+
+    def _get(self, key: str) -> Optional[bytes]:
+        response = self._session().get(self._object_url(key), headers=self._headers(), timeout=60)
+        # Supabase reports missing objects as 400 as well as 404
+        if response.status_code in (400, 404):
+            return None
+        response.raise_for_status()
+        return response.content
+
+    def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        response = self._session().get(self._object_url(key), headers=self._headers(), stream=True, timeout=60)
+        with response:
+            if response.status_code in (400, 404):
+                raise FileNotFoundError(key)
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size)
+
+    def exists(self, key: str) -> bool:
+        response = self._session().head(self._object_url(key), headers=self._headers(), timeout=30)
+        return response.status_code == 200
+
+    def delete(self, key: str):
+        response = self._session().delete(self._object_url(key), headers=self._headers(), timeout=30)
+        if response.status_code not in (200, 204, 400, 404):
+            response.raise_for_status()
+
+    def list_objects(self, prefix: str = "") -> List[ObjectInfo]:
+        folder, _, name_prefix = prefix.rpartition("/")
+        objects = []
+        offset = 0
+        while True:
+            response = self._session().post(
+                f"{self.url}/storage/v1/object/list/{self.bucket}",
+                headers=self._headers(),
+                json={"prefix": folder, "search": name_prefix, "limit": 1000, "offset": offset},
+                timeout=60,
+            )
+            response.raise_for_status()
+            entries = response.json()
+            for entry in entries:
+                # Sub-folders are listed without metadata
+                if not entry.get("metadata"):
+                    continue
+                modified = entry.get("updated_at") or entry.get("created_at")
+                objects.append(ObjectInfo(
+                    f"{folder}/{entry['name']}" if folder else entry["name"],
+                    int(entry["metadata"].get("size", 0)),
+                    datetime.fromisoformat(modified.replace("Z", "+00:00")).timestamp() if modified else 0.0,
+                ))
+            if len(entries) < 1000:
+                return objects
+            offset += len(entries)
+
+    def public_url(self, key: str) -> str:
+        return f"{self.url}/storage/v1/object/public/{self.bucket}/{key}"
+
+
+class LocalStorage(StorageBackend):
+    """Objects as files under a root directory"""
+
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, base_url: str = ""):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        with open(self._path(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects(self, prefix: str = "") -> List[ObjectInfo]:
+        objects = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    st = os.stat(path)
+                    objects.append(ObjectInfo(key, st.st_size, st.st_mtime))
+        return sorted(objects)
+
+    def public_url(self, key: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return "file://" + self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """S3-compatible bucket (AWS, MinIO, ...) through boto3"""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, public_url: str = ""):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise ImportError("The s3 storage backend requires boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.base_url = (public_url or (f"{endpoint_url.rstrip('/')}/{bucket}" if endpoint_url
+                                        else f"https://{bucket}.s3.amazonaws.com")).rstrip("/")
+        # boto3 clients are thread-safe; size the pool for put_many/get_many
+        self._client = boto3.client(
+            "s3", endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=max(10, STORAGE_MAX_WORKERS)),
+        )
+        self._missing = self._client.exceptions.NoSuchKey
+
+    def _is_missing(self, error) -> bool:
+        code = getattr(error, "response", {}).get("Error", {}).get("Code")
+        return isinstance(error, self._missing) or code in ("404", "NoSuchKey", "NotFound")
+
+    def _put(self, key: str, data: bytes, content_type: str):
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except Exception as e:
+            if self._is_missing(e):
+                return None
+            raise
+
+    def open_stream(self, key: str, chunk_size: int = STREAM_CHUNK) -> Iterator[bytes]:
+        try:
+            body = self._client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        with body:
+            yield from body.iter_chunks(chunk_size)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def delete(self, key: str):
+        self._client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_objects(self, prefix: str = "") -> List[ObjectInfo]:
+        objects = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects.extend(
+                ObjectInfo(item["Key"], item["Size"], item["LastModified"].timestamp())
+                for item in page.get("Contents", [])
+            )
+        return objects
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+
+def _s3_config() -> Tuple[str, Optional[str], str]:
+    """S3 bucket, endpoint and public URL from secrets or environment"""
+    try:
+        import streamlit as st
+        section = st.secrets["s3"]
+        return section["BUCKET"], section.get("ENDPOINT_URL"), section.get("PUBLIC_URL", "")
+    except Exception:
+        bucket = os.environ.get("S3_BUCKET")
+        if not bucket:
+            raise Exception("S3 storage selected but no bucket configured (S3_BUCKET or [s3] BUCKET)")
+        return bucket, os.environ.get("S3_ENDPOINT_URL"), os.environ.get("S3_PUBLIC_URL", "")
+
+
+def create_storage(backend: str) -> StorageBackend:
+    """Instantiate a storage backend by name"""
+    if backend == "supabase":
+        from utils import get_supabase_config
+        return SupabaseStorage(*get_supabase_config())
+    if backend == "local":
+        return LocalStorage(os.environ.get("CLINICAL_STORAGE_DIR", LOCAL_STORAGE_DIR),
+                            os.environ.get("CLINICAL_STORAGE_URL", ""))
+    if backend == "s3":
+        return S3Storage(*_s3_config())
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Process-wide storage backend"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = create_storage(os.environ.get("CLINICAL_STORAGE", STORAGE_BACKEND))
+        return _storage
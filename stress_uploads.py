@@ -0,0 +1,148 @@
+"""
+Stress test for the upload scheduler against a throttled stub server
+
+A local stub of the Supabase upload endpoint reads request bodies at a
+fixed per-connection bandwidth and records how many uploads it serves at
+once. One "bursty" doctor queues many large recordings at the same moment
+while the other doctors save a few notes-sized files each. With fair
+queuing the light doctors' uploads should not wait behind the burst.
+
+Checks: server-side concurrency never exceeds --concurrency, the overall
+byte rate stays within --rate (plus one burst), and the light doctors' p95
+latency is below the bursty doctor's. --fifo runs the same load with a
+single shared queue for comparison.
+
+Usage:
+    python stress_uploads.py --concurrency 4 --rate 4e6 --burst-uploads 40
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from upload_scheduler import UploadScheduler
+
+
+class ThrottledStorageHandler(BaseHTTPRequestHandler):
+    """Upload endpoint that reads bodies at a limited bandwidth per connection"""
+    bandwidth = 2e6  # bytes/s per connection
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+    received = 0
+
+    def do_POST(self):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.max_active = max(cls.max_active, cls.active)
+        try:
+            remaining = int(self.headers.get("Content-Length", 0))
+            while remaining:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                remaining -= len(chunk)
+                time.sleep(len(chunk) / self.bandwidth)
+                with cls.lock:
+                    cls.received += len(chunk)
+        finally:
+            with cls.lock:
+                cls.active -= 1
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=4, help="Scheduler upload slots")
+    parser.add_argument("--rate", type=float, default=4e6, help="Scheduler byte-rate limit (bytes/s)")
+    parser.add_argument("--bandwidth", type=float, default=2e6, help="Stub bandwidth per connection (bytes/s)")
+    parser.add_argument("--burst-uploads", type=int, default=40, help="Large uploads queued by the bursty doctor")
+    parser.add_argument("--burst-size", type=int, default=400_000, help="Bytes per large upload")
+    parser.add_argument("--doctors", type=int, default=5, help="Light doctors")
+    parser.add_argument("--light-uploads", type=int, default=4, help="Uploads per light doctor")
+    parser.add_argument("--light-size", type=int, default=20_000, help="Bytes per light upload")
+    parser.add_argument("--fifo", action="store_true", help="Single shared queue (no per-doctor fairness)")
+    args = parser.parse_args()
+
+    ThrottledStorageHandler.bandwidth = args.bandwidth
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ThrottledStorageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["SUPABASE_KEY"] = "stub"
+    from storage import create_storage
+    storage = create_storage("supabase")
+
+    burst = max(args.burst_size, args.light_size)
+    scheduler = UploadScheduler(args.concurrency, args.rate, burst, max_queued=0)
+    latencies = defaultdict(list)
+    lock = threading.Lock()
+
+    def upload(doctor: str, index: int, size: int):
+        submitted = time.perf_counter()
+        owner = "all" if args.fifo else doctor
+        scheduler.run(owner, size, storage.put, f"stress/{doctor}-{index}.bin", os.urandom(size), "application/octet-stream")
+        with lock:
+            latencies[doctor].append(time.perf_counter() - submitted)
+
+    threads = [
+        threading.Thread(target=upload, args=("bursty", i, args.burst_size))
+        for i in range(args.burst_uploads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)  # light doctors save while the burst is queued
+    for d in range(args.doctors):
+        for i in range(args.light_uploads):
+            thread = threading.Thread(target=upload, args=(f"doctor-{d}", i, args.light_size))
+            threads.append(thread)
+            thread.start()
+            time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    light = [t for doctor, values in latencies.items() if doctor != "bursty" for t in values]
+    heavy = latencies["bursty"]
+    total_bytes = ThrottledStorageHandler.received
+    print(f"{'':<10} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+    for label, values in (("bursty", heavy), ("light", light)):
+        print(
+            f"{label:<10} {len(values):>5} {statistics.median(values):>8.2f} "
+            f"{percentile(values, 95):>8.2f} {max(values):>8.2f}"
+        )
+    print(
+        f"{total_bytes / 1e6:.1f} MB in {elapsed:.1f}s ({total_bytes / elapsed / 1e6:.2f} MB/s), "
+        f"max concurrent uploads at server: {ThrottledStorageHandler.max_active}"
+    )
+
+    failures = []
+    if ThrottledStorageHandler.max_active > args.concurrency:
+        failures.append(f"concurrency {ThrottledStorageHandler.max_active} > limit {args.concurrency}")
+    if args.rate and total_bytes > args.rate * elapsed + burst:
+        failures.append(f"byte rate {total_bytes / elapsed:.0f}/s over limit {args.rate:.0f}/s")
+    if not args.fifo and percentile(light, 95) >= percentile(heavy, 95):
+        failures.append("light doctors waited as long as the bursty one")
+    if failures:
+        print("FAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
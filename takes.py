@@ -0,0 +1,124 @@
+"""
+Append-only history of audio and notes takes
+
+Every save is appended as one row of TAKES_PATH (note_id, take_id, kind,
+storage key, content hash, duration, size, doctor, created_at); earlier takes
+are never overwritten. The log is indexed in memory by note and kind in time
+order, so the latest take is the last element of a short list and history
+lookups never scan the whole dataset. Rows appended by other processes are
+picked up by reading only the bytes added since the last refresh.
+"""
+import csv
+import io
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import TAKES_PATH
+
+FIELDS = [
+    "note_id", "take_id", "kind", "storage_key", "content_hash",
+    "duration_s", "size_bytes", "doctor", "created_at",
+]
+
+
+class TakesLog:
+    """In-memory index over the append-only takes CSV"""
+
+    def __init__(self, path: str = TAKES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._by_note: Dict[tuple, List[dict]] = {}
+
+    def _index(self, take: dict):
+        self._by_note.setdefault((take["note_id"], take["kind"]), []).append(take)
+
+    def refresh(self):
+        """Index rows appended since the last refresh"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                data = f.read()
+            # Only consume complete lines; a concurrent writer may be mid-row
+            end = data.rfind(b"\n") + 1
+            if not end:
+                return
+            text = data[:end].decode("utf-8")
+            if self._offset == 0:
+                rows = csv.DictReader(io.StringIO(text))
+            else:
+                rows = csv.DictReader(io.StringIO(text), fieldnames=FIELDS)
+            for row in rows:
+                if row["note_id"] == "note_id":
+                    continue  # header written by a racing process
+                row["duration_s"] = float(row["duration_s"]) if row["duration_s"] else None
+                row["size_bytes"] = int(row["size_bytes"] or 0)
+                self._index(row)
+            self._offset += end
+
+    def append(self, note_id: str, kind: str, storage_key: str, content_hash: str,
+               size_bytes: int, doctor: str, duration_s: Optional[float] = None) -> Optional[dict]:
+        """
+        Record a new take
+        Returns None without writing if it repeats the latest take's content.
+        """
+        self.refresh()
+        latest = self.latest(note_id, kind)
+        if latest is not None and latest["content_hash"] == content_hash:
+            return None
+
+        take = {
+            "note_id": note_id,
+            "take_id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "storage_key": storage_key,
+            "content_hash": content_hash,
+            "duration_s": duration_s,
+            "size_bytes": size_bytes,
+            "doctor": doctor,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        line = io.StringIO()
+        writer = csv.DictWriter(line, fieldnames=FIELDS)
+        with self._lock:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            if new_file:
+                writer.writeheader()
+            writer.writerow({k: "" if v is None else v for k, v in take.items()})
+            # One write call in append mode keeps rows from concurrent writers whole
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                f.write(line.getvalue())
+        self.refresh()
+        return take
+
+    def history(self, note_id: str, kind: str = "audio") -> List[dict]:
+        """All takes of a note, oldest first"""
+        return list(self._by_note.get((note_id, kind), []))
+
+    def by_note(self, kind: str = "audio") -> Dict[str, List[dict]]:
+        """Takes of every note, oldest first"""
+        return {note_id: list(takes) for (note_id, k), takes in self._by_note.items() if k == kind}
+
+    def latest(self, note_id: str, kind: str = "audio") -> Optional[dict]:
+        """Most recent take of a note, or None"""
+        takes = self._by_note.get((note_id, kind))
+        return takes[-1] if takes else None
+
+
+_log: Optional[TakesLog] = None
+_log_lock = threading.Lock()
+
+
+def get_takes_log() -> TakesLog:
+    """Process-wide takes log, refreshed on access"""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = TakesLog()
+    _log.refresh()
+    return _log
@@ -2,83 +2,110 @@
 Text formatting functions for clinical notes
 """
 import re
-from typing import List
+from typing import Iterator, List, Tuple
 from config import CARD_WIDTH_CHARS
 
+CARD_PADDING = 32
+STREAM_CHUNK_CHARS = 8192
+_CUT_WINDOW = 256  # Longer than any header match, including its whitespace
+
+
+SECTION_PATTERNS = {
+    # Antécédents
+    r"(?im)^\s*(ATCDS?|ANT[EÉ]C[EÉ]DENTS?)\b\s*:?\s*": (
+        "<div class='section-header atcd'><span class='emoji'>🟦</span> Antécédents</div><br>",
+        "#5D9CEC"
+    ),
+
+    # Facteurs de risque cardio-vasculaire
+    r"(?im)^\s*(FDRCV|FACTEURS?\s+DE\s+RISQUE(S)?\s+CARDIO[-\s]?VASCULAIRE(S)?)\b\s*:?\s*": (
+        "<div class='section-header fdrcv'><span class='emoji'>🟥</span> Facteurs de risque cardio-vasculaire</div><br>",
+        "#ED5565"
+    ),
+
+    # Histoire de la maladie
+    r"(?im)^\s*(HDM|HISTOIRE\s+DE\s+LA\s+MALADIE)\b\s*:?\s*": (
+        "<div class='section-header hdm'><span class='emoji'>🟪</span> HDM</div><br>",
+        "#AC92EC"
+    ),
+
+    # Examen clinique
+    r"(?im)^\s*EXAMEN\s+CLINIQUE\b\s*:?\s*": (
+        "<div class='section-header exam'><span class='emoji'>🟩</span> Examen clinique</div><br>",
+        "#4FC1E9"
+    ),
+
+    # Bilan biologique
+    r"(?im)^\s*BILAN\s+BIO(LOGIQUE)?\b\s*:?\s*": (
+        "<div class='section-header bio'><span class='emoji'>🧪</span> Bilan biologique</div><br>",
+        "#48CFAD"
+    ),
+
+    # ECG
+    r"(?im)^\s*ECG\b\s*:?\s*": (
+        "<div class='section-header ecg'><span class='emoji'>📈</span> ECG</div><br>",
+        "#ED5565"
+    ),
+
+    # ETT
+    r"(?im)^\s*ETT\b(\s+DES\s+URGENCES)?\b\s*:?\s*": (
+        "<div class='section-header ett'><span class='emoji'>🫀</span> ETT</div><br>",
+        "#FC6E51"
+    ),
+
+    # Coronarographie
+    r"(?im)^\s*CORONAROGRAPHIE\b\s*:?\s*": (
+        "<div class='section-header coro'><span class='emoji'>🩺</span> Coronarographie</div><br>",
+        "#E9573F"
+    ),
+
+    # Conduite tenue
+    r"(?im)^\s*CONDUITE\s+TENUE(\s+EN\s+SALLE\s+D['’]URGENCE)?\b\s*:?\s*": (
+        "<div class='section-header conduite'><span class='emoji'>🟨</span> Conduite tenue</div><br>",
+        "#FFCE54"
+    ),
+
+    # Évolution
+    r"(?im)^\s*[EÉ]VOLUTION\b\s*:?\s*": (
+        "<div class='section-header evol'><span class='emoji'>📊</span> Évolution</div><br>",
+        "#A0D468"
+    ),
+
+    # Conduite à tenir
+    r"(?im)^\s*(CAT|CONDUITE\s+[ÀA]\s+TENIR)\b\s*:?\s*": (
+        "<div class='section-header cat'><span class='emoji'>🟫</span> Conduite à tenir</div><br>",
+        "#A0826D"
+    ),
+}
+
+_HEADER_PARTS = re.compile(r"section-header (\w+)'><span class='emoji'>[^<]*</span> ([^<]*)</div>")
+
+# Section key (e.g. "coro") -> display label (e.g. "Coronarographie")
+SECTION_LABELS = {
+    match.group(1): match.group(2)
+    for match in (_HEADER_PARTS.search(title) for title, _ in SECTION_PATTERNS.values())
+}
+
+_COMPILED_SECTIONS = [
+    (re.compile(pattern), title, _HEADER_PARTS.search(title).group(1))
+    for pattern, (title, _) in SECTION_PATTERNS.items()
+]
+
+
+def find_section_headers(text: str) -> List[Tuple[int, int, str]]:
+    """Locate section headers in raw text as (start, end, section_key), in order"""
+    headers = []
+    for pattern, _, key in _COMPILED_SECTIONS:
+        for match in pattern.finditer(text):
+            headers.append((match.start(), match.end(), key))
+    headers.sort()
+    return headers
+
 
 def format_clinical_text(text: str) -> str:
     """Format clinical text with colored section headers"""
-    sections = {
-        # Antécédents
-        r"(?im)^\s*(ATCDS?|ANT[EÉ]C[EÉ]DENTS?)\b\s*:?\s*": (
-            "<div class='section-header atcd'><span class='emoji'>🟦</span> Antécédents</div><br>",
-            "#5D9CEC"
-        ),
-
-        # Facteurs de risque cardio-vasculaire
-        r"(?im)^\s*(FDRCV|FACTEURS?\s+DE\s+RISQUE(S)?\s+CARDIO[-\s]?VASCULAIRE(S)?)\b\s*:?\s*": (
-            "<div class='section-header fdrcv'><span class='emoji'>🟥</span> Facteurs de risque cardio-vasculaire</div><br>",
-            "#ED5565"
-        ),
-
-        # Histoire de la maladie
-        r"(?im)^\s*(HDM|HISTOIRE\s+DE\s+LA\s+MALADIE)\b\s*:?\s*": (
-            "<div class='section-header hdm'><span class='emoji'>🟪</span> HDM</div><br>",
-            "#AC92EC"
-        ),
-
-        # Examen clinique
-        r"(?im)^\s*EXAMEN\s+CLINIQUE\b\s*:?\s*": (
-            "<div class='section-header exam'><span class='emoji'>🟩</span> Examen clinique</div><br>",
-            "#4FC1E9"
-        ),
-
-        # Bilan biologique
-        r"(?im)^\s*BILAN\s+BIO(LOGIQUE)?\b\s*:?\s*": (
-            "<div class='section-header bio'><span class='emoji'>🧪</span> Bilan biologique</div><br>",
-            "#48CFAD"
-        ),
-
-        # ECG
-        r"(?im)^\s*ECG\b\s*:?\s*": (
-            "<div class='section-header ecg'><span class='emoji'>📈</span> ECG</div><br>",
-            "#ED5565"
-        ),
-
-        # ETT
-        r"(?im)^\s*ETT\b(\s+DES\s+URGENCES)?\b\s*:?\s*": (
-            "<div class='section-header ett'><span class='emoji'>🫀</span> ETT</div><br>",
-            "#FC6E51"
-        ),
-
-        # Coronarographie
-        r"(?im)^\s*CORONAROGRAPHIE\b\s*:?\s*": (
-            "<div class='section-header coro'><span class='emoji'>🩺</span> Coronarographie</div><br>",
-            "#E9573F"
-        ),
-
-        # Conduite tenue
-        r"(?im)^\s*CONDUITE\s+TENUE(\s+EN\s+SALLE\s+D['’]URGENCE)?\b\s*:?\s*": (
-            "<div class='section-header conduite'><span class='emoji'>🟨</span> Conduite tenue</div><br>",
-            "#FFCE54"
-        ),
-
-        # Évolution
-        r"(?im)^\s*[EÉ]VOLUTION\b\s*:?\s*": (
-            "<div class='section-header evol'><span class='emoji'>📊</span> Évolution</div><br>",
-            "#A0D468"
-        ),
-
-        # Conduite à tenir
-        r"(?im)^\s*(CAT|CONDUITE\s+[ÀA]\s+TENIR)\b\s*:?\s*": (
-            "<div class='section-header cat'><span class='emoji'>🟫</span> Conduite à tenir</div><br>",
-            "#A0826D"
-        ),
-    }
-
-
-    for pattern, (title, color) in sections.items():
-        text = re.sub(pattern, title, text)
+    for pattern, title, _ in _COMPILED_SECTIONS:
+        text = pattern.sub(title, text)
 
     text = text.replace("\n", "<br>")
     return text
@@ -123,7 +150,7 @@ def split_content_dynamically(text: str, max_height: int = 500) -> List[str]:
     if not lines:
         return [text]
     
-    PADDING = 32
+    PADDING = CARD_PADDING
     line_heights = [calculate_line_height(line) for line in lines]
     total_height = sum(line_heights) + PADDING
     num_cards = max(1, -(-total_height // max_height))
@@ -187,4 +214,80 @@ def split_content_dynamically(text: str, max_height: int = 500) -> List[str]:
             if current_section:
                 sections.append("<br>".join(current_section))
     
-    return sections if sections else [text]
\ No newline at end of file
+    return sections if sections else [text]
+
+
+def _stream_chunks(text: str, size: int = STREAM_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Cut raw text into chunks of about size characters that format exactly as
+    they would within the whole text: a cut falls after a newline followed by
+    neither whitespace nor ':' (where every header match stops), and never
+    inside a header match, which may span lines and glue the next line to it
+    """
+    start = 0
+    while start < len(text):
+        cut = text.find("\n", start + size)
+        while cut != -1 and not _can_cut(text, cut):
+            cut = text.find("\n", cut + 1)
+        if cut == -1:
+            yield text[start:]
+            return
+        yield text[start:cut + 1]
+        start = cut + 1
+
+
+def _can_cut(text: str, newline: int) -> bool:
+    if newline + 1 >= len(text) or text[newline + 1].isspace() or text[newline + 1] == ":":
+        return False
+    # Every line start counts, not just non-overlapping matches: substitutions
+    # by earlier patterns can expose a match the original text did not have
+    line_start = text.rfind("\n", 0, max(0, newline - _CUT_WINDOW)) + 1
+    while line_start <= newline:
+        for pattern, _, _ in _COMPILED_SECTIONS:
+            match = pattern.match(text, line_start, newline + 1 + _CUT_WINDOW)
+            if match is None:
+                continue
+            # Leading blank lines may be split off; they format to empty lines
+            body = match.end() - len(match.group().lstrip())
+            if body <= newline < match.end():
+                return False
+        line_start = text.find("\n", line_start, newline + 1) + 1 or newline + 1
+    return True
+
+
+def iter_formatted_lines(text: str, chunk_chars: int = STREAM_CHUNK_CHARS) -> Iterator[str]:
+    """Non-empty lines of format_clinical_text(text), formatted a chunk at a time"""
+    carry = ""
+    for chunk in _stream_chunks(text, chunk_chars):
+        lines = (carry + format_clinical_text(chunk)).split("<br>")
+        carry = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if carry.strip():
+        yield carry
+
+
+def iter_cards(text: str, max_height: int = 500) -> Iterator[str]:
+    """
+    Lay out a note greedily, yielding each card as soon as it is full
+    Unlike split_content_dynamically, which balances card heights over the
+    whole note, a card only depends on the text up to its end, so the first
+    cards are ready in constant time however long the note is.
+    """
+    card = []
+    height = CARD_PADDING
+    empty = True
+    for line in iter_formatted_lines(text):
+        line_height = calculate_line_height(line)
+        if card and height + line_height > max_height:
+            yield "<br>".join(card)
+            card = []
+            height = CARD_PADDING
+        card.append(line)
+        height += line_height
+        empty = False
+    if card:
+        yield "<br>".join(card)
+    elif empty:
+        yield clean_content(format_clinical_text(text))
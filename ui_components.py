@@ -3,13 +3,28 @@ UI components for Clinical Notes Application
 """
 
 import streamlit as st
-from datetime import datetime
-from typing import List
+import pandas as pd
+from typing import Iterable, List
+import os
 import time
 
-from config import VISIBLE_CARDS
-from utils import safe_filename, upload_audio_file, upload_notes_file
-from data_handler import update_audio_file, update_additional_notes, save_data
+import metrics
+from config import VISIBLE_CARDS, NOTE_PAGE_SIZE, OFFLINE_RECORDER
+from search_index import get_search_index
+from utils import get_public_url
+from blob_store import get_audio_store, get_notes_store
+from audio_quality import analyze_audio, quality_issues
+from takes import get_takes_log
+from audio_spool import SpooledAudio, spool, release
+from data_handler import (
+    update_audio_file,
+    update_additional_notes,
+    save_data,
+    get_note_by_id,
+    get_note_index,
+    apply_validation,
+    is_partitioned
+)
 
 
 def init_session_state():
@@ -17,6 +32,9 @@ def init_session_state():
     if "recorded_audio" not in st.session_state:
         st.session_state.recorded_audio = None
 
+    if "recorded_audio_source" not in st.session_state:
+        st.session_state.recorded_audio_source = None
+
     if "audio_saved_msg" not in st.session_state:
         st.session_state.audio_saved_msg = None
     
@@ -35,29 +53,224 @@ def init_session_state():
     if "card_offset" not in st.session_state:
         st.session_state.card_offset = 0
 
+    if "note_page" not in st.session_state:
+        st.session_state.note_page = 0
 
-def render_note_selector(doctor_notes, username: str) -> str:
-    """Render note selection dropdown"""
-    note_ids = doctor_notes["note_id"].tolist()
-    return st.selectbox(
+    if "note_versions" not in st.session_state:
+        st.session_state.note_versions = {}
+
+
+NOTE_FILTERS = {
+    "All": None,
+    "🎤 To record": lambda index, n: not index.has("audio_file", n),
+    "✅ To validate": lambda index, n: not index.has("validated", n),
+}
+
+
+def note_badges(index, note_id: str) -> str:
+    """Status badges for a note: audio, additional notes, validated"""
+    return "".join([
+        "🎤" if index.has("audio_file", note_id) else "",
+        "📝" if index.has("additional_notes", note_id) else "",
+        "✅" if index.has("validated", note_id) else "",
+    ])
+
+
+@metrics.timed("render.note_selector")
+def render_note_selector(username: str, df) -> str:
+    """
+    Render note search, status filter and a paged selection dropdown
+    Only one page of note IDs is sent to the browser per rerun.
+    """
+    init_session_state()
+    index = get_note_index(df)
+    note_ids = index.notes_for(username)
+
+    query = st.text_input(
+        "🔎 Search notes",
+        key="note_search",
+        placeholder="e.g. STEMI coronarographie"
+    )
+    if query.strip():
+        with metrics.span("search"):
+            search = get_search_index(df, prune=not is_partitioned())
+            results = search.search(query, note_ids=note_ids, limit=len(note_ids))
+        note_ids = [note_id for note_id, _ in results]
+
+    status_filter = NOTE_FILTERS[st.radio(
+        "Filter", list(NOTE_FILTERS), horizontal=True, key="note_filter", label_visibility="collapsed"
+    )]
+    if status_filter is not None:
+        note_ids = [n for n in note_ids if status_filter(index, n)]
+
+    if not note_ids:
+        st.caption("No matching notes")
+        return None
+
+    num_pages = -(-len(note_ids) // NOTE_PAGE_SIZE)
+    page = min(st.session_state.note_page, num_pages - 1)
+    window = note_ids[page * NOTE_PAGE_SIZE:(page + 1) * NOTE_PAGE_SIZE]
+
+    selected = st.selectbox(
         f"📝 Select Clinical Note — {username}",
-        note_ids
+        window,
+        format_func=lambda n: f"{n} {note_badges(index, n)}".rstrip()
     )
 
+    if num_pages > 1:
+        p1, p2, p3 = st.columns([1, 3, 1])
+        with p1:
+            if st.button("◀", disabled=page == 0, key="note_page_prev"):
+                st.session_state.note_page = page - 1
+                st.rerun()
+        with p2:
+            st.caption(f"Page {page + 1} / {num_pages} — {len(note_ids)} notes")
+        with p3:
+            if st.button("▶", disabled=page >= num_pages - 1, key="note_page_next"):
+                st.session_state.note_page = page + 1
+                st.rerun()
+
+    return selected
+
+
+def _use_synced_recording(rec: dict):
+    """Make a synced offline recording the one the Save button uploads"""
+    with open(rec["path"], "rb") as f:
+        handle = spool(f, rec["recording_id"], suffix=os.path.splitext(rec["path"])[1])
+    release(st.session_state.get("recorded_audio"))
+    st.session_state.recorded_audio = handle
+    st.session_state.recorded_audio_source = rec["recording_id"]
+    # Discarded from the ingest directory once saved
+    st.session_state.synced_recording = rec["recording_id"]
+
+
+@st.fragment(run_every=3)
+def render_sync_progress(token: str):
+    """Poll the ingest endpoint and list the recordings that have fully synced"""
+    from chunk_ingest import recordings_for, discard
+
+    recordings = recordings_for(token)
+    for rec in recordings:
+        if not rec["complete"]:
+            st.caption(
+                f"⏳ Syncing recording: {len(rec['received'])}/{rec['recorded']} chunks "
+                f"({rec['bytes'] / 1024:.0f} KB)"
+            )
 
-def render_audio_recorder():
+    complete = [rec for rec in recordings if rec["complete"]]
+    if not complete:
+        return
+    # A take that just finished syncing is selected; older ones wait for a choice
+    seen = st.session_state.setdefault("synced_takes_seen", set())
+    new = [rec for rec in complete if rec["recording_id"] not in seen]
+    seen.update(rec["recording_id"] for rec in new)
+    if new:
+        _use_synced_recording(new[-1])
+        st.rerun()
+
+    # Every take is kept until it is saved or the doctor discards it
+    selected = st.session_state.get("synced_recording")
+    for number, rec in enumerate(complete, start=1):
+        recording_id = rec["recording_id"]
+        c1, c2, c3 = st.columns([3, 1, 1])
+        recorded_at = time.strftime("%H:%M", time.localtime(os.path.getmtime(rec["path"])))
+        marker = "▶️" if recording_id == selected else "🎙️"
+        c1.caption(f"{marker} Take {number} · {recorded_at} · {rec['bytes'] / 1024:.0f} KB")
+        if c2.button("Use", key=f"use_take_{recording_id}", disabled=recording_id == selected):
+            _use_synced_recording(rec)
+            st.rerun()
+        if c3.button("🗑️", key=f"discard_take_{recording_id}"):
+            if recording_id == selected:
+                release(st.session_state.get("recorded_audio"))
+                st.session_state.recorded_audio = None
+                st.session_state.recorded_audio_source = None
+                st.session_state.synced_recording = None
+            discard(recording_id)
+            st.rerun()
+
+
+def render_offline_recorder(username: str):
+    """Render the IndexedDB-buffered recorder and its sync progress"""
+    from audio_recorder import audio_recorder_component
+    from chunk_ingest import credential_expiry, session_token, start_ingest_server, upload_credential
+    from config import CHUNK_INGEST_TOKEN_TTL_S
+
+    start_ingest_server()
+    token = session_token(username)
+    # Renewed well before it expires; a new credential reloads the component
+    issued = st.session_state.get("upload_credential")
+    if (issued is None or issued[0] != token
+            or credential_expiry(issued[1]) - time.time() < CHUNK_INGEST_TOKEN_TTL_S / 4):
+        issued = st.session_state.upload_credential = (token, upload_credential(token))
+    audio_recorder_component(token, issued[1])
+    render_sync_progress(token)
+    if st.session_state.get("recorded_audio"):
+        st.caption("🎙️ Recording ready to save")
+
+
+@metrics.timed("render.audio_recorder")
+def render_audio_recorder(username: str):
     """Render audio recording input"""
+    if OFFLINE_RECORDER:
+        render_offline_recorder(username)
+        return
+
     audio = st.audio_input("🎤 Record audio", key="audio_input")
 
-    if audio is not None:
-        st.session_state.recorded_audio = audio.getvalue()
+    # Spool each widget value once; reruns with the same recording copy nothing
+    source_id = audio.file_id if audio is not None else None
+    if source_id == st.session_state.get("recorded_audio_source"):
+        return
+
+    release(st.session_state.get("recorded_audio"))
+    st.session_state.recorded_audio = spool(audio, source_id) if audio is not None else None
+    st.session_state.recorded_audio_source = source_id
 
 
+def render_conflict_warning(what: str):
+    """Tell the doctor their save lost a race with another account"""
+    st.warning(
+        f"⚠️ This note was changed by another doctor since you opened it. "
+        f"Nothing was saved — review the note and click Save again to replace their {what}."
+    )
+
+
+def remember_note_version(note_id: str, version: int):
+    """
+    Record the row version of a note as displayed to the doctor
+    Saves compare against it, so it follows the newest version shown (or
+    saved by the doctor); an older frame never moves it back.
+    """
+    init_session_state()
+    versions = st.session_state.note_versions
+    if version > versions.get(note_id, -1):
+        versions[note_id] = version
+
+
+def get_audio_quality(recorded_audio: SpooledAudio):
+    """Quality stats for the current recording, computed once per recording"""
+    cached = st.session_state.get("audio_quality")
+    if cached is not None and cached[0] == recorded_audio.sha256:
+        return cached[1]
+    with metrics.span("audio_quality"):
+        stats = analyze_audio(recorded_audio.path)
+    st.session_state.audio_quality = (recorded_audio.sha256, stats)
+    return stats
+
+
+@metrics.timed("render.save_audio_button")
 def render_save_audio_button(selected_note_id: str, username: str, df):
     """Render save audio button and handle upload"""
     init_session_state()
 
     recorded_audio = st.session_state.get("recorded_audio")
+    quality = get_audio_quality(recorded_audio) if recorded_audio else None
+    issues = quality_issues(quality) if quality else []
+    if issues:
+        st.warning("⚠️ " + " · ".join(issues))
+        upload_anyway = st.checkbox("Save anyway", key="audio_save_anyway")
+    else:
+        upload_anyway = True
 
     if st.button("💾 Save Audio", use_container_width=True):
 
@@ -65,19 +278,40 @@ def render_save_audio_button(selected_note_id: str, username: str, df):
             st.warning("⚠️ No audio recorded")
             return
 
-        safe_doctor_name = safe_filename(username)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"audio/{safe_doctor_name}_{selected_note_id}_{timestamp}.wav"
+        if not upload_anyway:
+            st.warning("⚠️ Re-record, or tick \"Save anyway\" to keep this take")
+            return
 
         try:
-            _, link = upload_audio_file(filename, recorded_audio)
+            store = get_audio_store(os.path.splitext(recorded_audio.path)[1])
+            content_hash = store.put_file(recorded_audio.path, recorded_audio.sha256)
+            link = get_public_url(store.remote_key(content_hash))
+
+            result = update_audio_file(
+                df, selected_note_id, link, content_hash, quality,
+                expected_version=st.session_state.note_versions.get(selected_note_id)
+            )
+            st.session_state.note_versions[selected_note_id] = result.version
+            if not result.ok:
+                render_conflict_warning("audio")
+                return
 
-            update_audio_file(df, selected_note_id, link)
             save_data(df)
+            store.replicate(content_hash, username)
+            get_takes_log().append(
+                selected_note_id, "audio", store.remote_key(content_hash), content_hash,
+                recorded_audio.size, username, quality["duration_s"] if quality else None
+            )
 
             st.session_state.audio_saved_msg = link
             st.session_state.audio_saved_time = time.time()
+            release(recorded_audio)
             st.session_state.recorded_audio = None
+            synced = st.session_state.get("synced_recording")
+            if synced:
+                from chunk_ingest import discard
+                discard(synced)
+                st.session_state.synced_recording = None
 
             st.rerun()
 
@@ -98,38 +332,23 @@ def render_save_audio_button(selected_note_id: str, username: str, df):
             st.session_state.audio_saved_time = None
 
 
-def render_content_cards(sections: List[str]):
+@metrics.timed("render.content_cards")
+def render_content_cards(sections: Iterable[str]):
     """
     Render content cards
     Desktop: paginated 3 cards
     Mobile: all cards stacked (handled by CSS)
+    A generator of cards (a long note being laid out) is rendered as it goes.
     """
     init_session_state()
+    if not isinstance(sections, list):
+        _render_cards_progressively(sections)
+        return
     num_cards = len(sections)
 
     # Navigation controls - wrapped in a unique HTML element
     if num_cards > VISIBLE_CARDS:
-        # Use HTML comment to mark the navigation section
-        st.markdown('<!-- NAV_START -->', unsafe_allow_html=True)
-        
-        nav_col1, _, nav_col3 = st.columns([1, 6, 1])
-
-        with nav_col1:
-            st.markdown('<span class="nav-arrow-btn">', unsafe_allow_html=True)
-            if st.button("◀", disabled=st.session_state.card_offset == 0, key="nav_prev"):
-                st.session_state.card_offset -= 1
-                st.rerun()
-            st.markdown('</span>', unsafe_allow_html=True)
-
-        with nav_col3:
-            st.markdown('<span class="nav-arrow-btn">', unsafe_allow_html=True)
-            max_offset = num_cards - VISIBLE_CARDS
-            if st.button("▶", disabled=st.session_state.card_offset >= max_offset, key="nav_next"):
-                st.session_state.card_offset += 1
-                st.rerun()
-            st.markdown('</span>', unsafe_allow_html=True)
-        
-        st.markdown('<!-- NAV_END -->', unsafe_allow_html=True)
+        _render_card_navigation(num_cards)
 
     # Desktop paginated view
     start = st.session_state.card_offset
@@ -151,6 +370,59 @@ def render_content_cards(sections: List[str]):
         )
 
 
+def _render_cards_progressively(cards: Iterable[str]):
+    """Fill the visible cards as soon as each is laid out; navigation comes last"""
+    nav = st.empty()
+    start = st.session_state.card_offset
+    cols = st.columns(VISIBLE_CARDS)
+    mobile = st.container()
+
+    num_cards = 0
+    for i, section in enumerate(cards):
+        num_cards += 1
+        if start <= i < start + VISIBLE_CARDS:
+            with cols[i - start]:
+                st.markdown(
+                    f'<div class="note-section desktop-card">{section}</div>',
+                    unsafe_allow_html=True
+                )
+        with mobile:
+            st.markdown(
+                f'<div class="note-section mobile-card" style="display: none;">{section}</div>',
+                unsafe_allow_html=True
+            )
+
+    if num_cards > VISIBLE_CARDS:
+        with nav.container():
+            _render_card_navigation(num_cards)
+
+
+def _render_card_navigation(num_cards: int):
+    """Previous/next buttons for the desktop card window"""
+    # Use HTML comment to mark the navigation section
+    st.markdown('<!-- NAV_START -->', unsafe_allow_html=True)
+    
+    nav_col1, _, nav_col3 = st.columns([1, 6, 1])
+
+    with nav_col1:
+        st.markdown('<span class="nav-arrow-btn">', unsafe_allow_html=True)
+        if st.button("◀", disabled=st.session_state.card_offset == 0, key="nav_prev"):
+            st.session_state.card_offset -= 1
+            st.rerun()
+        st.markdown('</span>', unsafe_allow_html=True)
+
+    with nav_col3:
+        st.markdown('<span class="nav-arrow-btn">', unsafe_allow_html=True)
+        max_offset = num_cards - VISIBLE_CARDS
+        if st.button("▶", disabled=st.session_state.card_offset >= max_offset, key="nav_next"):
+            st.session_state.card_offset += 1
+            st.rerun()
+        st.markdown('</span>', unsafe_allow_html=True)
+    
+    st.markdown('<!-- NAV_END -->', unsafe_allow_html=True)
+
+
+@metrics.timed("render.additional_notes")
 def render_additional_notes(selected_note_id: str, username: str, df):
     """Render additional notes text area and save button"""
     init_session_state()
@@ -174,15 +446,27 @@ def render_additional_notes(selected_note_id: str, username: str, df):
                 st.warning("⚠️ Please enter some notes first")
                 return
 
-            safe_doctor_name = safe_filename(username)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"notes/{safe_doctor_name}_{selected_note_id}_notes_{timestamp}.txt"
-
             try:
-                _, link = upload_notes_file(filename, notes_text.encode("utf-8"))
+                store = get_notes_store()
+                notes_bytes = notes_text.encode("utf-8")
+                content_hash = store.put(notes_bytes)
+                link = get_public_url(store.remote_key(content_hash))
+
+                result = update_additional_notes(
+                    df, selected_note_id, link, content_hash,
+                    expected_version=st.session_state.note_versions.get(selected_note_id)
+                )
+                st.session_state.note_versions[selected_note_id] = result.version
+                if not result.ok:
+                    render_conflict_warning("notes")
+                    return
 
-                update_additional_notes(df, selected_note_id, link)
                 save_data(df)
+                store.replicate(content_hash, username)
+                get_takes_log().append(
+                    selected_note_id, "notes", store.remote_key(content_hash), content_hash,
+                    len(notes_bytes), username
+                )
 
                 st.session_state.notes_saved_msg = link
                 st.session_state.notes_saved_time = time.time()
@@ -204,4 +488,118 @@ def render_additional_notes(selected_note_id: str, username: str, df):
             st.rerun()
         else:
             st.session_state.notes_saved_msg = None
-            st.session_state.notes_saved_time = None
\ No newline at end of file
+            st.session_state.notes_saved_time = None
+
+@metrics.timed("render.validation_mode")
+def render_validation_mode(doctor_notes, username: str, df):
+    """Render progress summary and bulk validation table"""
+    index = get_note_index(df)
+    progress = index.progress(username)
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("📋 Assigned", progress["total"])
+    m2.metric("🎤 With audio", progress["audio"])
+    m3.metric("📝 With notes", progress["notes"])
+    m4.metric("✅ Validated", progress["validated"])
+
+    note_ids = doctor_notes["note_id"].tolist()
+    table = pd.DataFrame({
+        "note_id": note_ids,
+        "preview": [
+            text[:120].replace("\n", " ") for text in doctor_notes["raw_text"].fillna("").astype(str)
+        ],
+        "audio": [index.has("audio_file", n) for n in note_ids],
+        "notes": [index.has("additional_notes", n) for n in note_ids],
+        "validated": [index.has("validated", n) for n in note_ids],
+    })
+
+    edited = st.data_editor(
+        table,
+        disabled=["note_id", "preview", "audio", "notes"],
+        hide_index=True,
+        use_container_width=True,
+        key="validation_editor"
+    )
+
+    if st.button("✅ Apply validation", use_container_width=True):
+        changes = {
+            note_id: bool(new)
+            for note_id, old, new in zip(note_ids, table["validated"], edited["validated"])
+            if bool(old) != bool(new)
+        }
+        if not changes:
+            st.info("No changes to apply")
+            return
+
+        try:
+            updated = apply_validation(df, changes)
+            save_data(df)
+            # The doctor's own writes are not conflicts on their next save
+            for note_id in changes:
+                if note_id in st.session_state.note_versions:
+                    remember_note_version(note_id, int(get_note_by_id(df, note_id)["version"]))
+            st.toast(f"✅ {updated} note(s) updated")
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Save failed: {e}")
+
+
+@metrics.timed("render.admin_dashboard")
+def render_admin_dashboard():
+    """Render progress across all doctors from the materialized summary"""
+    from progress_summary import load_summary, rebuild
+    from config import DATA_PATH
+
+    summary = load_summary(DATA_PATH)
+    totals = summary["all"]
+
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("📋 Notes", totals["total"])
+    m2.metric("🎤 With audio", totals["audio"])
+    m3.metric("📝 With notes", totals["notes"])
+    m4.metric("✅ Validated", totals["validated"])
+    m5.metric("⏱️ Recorded minutes", f"{totals['audio_seconds'] / 60:.1f}")
+
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "doctor": doctor,
+                "assigned": counts["total"],
+                "audio": counts["audio"],
+                "notes": counts["notes"],
+                "validated": counts["validated"],
+                "minutes": round(counts["audio_seconds"] / 60, 1),
+            }
+            for doctor, counts in sorted(summary["doctors"].items())
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+
+    c1, c2 = st.columns([3, 1])
+    c1.caption(f"Updated {summary['updated_at']} · last full recount {summary['rebuilt_at']}")
+    if c2.button("🔄 Recount", use_container_width=True):
+        with st.spinner("Recounting all notes..."):
+            rebuild(DATA_PATH)
+        st.rerun()
+
+
+@metrics.timed("render.take_history")
+def render_take_history(selected_note_id: str):
+    """Render the saved audio and notes takes of a note, newest first"""
+    log = get_takes_log()
+    audio_takes = log.history(selected_note_id, "audio")
+    notes_takes = log.history(selected_note_id, "notes")
+    if not audio_takes and not notes_takes:
+        return
+
+    with st.expander(f"🕘 History — {len(audio_takes)} audio take(s), {len(notes_takes)} note(s)"):
+        for take in reversed(audio_takes):
+            duration = f"{take['duration_s']:.1f} s · " if take["duration_s"] else ""
+            latest = " · **latest**" if take is audio_takes[-1] else ""
+            st.markdown(
+                f"🎤 {take['created_at']} · {take['doctor']} · {duration}"
+                f"{take['size_bytes'] / 1024:.0f} KB{latest}"
+            )
+        for take in reversed(notes_takes):
+            st.markdown(f"📝 {take['created_at']} · {take['doctor']} · {take['size_bytes']} bytes")
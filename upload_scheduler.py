@@ -0,0 +1,159 @@
+"""
+Process-wide upload scheduler with fair queuing and rate limits
+
+Uploads from every session are queued here instead of each script thread
+posting on its own. A fixed pool of workers bounds concurrent uploads, jobs
+are dispatched round-robin across owners (doctors) so one doctor's burst
+cannot starve the others, and an optional token bucket caps the total byte
+rate. Queue depth, in-flight uploads and time spent queued are exported as
+metrics; past UPLOAD_MAX_QUEUED jobs, submissions are rejected so callers
+can retry later instead of piling up.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Optional
+
+import metrics
+from config import (
+    UPLOAD_MAX_CONCURRENT,
+    UPLOAD_BYTES_PER_SECOND,
+    UPLOAD_BURST_BYTES,
+    UPLOAD_MAX_QUEUED,
+)
+
+
+class UploadRejected(Exception):
+    """Raised when the upload queue is full"""
+
+
+class TokenBucket:
+    """Byte-rate limiter; a request larger than the burst borrows against future tokens"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float):
+        """Take amount tokens, sleeping until the bucket has paid them back"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            deficit = -self._tokens
+        if deficit > 0:
+            time.sleep(deficit / self.rate)
+
+
+class _Job:
+    __slots__ = ("fn", "args", "nbytes", "future", "queued_at")
+
+    def __init__(self, fn: Callable, args: tuple, nbytes: int):
+        self.fn = fn
+        self.args = args
+        self.nbytes = nbytes
+        self.future: Future = Future()
+        self.queued_at = time.monotonic()
+
+
+class UploadScheduler:
+    """Bounded worker pool fed round-robin from per-owner queues"""
+
+    def __init__(self, max_concurrent: int = UPLOAD_MAX_CONCURRENT,
+                 bytes_per_second: float = UPLOAD_BYTES_PER_SECOND,
+                 burst_bytes: float = UPLOAD_BURST_BYTES,
+                 max_queued: int = UPLOAD_MAX_QUEUED):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._bucket = TokenBucket(bytes_per_second, burst_bytes) if bytes_per_second else None
+        self._cond = threading.Condition()
+        # Owners in round-robin order; an owner is moved to the back after each dispatch
+        self._queues: "OrderedDict[str, Deque[_Job]]" = OrderedDict()
+        self._queued = 0
+        self._in_flight = 0
+        self._workers = []
+
+    def _publish(self):
+        metrics.set_gauge("upload.queue_depth", self._queued)
+        metrics.set_gauge("upload.in_flight", self._in_flight)
+        metrics.set_gauge("upload.queued_owners", len(self._queues))
+
+    def submit(self, owner: str, nbytes: int, fn: Callable, *args) -> Future:
+        """Queue fn(*args) as an upload of nbytes on behalf of owner"""
+        job = _Job(fn, args, nbytes)
+        with self._cond:
+            if self.max_queued and self._queued >= self.max_queued:
+                metrics.incr("upload.rejected")
+                raise UploadRejected(f"Upload queue full ({self._queued} waiting)")
+            self._queues.setdefault(owner, deque()).append(job)
+            self._queued += 1
+            self._publish()
+            if len(self._workers) < self.max_concurrent:
+                worker = threading.Thread(target=self._work, name=f"upload-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify()
+        return job.future
+
+    def run(self, owner: str, nbytes: int, fn: Callable, *args):
+        """Submit an upload and wait for its result"""
+        return self.submit(owner, nbytes, fn, *args).result()
+
+    def depth(self) -> int:
+        """Jobs waiting for a worker"""
+        return self._queued
+
+    def _next_job(self) -> _Job:
+        owner, jobs = next(iter(self._queues.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._queues.move_to_end(owner)
+        else:
+            del self._queues[owner]
+        self._queued -= 1
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                job = self._next_job()
+                self._in_flight += 1
+                self._publish()
+
+            if not job.future.set_running_or_notify_cancel():
+                with self._cond:
+                    self._in_flight -= 1
+                    self._publish()
+                continue
+
+            if self._bucket is not None:
+                self._bucket.consume(job.nbytes)
+            metrics.observe("upload.wait", time.monotonic() - job.queued_at)
+            try:
+                job.future.set_result(job.fn(*job.args))
+            except BaseException as e:
+                job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._publish()
+
+
+_scheduler: Optional[UploadScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_upload_scheduler() -> UploadScheduler:
+    """Process-wide scheduler used for all storage uploads"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UploadScheduler()
+        return _scheduler
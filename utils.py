@@ -1,10 +1,16 @@
 """
-Utility functions for the Clinical Notes Application - Supabase Version
+Utility functions for the Clinical Notes Application
 """
+import functools
 import re
 import os
-import requests
-from typing import Tuple
+import threading
+
+import metrics
+
+# requests is imported lazily so the login page does not pay for it
+_http_session = None
+_http_session_lock = threading.Lock()
 
 
 def safe_filename(name: str) -> str:
@@ -12,8 +18,9 @@ def safe_filename(name: str) -> str:
     return re.sub(r'[^\w\-_.]', '_', name)
 
 
+@functools.lru_cache(maxsize=None)
 def get_supabase_config():
-    """Get Supabase configuration from secrets or environment"""
+    """Get Supabase configuration from secrets or environment (read once per process)"""
     try:
         import streamlit as st
         url = st.secrets["supabase"]["SUPABASE_URL"]
@@ -34,39 +41,25 @@ def get_supabase_config():
         return url, key, bucket
 
 
-def upload_file_to_supabase(filename: str, file_bytes: bytes, 
-                            mimetype: str = 'audio/wav') -> Tuple[str, str]:
-    """
-    Upload file to Supabase Storage
-    Returns: (file_id, public_url)
-    """
-    url, key, bucket = get_supabase_config()
-    
-    upload_url = f"{url}/storage/v1/object/{bucket}/{filename}"
-    headers = {
-        "Authorization": f"Bearer {key}",
-        "Content-Type": mimetype,
-        "x-upsert": "true"
-    }
-    
-    response = requests.post(upload_url, headers=headers, data=file_bytes)
-    
-    if response.status_code not in [200, 201]:
-        raise Exception(f"Upload failed: {response.status_code} - {response.text}")
-    
-    public_url = f"{url}/storage/v1/object/public/{bucket}/{filename}"
-    
-    return filename, public_url
-
-
-def upload_audio_file(filename: str, file_bytes: bytes) -> Tuple[str, str]:
-    """Upload audio file to Supabase"""
-    return upload_file_to_supabase(filename, file_bytes, mimetype='audio/wav')
+def get_http_session():
+    """Get the process-wide HTTP session used for storage requests"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            from config import STORAGE_MAX_WORKERS
+            _http_session = requests.Session()
+            # One pooled connection per concurrent transfer (put_many/get_many)
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, STORAGE_MAX_WORKERS))
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+        return _http_session
 
 
-def upload_notes_file(filename: str, file_bytes: bytes) -> Tuple[str, str]:
-    """Upload text notes to Supabase"""
-    return upload_file_to_supabase(filename, file_bytes, mimetype='text/plain')
+def get_public_url(filename: str) -> str:
+    """Public URL of an object in the configured storage backend"""
+    from storage import get_storage
+    return get_storage().public_url(filename)
 
 
 def create_directories():
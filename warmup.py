@@ -0,0 +1,52 @@
+"""
+Background warm-up for the Clinical Notes Application
+
+The login page only needs auth and styles. Once it has rendered, the heavy
+modules (pandas, requests) and the shared objects behind them are loaded in a
+daemon thread so the first doctor to log in does not wait for them.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_started = False
+_lock = threading.Lock()
+_done = threading.Event()
+
+
+def _warm():
+    try:
+        import data_handler
+        import text_formatter  # noqa: F401
+        import ui_components  # noqa: F401
+        import utils
+
+        utils.get_http_session()
+        try:
+            import storage
+            storage.get_storage()
+        except Exception:
+            pass
+        # A partitioned dataset is loaded per doctor after login instead
+        if not data_handler.is_partitioned():
+            data_handler.load_data()
+    except Exception as e:
+        logger.warning(f"Background warm-up failed: {e}")
+    finally:
+        _done.set()
+
+
+def start_background_warmup():
+    """Start the warm-up thread once per process"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_warm, name="clinical-warmup", daemon=True).start()
+
+
+def wait_for_warmup(timeout: float = None) -> bool:
+    """Block until the warm-up has finished (used by benchmarks)"""
+    return _done.wait(timeout)